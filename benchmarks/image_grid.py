@@ -0,0 +1,101 @@
+"""
+Micro-benchmark of the image grid assembly used for samples, test and validation grids
+and by experiment.py.
+
+Compares the former per-image loops over float64 frames with image_utils.tile_images,
+which converts the images to uint8 once and places all of them with a single
+reshaped/transposed assignment, with and without a reused output buffer.
+
+    python -m benchmarks.image_grid [--repeats 200]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from config import size_image
+from image_utils import emotion_grid_layout, tile_images, to_uint8
+
+
+def loop_grid(batch_images, image_value_range=(-1, 1), size_frame=None):
+    # grid assembly of images_to_grid and save_batch_images before tile_images
+    images = (batch_images - image_value_range[0]) / (image_value_range[-1] - image_value_range[0])
+    if size_frame is None:
+        auto_size = int(np.ceil(np.sqrt(images.shape[0])))
+        size_frame = [auto_size, auto_size]
+    img_h, img_w = batch_images.shape[1], batch_images.shape[2]
+    frame = np.zeros([img_h * size_frame[0], img_w * size_frame[1], 3])
+    for ind, image in enumerate(images):
+        ind_col = ind % size_frame[1]
+        ind_row = ind // size_frame[1]
+        frame[(ind_row * img_h):(ind_row * img_h + img_h), (ind_col * img_w):(ind_col * img_w + img_w), :] = image
+    return (frame * 255).astype(np.uint8)
+
+
+def loop_emotion_grid(inp, generated_outp):
+    # grid assembly of experiment.save_generated_output before tile_images
+    black_image = np.zeros((1, size_image, size_image, 3))
+    black_image3 = np.tile(black_image, (3, 1, 1, 1))
+    final_image_list = np.concatenate([black_image3, generated_outp[:7],
+                                       black_image3, generated_outp[7:14],
+                                       black_image3, generated_outp[14:21],
+                                       black_image, inp, black_image, generated_outp[21:28],
+                                       black_image3, generated_outp[28:35],
+                                       black_image3, generated_outp[35:42],
+                                       black_image3, generated_outp[42:]])
+    final_image = np.zeros((size_image * 7, size_image * 10, 3))
+    for index, image in enumerate(final_image_list):
+        index_column = index % 10
+        index_row = index // 10
+        final_image[(index_row * size_image):((index_row + 1) * size_image),
+                    (index_column * size_image):((index_column + 1) * size_image)] = image
+    return ((final_image + 1) * 255 / 2).astype(np.uint8)
+
+
+def time_per_call(function, repeats):
+    function()
+    start_time = time.time()
+    for _ in range(repeats):
+        function()
+    return (time.time() - start_time) / repeats
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the image grid assembly')
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--batch_size', type=int, default=64)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    batch = rng.uniform(-1, 1, (args.batch_size, size_image, size_image, 3)).astype(np.float32)
+    inp = rng.uniform(-1, 1, (1, size_image, size_image, 3)).astype(np.float32)
+    generated = rng.uniform(-1, 1, (49, size_image, size_image, 3)).astype(np.float32)
+
+    layout = emotion_grid_layout()
+    emotion_out = np.empty((7 * size_image, 10 * size_image, 3), dtype=np.uint8)
+    size_frame = int(np.ceil(np.sqrt(args.batch_size)))
+    batch_out = np.empty((size_frame * size_image, size_frame * size_image, 3), dtype=np.uint8)
+
+    # both implementations have to produce the same emotion grid
+    expected = loop_emotion_grid(inp, generated).astype(np.int16)
+    actual = tile_images(to_uint8(np.concatenate([inp, generated])), layout=layout).astype(np.int16)
+    assert np.abs(expected - actual).max() <= 1, 'emotion grids differ'
+
+    cases = [
+        ('batch grid (%d images), loop' % args.batch_size,
+         lambda: loop_grid(batch)),
+        ('batch grid (%d images), tile_images' % args.batch_size,
+         lambda: tile_images(to_uint8(batch))),
+        ('batch grid (%d images), tile_images, reused buffer' % args.batch_size,
+         lambda: tile_images(to_uint8(batch), out=batch_out)),
+        ('emotion grid (1 + 49 images), loop',
+         lambda: loop_emotion_grid(inp, generated)),
+        ('emotion grid (1 + 49 images), tile_images',
+         lambda: tile_images(to_uint8(np.concatenate([inp, generated])), layout=layout)),
+        ('emotion grid (1 + 49 images), tile_images, reused buffer',
+         lambda: tile_images(to_uint8(np.concatenate([inp, generated])), layout=layout, out=emotion_out)),
+    ]
+
+    for name, function in cases:
+        print("%-60s %8.3f ms" % (name, time_per_call(function, args.repeats) * 1000))
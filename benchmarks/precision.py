@@ -0,0 +1,178 @@
+"""
+Comparison of mixed precision training with the float32 baseline.
+
+Trains the model from the same initialization on the same sequence of random batches
+once per compute dtype and reports the step time, the peak memory and how far the loss
+curves deviate from those of float32. Every dtype runs in its own process, so that the
+peak memory of one run does not include the others. The float32 run saves the initial
+values of its variables, and the other runs load them by name, since the half precision
+graphs hold additional ops and would draw different initial values from the same seed.
+
+    python -m benchmarks.precision [--dtypes float32,float16] [--steps 50] [--output precision.json]
+
+The peak memory is that of the GPU if the model runs on a GPU, otherwise the peak
+resident memory of the process. A dtype whose run fails (e.g. for lack of kernels on
+this machine) is reported as failed.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.suite import set_seeds
+from config import device_strategy, intra_op_threads, inter_op_threads, image_value_range, num_z_channels, \
+    size_batch, size_image
+from devices import CPU, session_config
+from model import Model
+from vgg_face import vgg_variables
+
+LOSSES = ['EG_loss', 'E_z_loss', 'D_z_loss_z', 'D_z_loss_prior', 'G_img_loss', 'D_img_loss_G', 'D_img_loss_input',
+          'vgg_loss']
+
+
+def initialize(session, init_path, seed):
+    """
+    Saves the initial values of all variables to init_path if it does not exist yet,
+    otherwise loads the variables saved there by name.
+
+    @param session: tensorflow session of the model graph
+    @param init_path: npz file of the initial values (string)
+    @param seed: random seed of the VGG face weights (int)
+    """
+    session.run(tf.global_variables_initializer())
+    if os.path.exists(init_path):
+        with np.load(init_path) as values:
+            for var in tf.global_variables():
+                # variables only some dtypes have (e.g. the loss scale) keep their initializer
+                if var.op.name in values:
+                    var.load(values[var.op.name], session)
+    else:
+        rng = np.random.RandomState(seed)
+        for var in vgg_variables():
+            var.load(rng.normal(0, 0.01, var.get_shape().as_list()).astype(np.float32), session)
+        np.savez(init_path, **dict((var.op.name, value) for var, value in
+                                   zip(tf.global_variables(), session.run(tf.global_variables()))))
+
+
+def train(dtype, steps, init_path, seed=0):
+    """
+    Trains steps steps with compute dtype dtype.
+
+    @param init_path: npz file of the initial values, written by the first run and loaded by the others (string)
+
+    @return: dictionary of the step times (sec), the peak memory (bytes) and the loss curves
+    """
+    rng = np.random.RandomState(seed + 1)
+    graph = tf.Graph()
+    with graph.as_default(), \
+            tf.Session(graph=graph, config=session_config(device_strategy, intra_op_threads, inter_op_threads)) as session:
+        set_seeds(seed)
+        model = Model(session, dtype=dtype)
+        model.build_training_ops()
+        on_gpu = model.device != CPU
+        if on_gpu:
+            with tf.device(model.device):
+                peak_memory = tf.contrib.memory_stats.MaxBytesInUse()
+        initialize(session, init_path, seed)
+
+        step_times = []
+        curves = dict((name, []) for name in LOSSES)
+        for _ in range(steps):
+            images = rng.uniform(-1, 1, (size_batch, size_image, size_image, 3)).astype(np.float32)
+            valence = rng.uniform(-1, 1, (size_batch, 1)).astype(np.float32)
+            arousal = rng.uniform(-1, 1, (size_batch, 1)).astype(np.float32)
+            z_prior = rng.uniform(image_value_range[0], image_value_range[-1],
+                                  (size_batch, num_z_channels)).astype(np.float32)
+            start_time = time.time()
+            results = model.train_step(images, valence, arousal, z_prior)
+            step_times.append(time.time() - start_time)
+            for name, value in zip(LOSSES, results[3:11]):
+                curves[name].append(float(value))
+
+        if on_gpu:
+            memory = int(session.run(peak_memory))
+        else:
+            # ru_maxrss is in kilobytes on Linux
+            memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return {'dtype': dtype, 'device': 'gpu' if on_gpu else 'cpu', 'step_times': step_times,
+            'peak_memory': memory, 'losses': curves}
+
+
+def relative_deviation(curve, reference):
+    """
+    @return: mean absolute difference of two loss curves relative to the mean of reference
+    """
+    curve, reference = np.asarray(curve), np.asarray(reference)
+    return float(np.mean(np.abs(curve - reference)) / max(np.mean(np.abs(reference)), 1e-12))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Mixed precision training compared with float32')
+    parser.add_argument('--dtypes', default='float32,float16')
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5, help='steps excluded from the step time')
+    parser.add_argument('--output', default='precision.json', help='JSON file to write the results to')
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--init', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # child process: train with one dtype and write its results to --output
+        with open(args.output, 'w') as f:
+            json.dump(train(args.run, args.steps, args.init), f)
+        sys.exit()
+
+    # float32 runs first and saves the initial values for the other dtypes
+    dtypes = ['float32'] + [dtype for dtype in args.dtypes.split(',') if dtype != 'float32']
+    results = {}
+    init_dir = tempfile.mkdtemp(prefix='precision_')
+    try:
+        for dtype in dtypes:
+            with tempfile.NamedTemporaryFile(suffix='.json') as output:
+                try:
+                    subprocess.check_call([sys.executable, '-m', 'benchmarks.precision', '--run', dtype,
+                                           '--steps', str(args.steps), '--output', output.name,
+                                           '--init', os.path.join(init_dir, 'init.npz')])
+                except subprocess.CalledProcessError as e:
+                    results[dtype] = {'dtype': dtype, 'error': 'training failed with exit status %d' % e.returncode}
+                    continue
+                with open(output.name) as f:
+                    results[dtype] = json.load(f)
+    finally:
+        shutil.rmtree(init_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    reference = results['float32']
+    if 'error' in reference:
+        print("\nfloat32 %s, nothing to compare with" % reference['error'])
+        sys.exit(1)
+    reference_time = np.median(reference['step_times'][args.warmup:])
+    print("\ndtype      step p50 (ms)  speedup  peak memory (MB)  loss deviation from float32 (%s)" % ', '.join(LOSSES))
+    for dtype in dtypes:
+        result = results[dtype]
+        if 'error' in result:
+            print("%-9s  %s" % (dtype, result['error']))
+            continue
+        step_time = np.median(result['step_times'][args.warmup:])
+        result['step_time_p50'] = float(step_time)
+        result['speedup'] = float(reference_time / step_time)
+        result['loss_deviation'] = dict((name, relative_deviation(result['losses'][name], reference['losses'][name]))
+                                        for name in LOSSES)
+        print("%-9s  %13.1f  %6.2fx  %16.1f  %s" % (
+            dtype, step_time * 1000, result['speedup'], result['peak_memory'] / 1e6,
+            '  '.join('%.3f' % result['loss_deviation'][name] for name in LOSSES)))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,292 @@
+"""
+Benchmark suite of the data loading, the networks, the training step and the inference.
+
+Builds the Model graph and runs every stage on synthetic data, so neither AffectNet nor
+the VGG face weights are needed: the training images are random JPEG files written to a
+temporary directory and the VGG face variables are filled with random weights. All
+random numbers are drawn with fixed seeds.
+
+For each stage, the suite reports images/sec and the latency percentiles of a call:
+
+- data_loading: decoding a training batch with input_pipeline.FileSource
+- encoder: encoding a training batch with the encoder alone
+- generator: generating a training batch with the generator alone
+- vgg_loss: forward and backward pass of the identity preserving loss on size_vgg_subset pairs
+- train_step: one update of encoder + generator and both discriminators
+- test_grid: the 49 label grid of one image, as saved by evaluation.save_test
+- experiment: experiment.apply_network_to_images_of_dir on a directory of images, including
+  loading the model from a checkpoint
+
+The results are written as JSON. Passing the JSON of an earlier commit with --compare
+prints the change of every stage and fails if a stage got slower than --tolerance.
+
+    python -m benchmarks.suite [--output benchmark.json] [--compare baseline.json] [--stages encoder,generator]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from config import image_value_range, num_z_channels, size_batch, size_image, size_vgg_subset, vgg_input_size, \
+    device_strategy, intra_op_threads, inter_op_threads, data_format
+from devices import session_config
+from evaluation import save_test
+from experiment import apply_network_to_images_of_dir
+from image_decode import load_images
+from inference import emotion_grid
+from input_pipeline import FileSource
+from manifest import build_manifest
+from model import Model
+from vgg_face import identity_loss, vgg_variables
+
+STAGES = ['data_loading', 'encoder', 'generator', 'vgg_loss', 'train_step', 'test_grid', 'experiment']
+
+
+def set_seeds(seed):
+    """
+    Seeds python, numpy and the graph level seed of tensorflow, which only applies to the
+    current default graph: call it inside graph.as_default() of the benchmarked graph.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.set_random_seed(seed)
+
+
+def write_synthetic_images(data_path, num_images, source_size=256, seed=0):
+    """
+    Writes random JPEG images named like the AffectNet images, with random labels.
+
+    @param data_path: directory to write the images to (string)
+    @param num_images: number of images (int)
+    @param source_size: width and height of the images before decoding (int)
+    @param seed: random seed (int)
+    """
+    rng = np.random.RandomState(seed)
+    for index in range(num_images):
+        # smooth random image, so that the JPEG is compressed like a photo
+        coarse = rng.randint(0, 256, (8, 8, 3)).astype(np.uint8)
+        image = Image.fromarray(coarse).resize((source_size, source_size), Image.BILINEAR)
+        name = '%06ds%ds%ds%d.jpg' % (index, rng.randint(0, 8), rng.randint(-1000, 1001), rng.randint(-1000, 1001))
+        image.save(os.path.join(data_path, name), quality=90)
+
+
+def measure(function, num_images, steps, warmup):
+    """
+    Calls function warmup times, then measures steps calls.
+
+    @param function: function without arguments
+    @param num_images: number of images processed by one call (int)
+
+    @return: dictionary of images/sec and latency statistics (sec)
+    """
+    for _ in range(warmup):
+        function()
+    latencies = []
+    for _ in range(steps):
+        start_time = time.time()
+        function()
+        latencies.append(time.time() - start_time)
+    latencies = np.asarray(latencies)
+    return {
+        'images_per_call': num_images,
+        'calls': steps,
+        'images_per_sec': num_images * steps / latencies.sum(),
+        'latency_mean': float(latencies.mean()),
+        'latency_p50': float(np.percentile(latencies, 50)),
+        'latency_p90': float(np.percentile(latencies, 90)),
+        'latency_p99': float(np.percentile(latencies, 99)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(stages, steps=20, warmup=3, seed=0, num_experiment_images=16, source_size=256, config=None):
+    """
+    Runs the given stages on synthetic data.
+
+    @param stages: names of the stages to run (list of strings, see STAGES)
+    @param steps: number of measured calls per stage (int)
+    @param warmup: number of calls before the measurement (int)
+    @param seed: random seed (int)
+    @param num_experiment_images: number of images of the experiment stage (int)
+    @param source_size: width and height of the synthetic image files (int)
+    @param config: (optional) tf.ConfigProto of the model session, defaults to the settings of config.py
+
+    @return: dictionary of the results of each stage
+    """
+    if config is None:
+        config = session_config(device_strategy, intra_op_threads, inter_op_threads)
+
+    rng = np.random.RandomState(seed)
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        data_path = os.path.join(work_dir, 'data')
+        os.makedirs(data_path)
+        write_synthetic_images(data_path, max(size_batch, num_experiment_images), source_size=source_size, seed=seed)
+        manifest = build_manifest(data_path)
+
+        if 'data_loading' in stages:
+            source = FileSource(manifest, image_size=size_image, image_value_range=image_value_range)
+            indices = np.arange(size_batch)
+            results['data_loading'] = measure(lambda: source.load(indices), size_batch, steps, warmup)
+            source.close()
+
+        images = load_images(manifest.paths[:size_batch], image_size=size_image, image_value_range=image_value_range)
+        valence = rng.uniform(-1, 1, (size_batch, 1)).astype(np.float32)
+        arousal = rng.uniform(-1, 1, (size_batch, 1)).astype(np.float32)
+        z_prior = rng.uniform(image_value_range[0], image_value_range[-1], (size_batch, num_z_channels)).astype(np.float32)
+
+        graph = tf.Graph()
+        with graph.as_default(), tf.Session(graph=graph, config=config) as session:
+            set_seeds(seed)
+            model = Model(session)
+            model.build_training_ops()
+            # the identity preserving loss on its own inputs, sharing the VGG variables of the model
+            vgg_real = tf.placeholder(tf.float32, [None, size_image, size_image, 3])
+            vgg_fake = tf.placeholder(tf.float32, [None, size_image, size_image, 3])
+            vgg_loss = identity_loss(vgg_real, vgg_fake, input_size=vgg_input_size)
+            vgg_gradient = tf.gradients(vgg_loss, vgg_fake)[0]
+            session.run(tf.global_variables_initializer())
+            for var in vgg_variables():
+                var.load(rng.normal(0, 0.01, var.get_shape().as_list()).astype(np.float32), session)
+
+            z = model.encode(images)
+            fake_images = model.generate(z, valence, arousal)
+
+            if 'encoder' in stages:
+                results['encoder'] = measure(lambda: model.encode(images), size_batch, steps, warmup)
+
+            if 'generator' in stages:
+                results['generator'] = measure(lambda: model.generate(z, valence, arousal), size_batch, steps, warmup)
+
+            if 'vgg_loss' in stages:
+                feed_dict = {vgg_real: images[:size_vgg_subset], vgg_fake: fake_images[:size_vgg_subset]}
+                results['vgg_loss'] = measure(lambda: session.run([vgg_loss, vgg_gradient], feed_dict=feed_dict),
+                                              min(size_vgg_subset, size_batch), steps, warmup)
+
+            if 'train_step' in stages:
+                results['train_step'] = measure(lambda: model.train_step(images, valence, arousal, z_prior),
+                                                size_batch, steps, warmup)
+
+            if 'test_grid' in stages:
+                test_dir = os.path.join(work_dir, 'test')
+                results['test_grid'] = measure(lambda: save_test(model, images, test_dir, 'test.png'),
+                                               len(emotion_grid()[0]), steps, warmup)
+
+            if 'experiment' in stages:
+                checkpoint_dir = os.path.join(work_dir, 'checkpoint')
+                os.makedirs(checkpoint_dir)
+                model.saver.save(session, os.path.join(checkpoint_dir, 'benchmark'))
+
+        if 'experiment' in stages:
+            experiment_path = os.path.join(work_dir, 'experiment') + os.sep
+            os.makedirs(experiment_path)
+            for name in sorted(os.listdir(data_path))[:num_experiment_images]:
+                shutil.copy(os.path.join(data_path, name), experiment_path)
+            output_path = os.path.join(work_dir, 'experiment_output') + os.sep
+
+            def run_experiment():
+                # the experiment skips images that are already in the output directory
+                shutil.rmtree(output_path, ignore_errors=True)
+                os.makedirs(output_path)
+                apply_network_to_images_of_dir(experiment_path, output_path, model_path=checkpoint_dir)
+
+            results['experiment'] = measure(run_experiment, num_experiment_images, max(steps // 5, 1), 1)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of images/sec of every stage against baseline.
+
+    @return: names of the stages that got slower by more than tolerance (fraction)
+    """
+    regressions = []
+    print("\n%-14s %14s %14s %8s" % ('stage', 'baseline', 'current', 'change'))
+    for stage, result in sorted(results.items()):
+        if stage not in baseline:
+            continue
+        before, after = baseline[stage]['images_per_sec'], result['images_per_sec']
+        change = after / before - 1
+        print("%-14s %14.1f %14.1f %+7.1f%%" % (stage, before, after, change * 100))
+        if change < -tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark suite on synthetic data')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma separated subset of %s' % ', '.join(STAGES))
+    parser.add_argument('--steps', type=int, default=20, help='measured calls per stage')
+    parser.add_argument('--warmup', type=int, default=3, help='calls per stage before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown per stage (fraction)')
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error('unknown stages: %s' % ', '.join(sorted(unknown)))
+
+    results = run_suite(stages, steps=args.steps, warmup=args.warmup, seed=args.seed)
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'gpu': tf.test.is_gpu_available(),
+        'seed': args.seed,
+        'config': {
+            'size_batch': size_batch,
+            'size_image': size_image,
+            'size_vgg_subset': size_vgg_subset,
+            'vgg_input_size': vgg_input_size,
+            'device_strategy': device_strategy,
+            'intra_op_threads': intra_op_threads,
+            'inter_op_threads': inter_op_threads,
+            'data_format': data_format,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print("\n%-14s %14s %10s %10s %10s" % ('stage', 'images/sec', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)'))
+    for stage in STAGES:
+        if stage in results:
+            result = results[stage]
+            print("%-14s %14.1f %10.1f %10.1f %10.1f" % (
+                stage, result['images_per_sec'],
+                result['latency_p50'] * 1000, result['latency_p90'] * 1000, result['latency_p99'] * 1000))
+    print("\nResults written to %s" % args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nSlower than %s by more than %d%%: %s" % (args.compare, args.tolerance * 100, ', '.join(regressions)))
+            sys.exit(1)
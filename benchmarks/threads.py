@@ -0,0 +1,79 @@
+"""
+Sweep of the tensorflow thread pool sizes on the CPU.
+
+Runs the encoder, generator and training step stages of benchmarks/suite.py for every
+combination of intra-op and inter-op threads and reports images/sec, to choose
+intra_op_threads and inter_op_threads in config.py for a CPU-only node.
+
+    python -m benchmarks.threads [--intra 0,8,16,32] [--inter 1,2,4] [--output threads.json]
+
+By default, the intra-op values are powers of two up to the number of logical cores and 0
+(tensorflow's default, one thread per logical core). The first session of a process fixes
+tensorflow's thread pools for the whole process, so every combination runs in its own process.
+"""
+import argparse
+import json
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.suite import run_suite
+from devices import session_config
+
+STAGES = ['encoder', 'generator', 'train_step']
+
+
+def default_intra_threads():
+    num_cores = multiprocessing.cpu_count()
+    values = [0]
+    threads = 1
+    while threads < num_cores:
+        values.append(threads)
+        threads *= 2
+    return values + [num_cores]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Sweep of the tensorflow thread pool sizes on the CPU')
+    parser.add_argument('--intra', default=None, help='comma separated intra-op thread counts')
+    parser.add_argument('--inter', default='1,2,4', help='comma separated inter-op thread counts')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--output', default='threads.json', help='JSON file to write the results to')
+    parser.add_argument('--run', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    stages = args.stages.split(',')
+
+    if args.run:
+        # child process: run the stages with the thread counts "intra,inter" and write the results to --output
+        intra, inter = [int(v) for v in args.run.split(',')]
+        config = session_config('cpu', intra_op_threads=intra, inter_op_threads=inter)
+        with open(args.output, 'w') as f:
+            json.dump(run_suite(stages, steps=args.steps, config=config), f)
+        sys.exit()
+
+    intra_values = [int(v) for v in args.intra.split(',')] if args.intra else default_intra_threads()
+    inter_values = [int(v) for v in args.inter.split(',')]
+
+    results = []
+    for intra in intra_values:
+        for inter in inter_values:
+            with tempfile.NamedTemporaryFile(suffix='.json') as output:
+                subprocess.check_call([sys.executable, '-m', 'benchmarks.threads', '--run', '%d,%d' % (intra, inter),
+                                       '--stages', args.stages, '--steps', str(args.steps), '--output', output.name])
+                with open(output.name) as f:
+                    stage_results = json.load(f)
+            results.append({'intra_op_threads': intra, 'inter_op_threads': inter, 'results': stage_results})
+            print("intra %3d  inter %3d  %s" % (intra, inter, '  '.join(
+                '%s %.1f images/sec' % (stage, stage_results[stage]['images_per_sec']) for stage in stages)))
+
+    with open(args.output, 'w') as f:
+        json.dump({'logical_cores': multiprocessing.cpu_count(), 'sweep': results}, f, indent=2)
+
+    print("\nFastest settings:")
+    for stage in stages:
+        best = max(results, key=lambda result: result['results'][stage]['images_per_sec'])
+        print("\t%-12s intra_op_threads = %d, inter_op_threads = %d (%.1f images/sec)" % (
+            stage, best['intra_op_threads'], best['inter_op_threads'], best['results'][stage]['images_per_sec']))
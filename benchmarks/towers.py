@@ -0,0 +1,102 @@
+"""
+Scaling of the data parallel training with the number of towers.
+
+Measures the training step with 1, 2, 4 and 8 towers on random data, each tower
+processing --tower_batch images (weak scaling, the global batch grows with the number of
+towers), and reports the speedup and the scaling efficiency relative to one tower:
+
+    efficiency = images/sec with N towers / (N * images/sec with one tower)
+
+The towers run on the GPUs, or on logical CPU devices with device_strategy = 'cpu' or
+without GPU. Towers beyond the number of GPUs are skipped. The first session of a process
+fixes tensorflow's thread pools, so every number of towers runs in its own process.
+
+    python -m benchmarks.towers [--towers 1,2,4,8] [--tower_batch 49] [--output towers.json]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.suite import measure, set_seeds
+from config import device_strategy, intra_op_threads, inter_op_threads, image_value_range, num_z_channels, \
+    size_batch, size_image
+from devices import CPU, num_gpus, resolve_device, session_config
+from model import Model
+from vgg_face import vgg_variables
+
+
+def benchmark_towers(num_towers, tower_batch, steps, warmup, seed=0):
+    """
+    @return: results of benchmarks.suite.measure for the training step with num_towers towers
+    """
+    rng = np.random.RandomState(seed)
+    batch = tower_batch * num_towers
+    images = rng.uniform(-1, 1, (batch, size_image, size_image, 3)).astype(np.float32)
+    valence = rng.uniform(-1, 1, (batch, 1)).astype(np.float32)
+    arousal = rng.uniform(-1, 1, (batch, 1)).astype(np.float32)
+    z_prior = rng.uniform(image_value_range[0], image_value_range[-1], (batch, num_z_channels)).astype(np.float32)
+
+    config = session_config(device_strategy, intra_op_threads, inter_op_threads, num_cpu_devices=num_towers)
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph, config=config) as session:
+        set_seeds(seed)
+        model = Model(session, towers=num_towers)
+        model.build_training_ops()
+        session.run(tf.global_variables_initializer())
+        for var in vgg_variables():
+            var.load(rng.normal(0, 0.01, var.get_shape().as_list()).astype(np.float32), session)
+        return measure(lambda: model.train_step(images, valence, arousal, z_prior), batch, steps, warmup)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Scaling of the data parallel training')
+    parser.add_argument('--towers', default='1,2,4,8', help='comma separated numbers of towers')
+    parser.add_argument('--tower_batch', type=int, default=size_batch, help='images per tower and step')
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--output', default='towers.json', help='JSON file to write the results to')
+    parser.add_argument('--run', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # child process: measure args.run towers and write the results to --output
+        with open(args.output, 'w') as f:
+            json.dump(benchmark_towers(args.run, args.tower_batch, args.steps, args.warmup), f)
+        sys.exit()
+
+    tower_counts = [int(n) for n in args.towers.split(',')]
+    on_gpu = resolve_device(device_strategy) != CPU
+    if on_gpu:
+        skipped = [n for n in tower_counts if n > num_gpus()]
+        if skipped:
+            print("Skipping %s towers, only %d GPUs" % (', '.join(str(n) for n in skipped), num_gpus()))
+        tower_counts = [n for n in tower_counts if n <= num_gpus()]
+    if 1 not in tower_counts:
+        tower_counts = [1] + tower_counts
+
+    results = {}
+    for n in tower_counts:
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            subprocess.check_call([sys.executable, '-m', 'benchmarks.towers', '--run', str(n),
+                                   '--tower_batch', str(args.tower_batch), '--steps', str(args.steps),
+                                   '--warmup', str(args.warmup), '--output', output.name])
+            with open(output.name) as f:
+                results[n] = json.load(f)
+    reference = results[1]['images_per_sec']
+
+    report = []
+    print("\ntowers  images/sec  step p50 (ms)  speedup  efficiency")
+    for n in tower_counts:
+        speedup = results[n]['images_per_sec'] / reference
+        report.append({'towers': n, 'speedup': speedup, 'efficiency': speedup / n, 'train_step': results[n]})
+        print("%6d  %10.1f  %13.1f  %6.2fx  %9.0f%%" % (
+            n, results[n]['images_per_sec'], results[n]['latency_p50'] * 1000, speedup, speedup / n * 100))
+
+    with open(args.output, 'w') as f:
+        json.dump({'device': 'gpu' if on_gpu else 'cpu', 'tower_batch': args.tower_batch, 'scaling': report}, f, indent=2)
@@ -0,0 +1,115 @@
+"""
+Benchmark of the identity preserving (VGG) loss at different VGG input sizes.
+
+For each input size, measures the time of a forward and backward pass of the loss and
+its FLOPs, and compares its values with those of the 224x224 loss on the same pairs of
+real and distorted images.
+
+    python -m benchmarks.vgg_loss [--weights ./utils/vgg-face.npz] [--images ./data/validation/]
+
+Without --weights, the VGG weights are random; without --images, smooth random images are
+used as real images.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import size_image, size_vgg_subset, image_value_range
+from image_decode import load_images
+from vgg_face import identity_loss, load_vgg_weights, vgg_variables, VGG_IMAGE_SIZE
+
+NOISE_LEVELS = [0.02, 0.05, 0.1, 0.2, 0.4]
+
+
+def random_faces(num_images, seed=0):
+    """
+    @return: smooth random images of shape [num_images, size_image, size_image, 3] in [-1, 1]
+    """
+    rng = np.random.RandomState(seed)
+    coarse = rng.uniform(-1, 1, (num_images, 6, 6, 3))
+    images = np.repeat(np.repeat(coarse, size_image // 6, axis=1), size_image // 6, axis=2)
+    return np.clip(images + rng.normal(0, 0.05, images.shape), -1, 1).astype(np.float32)
+
+
+def load_faces(path, num_images):
+    names = sorted(os.listdir(path))[:num_images]
+    return load_images([os.path.join(path, name) for name in names], image_size=size_image,
+                       image_value_range=image_value_range)
+
+
+def benchmark_input_size(input_size, real, fakes, weights_path, num_steps):
+    """
+    @return: dictionary with FLOPs, time per step (sec) and loss value for each noise level
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        real_tensor = tf.placeholder(tf.float32, [size_vgg_subset, size_image, size_image, 3])
+        fake_tensor = tf.placeholder(tf.float32, [size_vgg_subset, size_image, size_image, 3])
+        loss = identity_loss(real_tensor, fake_tensor, input_size=input_size)
+        gradient = tf.gradients(loss, fake_tensor)[0]
+
+        flops = tf.profiler.profile(
+            graph,
+            options=tf.profiler.ProfileOptionBuilder(tf.profiler.ProfileOptionBuilder.float_operation())
+            .with_empty_output().build()
+        ).total_float_ops
+
+        with tf.Session(graph=graph) as session:
+            if weights_path:
+                load_vgg_weights(session, weights_path)
+            else:
+                rng = np.random.RandomState(0)
+                for var in vgg_variables():
+                    var.load(rng.normal(0, 0.01, var.get_shape().as_list()), session)
+
+            feed_dict = {real_tensor: real, fake_tensor: fakes[0]}
+            for _ in range(2):
+                session.run([loss, gradient], feed_dict=feed_dict)
+            start_time = time.time()
+            for _ in range(num_steps):
+                session.run([loss, gradient], feed_dict=feed_dict)
+            step_time = (time.time() - start_time) / num_steps
+
+            losses = [session.run(loss, feed_dict={real_tensor: real, fake_tensor: fake}) for fake in fakes]
+
+    return {'flops': flops, 'step_time': step_time, 'losses': losses}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the VGG loss at different input sizes')
+    parser.add_argument('--weights', default=None, help='npz file of the VGG face weights')
+    parser.add_argument('--images', default=None, help='directory of real face images')
+    parser.add_argument('--sizes', default='224,160,128,%d' % size_image)
+    parser.add_argument('--steps', type=int, default=10)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    real = load_faces(args.images, size_vgg_subset) if args.images else random_faces(size_vgg_subset)
+    rng = np.random.RandomState(1)
+    fakes = [np.clip(real + rng.normal(0, level, real.shape), -1, 1).astype(np.float32) for level in NOISE_LEVELS]
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if VGG_IMAGE_SIZE not in sizes:
+        sizes = [VGG_IMAGE_SIZE] + sizes
+    results = dict((size, benchmark_input_size(size, real, fakes, args.weights, args.steps)) for size in sizes)
+    reference = results[VGG_IMAGE_SIZE]
+
+    print("\ninput size  GFLOPs  step time  speedup  loss ratio to 224 (noise %s)  correlation" %
+          ', '.join(str(level) for level in NOISE_LEVELS))
+    for size in sizes:
+        result = results[size]
+        ratios = np.asarray(result['losses']) / np.asarray(reference['losses'])
+        correlation = np.corrcoef(result['losses'], reference['losses'])[0, 1]
+        print("%10d  %6.1f  %7.1fms  %6.2fx  %s  %11.3f" % (
+            size,
+            result['flops'] / 1e9,
+            result['step_time'] * 1000,
+            reference['step_time'] / result['step_time'],
+            '  '.join('%.2f' % r for r in ratios),
+            correlation
+        ))
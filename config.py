@@ -1,6 +1,7 @@
 """
 NETWORK CONFIG FILE
 """
+import multiprocessing
 
 # training data directory
 training_data_path = "./data/train/"
@@ -8,8 +9,10 @@ training_data_path = "./data/train/"
 # validation data directory
 validation_data_path = "./data/train/"
 
-# path to pre-trained vgg face model weights
-vgg_face_path = './utils/vgg-face.mat'
+# path to pre-trained vgg face model weights (layers up to conv5_2),
+# converted from the MatConvNet file by running vgg_face.py
+vgg_face_path = './utils/vgg-face.npz'
+vgg_face_mat_path = './utils/vgg-face.mat'
 
 # batch size
 size_batch=49	
@@ -26,3 +29,94 @@ save_dir='./save'
 # value range of single pixels in an input image
 image_value_range = (-1, 1) 
 
+# shuffle the training data at the beginning of each epoch
+enable_shuffle = True
+
+# number of threads decoding training images in the background
+num_loader_threads = 8
+
+# number of batches the input pipeline prepares ahead of the training step
+prefetch_batches = 4
+
+# train on the compiled (resized, memory-mapped) training data instead of the image files,
+# the data sets are compiled to the directories below by running dataset_cache.py
+use_dataset_cache = False
+training_cache_dir = './data/train_cache/'
+validation_cache_dir = './data/validation_cache/'
+
+# number of images of each batch used for the identity preserving (VGG) loss
+size_vgg_subset = 16
+
+# width and height of the images in the VGG network of the identity preserving loss,
+# 224 is the input size of the VGG face model, size_image runs it at native resolution
+vgg_input_size = 224
+
+# number of training steps between two tensorboard summaries of the losses and
+# between two summaries of the (more expensive) histograms
+summary_interval = 10
+histogram_interval = 100
+
+# sampling, testing and validation run in the background: maximal number of queued
+# evaluation jobs and number of threads saving the resulting images
+max_pending_evaluations = 2
+num_writer_threads = 4
+
+# number of validation images whose emotion grids are generated in one run
+validation_images_per_run = 8
+
+# number of training steps between two records of the stage timings in save_dir/metrics.jsonl,
+# each record holds the statistics of the last metrics_window steps of each stage
+metrics_interval = 50
+metrics_window = 100
+
+# log of the training, written from a background thread: the log file is rotated when it
+# exceeds log_max_bytes and log_backup_count rotated files are kept, the losses of each
+# step are written to the file but printed to the console only every log_console_interval steps
+log_file = 'logfile.txt'
+log_level = 'INFO'
+log_max_bytes = 10 * 1024 * 1024
+log_backup_count = 5
+log_console_interval = 10
+
+# device of the networks: 'gpu' (the first GPU), 'cpu' (hides all GPUs) or 'auto' (the first
+# GPU if there is one, otherwise the CPU)
+device_strategy = 'auto'
+
+# sizes of the tensorflow thread pools; intra-op threads parallelize a single op (e.g. a
+# convolution), inter-op threads run independent ops concurrently. The defaults are one
+# intra-op thread per physical core (assuming two hardware threads per core) and two
+# inter-op threads, 0 lets tensorflow use one thread per logical core for each pool;
+# see README.md and benchmarks/threads.py to tune them for a CPU-only node
+intra_op_threads = max(multiprocessing.cpu_count() // 2, 1)
+inter_op_threads = 2
+
+# layout of the convolutions: 'NHWC' (the fastest layout on CPU, and the only one most
+# CPU kernels support) or 'NCHW' (faster with cuDNN on GPU)
+data_format = 'NHWC'
+
+# log the device of every op when the graph is built
+log_device_placement = False
+
+# number of data parallel towers, each batch of size_batch images is split between them;
+# the towers run on the first num_towers GPUs, or on as many logical CPU devices, which share
+# one intra-op thread pool (inter_op_threads is raised to num_towers for them)
+num_towers = 1
+
+# mixed precision training: the networks compute in 'float16' with float32
+# master weights (batch normalization and losses stay float32), 'float32' turns it off;
+# the float16 losses are scaled by loss_scale, 'dynamic' adapts the scale during training
+compute_dtype = 'float32'
+loss_scale = 'dynamic'
+
+# local inference server (server.py): address, maximal number of generated images of a
+# batch and maximal time (sec) a batch waits for further requests after its first one
+server_host = '127.0.0.1'
+server_port = 8000
+server_max_batch_images = 196
+server_max_latency = 0.01
+
+# cache of the encoder outputs z by image content (latent_cache.py) in experiment.py and
+# server.py: maximal number of codes in memory, and directory persisting the codes of
+# each model across runs (None keeps them in memory only)
+latent_cache_size = 10000
+latent_cache_dir = None
@@ -0,0 +1,121 @@
+"""
+Preprocessed, memory-mapped copies of the training and validation data.
+
+compile_dataset() decodes every image of a data directory once, resizes it to
+size_image and writes all images into a single uint8 array on disk, together with a
+parallel array of labels and the image ids of the manifest. DatasetCache reads training batches directly from the
+memory-mapped array, so no image has to be decoded during training and several
+training jobs share the cached pages of the file.
+
+Run this script to compile the training and validation data set in config.py.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import *
+from image_decode import decode_images, uint8_to_range
+from manifest import load_manifest
+
+IMAGES_FILE = 'images.npy'
+LABELS_FILE = 'labels.npy'
+CATEGORIES_FILE = 'categories.npy'
+NAMES_FILE = 'names.npy'
+IDS_FILE = 'ids.npy'
+
+
+def compile_dataset(data_path, cache_dir, image_size=96, num_threads=8):
+    """
+    Decodes and resizes all images of the manifest of data_path and saves them to cache_dir.
+
+    @param data_path: directory of the images (string)
+    @param cache_dir: directory to save the compiled data set to (string)
+    @param image_size: width and height of the saved images (int)
+    @param num_threads: number of decoding threads (int)
+
+    @return: number of compiled images
+    """
+    manifest = load_manifest(data_path)
+    paths = manifest.paths
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    images = np.lib.format.open_memmap(
+        os.path.join(cache_dir, IMAGES_FILE),
+        mode='w+',
+        dtype=np.uint8,
+        shape=(len(manifest), image_size, image_size, 3)
+    )
+
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        decode_images(paths, image_size=image_size, pool=pool, out=images)
+    images.flush()
+    del images
+
+    np.save(os.path.join(cache_dir, LABELS_FILE), np.concatenate([manifest.valence, manifest.arousal], axis=1))
+    np.save(os.path.join(cache_dir, CATEGORIES_FILE), manifest.categories)
+    np.save(os.path.join(cache_dir, NAMES_FILE), manifest.names)
+    np.save(os.path.join(cache_dir, IDS_FILE), manifest.ids)
+    return len(manifest)
+
+
+def cache_exists(cache_dir):
+    """
+    @param cache_dir: directory of a compiled data set (string)
+
+    @return: True if all files of a compiled data set exist in cache_dir
+    """
+    return all(os.path.exists(os.path.join(cache_dir, f))
+               for f in [IMAGES_FILE, LABELS_FILE, CATEGORIES_FILE, NAMES_FILE, IDS_FILE])
+
+
+class DatasetCache(object):
+    """
+    Input source reading samples of a compiled data set from the memory-mapped image array.
+    """
+    def __init__(self, cache_dir, image_value_range=(-1, 1), indices=None):
+        """
+        @param cache_dir: directory of a compiled data set (string)
+        @param image_value_range: pixel value range of the returned images
+        @param indices: (optional) rows of the data set making up this source, may contain
+                        duplicates (e.g. for balancing the categories)
+        """
+        self.images = np.load(os.path.join(cache_dir, IMAGES_FILE), mmap_mode='r')
+        self.labels = np.load(os.path.join(cache_dir, LABELS_FILE))
+        self.categories = np.load(os.path.join(cache_dir, CATEGORIES_FILE))
+        self.names = np.load(os.path.join(cache_dir, NAMES_FILE))
+        self.image_value_range = image_value_range
+        self.indices = np.arange(len(self.labels)) if indices is None else np.asarray(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def load(self, indices):
+        """
+        @param indices: indices of the samples to load
+
+        @return: images [n, size, size, 3], valence [n, 1], arousal [n, 1]
+        """
+        rows = self.indices[indices]
+        # read the rows in file order, then restore the requested order
+        order = np.argsort(rows)
+        images = np.empty((len(rows),) + self.images.shape[1:], dtype=np.uint8)
+        images[order] = self.images[rows[order]]
+
+        labels = self.labels[rows]
+        return uint8_to_range(images, self.image_value_range), labels[:, :1], labels[:, 1:]
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+
+    for data_path, cache_dir in [(training_data_path, training_cache_dir),
+                                 (validation_data_path, validation_cache_dir)]:
+        start_time = time.time()
+        num_images = compile_dataset(data_path, cache_dir, image_size=size_image, num_threads=num_loader_threads)
+        print("Compiled %d images from %s to %s in %.1fs" % (num_images, data_path, cache_dir, time.time() - start_time))
@@ -0,0 +1,92 @@
+"""
+Device placement and session configuration.
+
+The networks are placed on the device of the device strategy in config.py: 'gpu' (the
+first GPU), 'cpu' or 'auto' (the first GPU if there is one, otherwise the CPU).
+session_config() creates the matching tf.ConfigProto with the thread pool sizes.
+"""
+import tensorflow as tf
+from tensorflow.python.client import device_lib
+
+CPU = '/device:CPU:0'
+GPU = '/device:GPU:0'
+
+DEVICE_STRATEGIES = ['auto', 'cpu', 'gpu']
+DATA_FORMATS = ['NHWC', 'NCHW']
+
+_num_gpus = None
+
+
+def num_gpus():
+    """
+    @return: number of GPUs tensorflow finds (int)
+    """
+    global _num_gpus
+    if _num_gpus is None:
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        _num_gpus = sum(device.device_type == 'GPU' for device in device_lib.list_local_devices(config))
+    return _num_gpus
+
+
+def gpu_available():
+    """
+    @return: True if tensorflow finds a GPU (bool)
+    """
+    return num_gpus() > 0
+
+
+def resolve_device(strategy='auto'):
+    """
+    @param strategy: 'auto', 'cpu' or 'gpu'
+
+    @return: name of the device to place the networks on (string)
+    """
+    if strategy not in DEVICE_STRATEGIES:
+        raise ValueError("Unknown device strategy '%s', expected one of %s" % (strategy, ', '.join(DEVICE_STRATEGIES)))
+    if strategy == 'cpu':
+        return CPU
+    if strategy == 'gpu':
+        return GPU
+    return GPU if gpu_available() else CPU
+
+
+def check_data_format(data_format, device):
+    """
+    Raises a ValueError if the convolutions of data_format cannot run on device.
+
+    @param data_format: 'NHWC' or 'NCHW'
+    @param device: name of the device (string)
+    """
+    if data_format not in DATA_FORMATS:
+        raise ValueError("Unknown data format '%s', expected one of %s" % (data_format, ', '.join(DATA_FORMATS)))
+    if data_format == 'NCHW' and device == CPU:
+        raise ValueError("The NCHW data format needs a GPU, use data_format = 'NHWC' on the CPU")
+
+
+def session_config(strategy='auto', intra_op_threads=0, inter_op_threads=0, log_placement=False, num_cpu_devices=1):
+    """
+    @param strategy: device strategy, 'auto', 'cpu' or 'gpu'
+    @param intra_op_threads: threads parallelizing a single op, 0 for one per logical core (int)
+    @param inter_op_threads: threads running independent ops concurrently, 0 for one per logical core,
+                             raised to num_cpu_devices if it is smaller (int)
+    @param log_placement: log the device of every op (bool)
+    @param num_cpu_devices: number of CPU devices, e.g. for data parallel towers on the CPU (int)
+
+    @return: tf.ConfigProto
+    """
+    if num_cpu_devices > 1 and 0 < inter_op_threads < num_cpu_devices:
+        # all CPU devices share one intra-op pool, only the inter-op pool runs their ops concurrently
+        inter_op_threads = num_cpu_devices
+    config = tf.ConfigProto(
+        # ops without kernel on the chosen device (e.g. summaries) fall back to the CPU
+        allow_soft_placement=True,
+        log_device_placement=log_placement,
+        intra_op_parallelism_threads=intra_op_threads,
+        inter_op_parallelism_threads=inter_op_threads
+    )
+    if strategy == 'cpu':
+        config.device_count['GPU'] = 0
+    if num_cpu_devices > 1:
+        config.device_count['CPU'] = num_cpu_devices
+    return config
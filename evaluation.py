@@ -0,0 +1,248 @@
+"""
+Sampling, testing and validation of the model during training.
+
+The functions save_samples, save_test and save_validation work with any model providing
+encode() and generate(), i.e. model.Model or inference.InferenceModel, and optionally
+hand the PNG encoding to a thread pool.
+
+The validation images are decoded once into a ValidationSet, which is kept in memory
+across epochs.
+
+AsyncEvaluator runs these jobs on a background thread, so that the training loop does
+not wait for them. Each job works on a snapshot of the encoder and generator weights,
+taken when the job is submitted, in a separate inference graph and session.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from config import image_value_range, size_image
+from dataset_cache import IDS_FILE, IMAGES_FILE
+from image_decode import decode_images, uint8_to_range
+from image_utils import save_batch_images, save_output
+from inference import InferenceModel, build_inference_graph, emotion_grid
+
+log = logging.getLogger(__name__)
+
+
+def _save(writer, function, **kwargs):
+    # save on the writer pool if there is one
+    if writer is None:
+        function(**kwargs)
+    else:
+        writer.submit(function, **kwargs)
+
+
+def _make_dir(path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+
+def save_samples(model, images, valence, arousal, sample_dir, name, writer=None):
+    """
+    Reconstructs images with the given labels and saves them and the input images as grids.
+
+    @param model: model providing encode() and generate()
+    @param images: numpy array of shape [n, size_image, size_image, 3]
+    @param valence: numpy array of shape [n, 1]
+    @param arousal: numpy array of shape [n, 1]
+    @param sample_dir: directory to save the grids to (string)
+    @param name: file name of the grid (string)
+    @param writer: (optional) thread pool saving the grids
+    """
+    _make_dir(sample_dir)
+    G = model.generate(model.encode(images), valence, arousal)
+    size_frame = int(np.ceil(np.sqrt(len(images))))
+    _save(writer, save_batch_images,
+          batch_images=G,
+          save_path=os.path.join(sample_dir, name),
+          image_value_range=image_value_range,
+          size_frame=[size_frame, size_frame])
+    _save(writer, save_batch_images,
+          batch_images=images,
+          save_path=os.path.join(sample_dir, "input.png"),
+          image_value_range=image_value_range,
+          size_frame=[size_frame, size_frame])
+
+
+def save_test(model, images, test_dir, name, writer=None):
+    """
+    Generates the first image for the 49 labels of the emotion grid and saves the grid.
+
+    @param model: model providing encode() and generate()
+    @param images: numpy array of shape [n, size_image, size_image, 3]
+    @param test_dir: directory to save the grid to (string)
+    @param name: file name of the grid (string)
+    @param writer: (optional) thread pool saving the grid
+    """
+    _make_dir(test_dir)
+    images = images[:1, :, :, :]
+
+    valence, arousal = emotion_grid()
+
+    # encode once, generate for all 49 labels
+    z = model.encode(images)
+    G = model.generate(np.repeat(z, len(valence), axis=0), valence, arousal)
+
+    _save(writer, save_output,
+          input_image=images,
+          output=G,
+          path=os.path.join(test_dir, name),
+          image_value_range=image_value_range,
+          size_frame=[7, 10])
+
+
+class ValidationSet(object):
+    """
+    Validation images, decoded once on first use and kept in memory as uint8.
+    """
+    def __init__(self, ids, paths=None, images=None, num_threads=8):
+        """
+        @param ids: image ids, used as file names of the grids
+        @param paths: (optional) paths of the images, decoded on first use
+        @param images: (optional) uint8 numpy array of the decoded images
+        @param num_threads: number of decoding threads (int)
+        """
+        self.ids = list(ids)
+        self.paths = paths
+        self._images = images
+        self.num_threads = num_threads
+
+    @classmethod
+    def from_manifest(cls, manifest, num_threads=8):
+        """
+        @param manifest: manifest.Manifest of the validation data
+        """
+        return cls(manifest.ids, paths=manifest.paths, num_threads=num_threads)
+
+    @classmethod
+    def from_cache(cls, cache_dir):
+        """
+        @param cache_dir: directory of the validation data compiled by dataset_cache.py (string)
+        """
+        ids = np.load(os.path.join(cache_dir, IDS_FILE))
+        images = np.load(os.path.join(cache_dir, IMAGES_FILE))
+        return cls([str(image_id) for image_id in ids], images=images)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def images(self):
+        if self._images is None:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+                self._images = decode_images(self.paths, image_size=size_image, pool=pool)
+        return self._images
+
+
+def save_validation(model, validation_set, validation_dir, images_per_run=8, writer=None):
+    """
+    Saves the emotion grid of every image of the validation data.
+
+    The images are processed images_per_run at a time: they are encoded in one run and
+    their 49 labels each are generated in one run.
+
+    @param model: model providing encode() and generate()
+    @param validation_set: ValidationSet of the validation data
+    @param validation_dir: directory to save the grids to (string)
+    @param images_per_run: number of validation images per run (int)
+    @param writer: (optional) thread pool saving the grids
+    """
+    _make_dir(validation_dir)
+    valence, arousal = emotion_grid()
+    num_labels = len(valence)
+
+    for start in range(0, len(validation_set), images_per_run):
+        images = uint8_to_range(validation_set.images[start:start + images_per_run], image_value_range)
+        ids = validation_set.ids[start:start + images_per_run]
+
+        z = model.encode(images)
+        G = model.generate(np.repeat(z, num_labels, axis=0),
+                           np.tile(valence, (len(images), 1)),
+                           np.tile(arousal, (len(images), 1)))
+
+        for k, image_id in enumerate(ids):
+            _save(writer, save_output,
+                  input_image=images[k:k + 1],
+                  output=G[k * num_labels:(k + 1) * num_labels],
+                  path=os.path.join(validation_dir, image_id + ".png"),
+                  image_value_range=image_value_range,
+                  size_frame=[7, 10])
+
+
+class AsyncEvaluator(object):
+    """
+    Runs evaluation jobs with snapshots of the encoder and generator weights on a background thread.
+    """
+    def __init__(self, session, max_pending=2, num_writers=4, config=None):
+        """
+        @param session: training session holding the encoder and generator variables
+        @param max_pending: maximal number of jobs waiting to be run (int)
+        @param num_writers: number of threads encoding and saving PNGs (int)
+        @param config: (optional) tf.ConfigProto of the evaluation session
+        """
+        self.train_session = session
+
+        # inference graph with its own copy of the encoder and generator variables
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            build_inference_graph()
+            self.variables = tf.global_variables()
+        train_variables = dict((var.name, var) for var in session.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES))
+        self.train_variables = [train_variables[var.name] for var in self.variables]
+        self.model = InferenceModel(tf.Session(graph=self.graph, config=config), self.graph)
+
+        self.writer = ThreadPoolExecutor(max_workers=num_writers)
+        self.dropped_jobs = 0
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='evaluator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                self._jobs.task_done()
+                return
+            weights, function, kwargs = item
+            # a failing job, including the restore of its snapshot, must not stop the thread,
+            # otherwise submit(block=True) and close() would wait forever
+            try:
+                for var, value in zip(self.variables, weights):
+                    var.load(value, self.model.session)
+                function(self.model, writer=self.writer, **kwargs)
+            except Exception as e:
+                log.exception("Evaluation job %s failed: %s", function.__name__, e)
+            finally:
+                self._jobs.task_done()
+
+    def submit(self, function, block=False, **kwargs):
+        """
+        Takes a snapshot of the current weights and queues function(model, writer=..., **kwargs).
+
+        @param function: save_samples, save_test, save_validation or similar
+        @param block: wait for a free slot if max_pending jobs are queued, otherwise drop the job (bool)
+
+        @return: True if the job was queued
+        """
+        if not block and self._jobs.full():
+            self.dropped_jobs += 1
+            return False
+        weights = self.train_session.run(self.train_variables)
+        self._jobs.put((weights, function, kwargs))
+        return True
+
+    def close(self):
+        """
+        Waits for all queued jobs and writes.
+        """
+        self._jobs.put(None)
+        self._thread.join()
+        self.writer.shutdown()
+        self.model.session.close()
@@ -2,25 +2,22 @@
 Script for performing the qualitative analysis.
 """
 from PIL import Image
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import tensorflow as tf
+
+from config import image_value_range, size_image, device_strategy, intra_op_threads, inter_op_threads, \
+    latent_cache_size, latent_cache_dir
+from devices import session_config
+from image_decode import load_images
+from image_utils import emotion_grid_layout, tile_images, to_uint8
+from inference import load_inference_model, emotion_grid
+from latent_cache import LatentCache, content_key, model_id
 
 # --------------------------------------------------------------------
 # -HELPERS------------------------------------------------------------
 # --------------------------------------------------------------------
-def normalize_image(img, maximum):
-    """
-    Normalizes all pixels to values between 0 and maximum.
-
-    @param img: numpy array
-    @param maximum: scalar value
-
-    @return numpy array of same size as img
-    """
-    img /= img.max() / maximum
-    return img
-
 def save_image(img_array, path):
     """
     Saves an image from a three-dimensional numpy array under path.
@@ -54,12 +51,8 @@ def get_generated_images(path, p=96):
     @return: numpy array of shape 49x96x96x3
     """
     img = get_image_array(path)
-    res = []
-    for r in range(7):
-        for c in range(7):
-            single_image = img[r * p:(r + 1) * p, p * (c + 3):p * (c + 4)]
-            res.append(single_image)
-    return np.asarray(res)
+    grid = img[:7 * p, 3 * p:10 * p]
+    return grid.reshape((7, p, 7, p) + grid.shape[2:]).swapaxes(1, 2).reshape((49, p, p) + grid.shape[2:])
 
 
 def tile_to_square(images):
@@ -70,41 +63,20 @@ def tile_to_square(images):
 
     @return: numpy array of shape 672x672
     """
-    # Build final image from components
-    frame = np.zeros([96 * 7, 96 * 7])
-    for index, image in enumerate(images):
-        index_column = index % 7
-        index_row = index // 7
-        frame[(index_row * 96):((index_row + 1) * 96), (index_column * 96):((index_column + 1) * 96)] = image
-    return frame
+    return tile_images(images, size_frame=[7, 7])
 
 
-def save_generated_output(inp, generated_outp, path):
+def save_generated_output(inp, generated_outp, path, out=None):
     """
     Save the output generated by the network.
+
+    @param inp: input image, numpy array of shape 1x96x96x3 in [-1, 1]
+    @param generated_outp: generated images, numpy array of shape 49x96x96x3 in [-1, 1]
+    @param path: string
+    @param out: (optional) uint8 numpy array of shape 672x960x3 to assemble the image in
     """
-    # Tile black background
-    black_image = np.zeros((1, 96, 96, 3))
-    black_image3 = np.tile(black_image, (3, 1, 1, 1))
-
-    # Build final image from components
-    final_image_list = np.concatenate([black_image3, generated_outp[:7],
-                                       black_image3, generated_outp[7:14],
-                                       black_image3, generated_outp[14:21],
-                                       black_image, inp, black_image, generated_outp[21:28],
-                                       black_image3, generated_outp[28:35],
-                                       black_image3, generated_outp[35:42],
-                                       black_image3, generated_outp[42:]])
-
-    # Transform into savable format
-    final_image = np.zeros((96 * 7, 96 * 10, 3))
-    for index, image in enumerate(final_image_list):
-        index_column = index % 10
-        index_row = index // 10
-        final_image[(index_row * 96):((index_row + 1) * 96), (index_column * 96):((index_column + 1) * 96)] = image
-
-    # Normalize + save image
-    save_image((final_image + 1) * 255 / 2, path)
+    images = to_uint8(np.concatenate([inp[:1], generated_outp]))
+    save_image(tile_images(images, layout=emotion_grid_layout(), out=out), path)
 
 
 def load_image_as_network_input(image_path):
@@ -115,61 +87,89 @@ def load_image_as_network_input(image_path):
 
     @return: numpy array of size 96x96x3
     """
-    image = get_image_array(image_path, image_size=(96, 96))
-    image = normalize_image(image, 2)
-    return image - 1
+    return load_images([image_path], image_size=size_image, image_value_range=image_value_range)[0]
 
 
 # --------------------------------------------------------------------
 # -MAIN METHODS-------------------------------------------------------
 # --------------------------------------------------------------------
-def apply_network_to_images_of_dir(path_to_dir, path_to_out_dir):
+def apply_network_to_images_of_dir(path_to_dir, path_to_out_dir, model_path='./checkpoint', batch_size=16, num_threads=4):
     """
     Applies the trained network to all images found in path_to_dir for 49 emotions respectively.
     Saves the output in path_to_out_dir.
 
+    The images are processed in batches of batch_size input images, i.e. batch_size*49 generated
+    images per run. The next batch is decoded while the current one is processed, and the
+    results are saved by num_threads background writers. The codes z of the images are
+    cached by content (see latent_cache.py), so an image already encoded by the same model,
+    in this run or, with latent_cache_dir, an earlier one, skips the encoder.
+
     @param path_to_dir: path to existing directory (string)
     @param path_to_out_dir: path to existing directory (string)
+    @param model_path: inference model written by export.py, quantized models written by quantize.py,
+                       or checkpoint directory (string)
+    @param batch_size: number of input images processed per run, trades memory for throughput (int)
+    @param num_threads: number of threads decoding and saving images (int)
     """
-    # valence
-    valence = np.arange(0.75, -0.751, -0.25)
-    valence = np.repeat(valence, 7).reshape((49, 1))
+    valence, arousal = emotion_grid()
+    num_labels = len(valence)
 
-    # arousal
-    arousal = [np.arange(0.75, -0.751, -0.25)]
-    arousal = np.repeat(arousal, 7, axis=0)
-    arousal = np.asarray([item for sublist in arousal for item in sublist]).reshape((49, 1))
+    # restore graph
+    model = load_inference_model(model_path, config=session_config(device_strategy, intra_op_threads, inter_op_threads))
+    cache = LatentCache(model_id(model_path), latent_cache_size, latent_cache_dir)
 
-    with tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(allow_soft_placement=True)) as sess:
-
-        # restore graph
-        new_saver = tf.compat.v1.train.import_meta_graph('checkpoint/01_model.meta')
-        new_saver.restore(sess, tf.compat.v1.train.latest_checkpoint('./checkpoint'))
-        graph = tf.get_default_graph()
-
-        # create feed dict
-        arousal_tensor = graph.get_tensor_by_name("arousal_labels:0")
-        valence_tensor = graph.get_tensor_by_name("valence_labels:0")
-        images_tensor = graph.get_tensor_by_name("input_images:0")
+    with model:
 
         # load input
         files_already = os.listdir(path_to_out_dir)
 
         files = [f for f in os.listdir(path_to_dir) if not f in files_already]
+        batches = [files[start:start + batch_size] for start in range(0, len(files), batch_size)]
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher, \
+                ThreadPoolExecutor(max_workers=num_threads) as decoder, \
+                ThreadPoolExecutor(max_workers=num_threads) as writer:
+
+            def read_file(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+
+            def load_batch(batch):
+                contents = list(decoder.map(read_file, [path_to_dir + file for file in batch]))
+                images = load_images([io.BytesIO(data) for data in contents], image_size=size_image,
+                                     image_value_range=image_value_range, pool=decoder)
+                return [content_key(data) for data in contents], images
+
+            next_images = prefetcher.submit(load_batch, batches[0]) if batches else None
+            pending_writes = []
+
+            for index, batch in enumerate(batches):
+                keys, images = next_images.result()
+                if index + 1 < len(batches):
+                    # decode the next batch while this one is processed
+                    next_images = prefetcher.submit(load_batch, batches[index + 1])
+
+                # encode every image not in the cache once, then generate all 49 labels of all images in one run
+                z = cache.encode(model, keys, lambda indices: images[indices])
+                x = model.generate(np.repeat(z, num_labels, axis=0),
+                                   np.tile(valence, (len(batch), 1)),
+                                   np.tile(arousal, (len(batch), 1)))
 
-        for file in files:
-            i = load_image_as_network_input(path_to_dir + file).reshape((1, 96, 96, 3))
-            query_images = np.tile(i, (49, 1, 1, 1))
+                # save
+                for k, file in enumerate(batch):
+                    pending_writes.append(writer.submit(save_generated_output,
+                                                        images[k:k + 1],
+                                                        x[k * num_labels:(k + 1) * num_labels],
+                                                        path_to_out_dir + file))
 
-            # create input for net
-            feed_dict = {arousal_tensor: arousal, valence_tensor: valence, images_tensor: query_images}
-            op_to_restore = sess.graph.get_tensor_by_name("generator/Tanh:0")
+                # limit the number of results waiting to be saved
+                while len(pending_writes) > 2 * batch_size:
+                    pending_writes.pop(0).result()
 
-            # run
-            x = sess.run(op_to_restore, feed_dict)
+            for write in pending_writes:
+                write.result()
 
-            # save
-            save_generated_output(i, x, path_to_out_dir + file)
+    print("Latent cache: %(hits)d hits (%(disk_hits)d from disk), %(misses)d misses" % cache.stats())
 
 # --------------------------------------------------------------------
 # --------------------------------------------------------------------
@@ -178,4 +178,4 @@ def apply_network_to_images_of_dir(path_to_dir, path_to_out_dir):
 
 if __name__ == "__main__":
 
-    apply_network_to_images_of_dir('./test_images/', './test_images_edited/')
\ No newline at end of file
+    apply_network_to_images_of_dir('./test_images/', './test_images_edited/', batch_size=16)
\ No newline at end of file
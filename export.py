@@ -0,0 +1,128 @@
+"""
+Exports the encoder and generator of a trained model as a compact, frozen inference graph.
+
+Only the inference branch (see inference.build_inference_graph) is built, so the
+discriminators, the VGG face network, the optimizer slots and the summaries of the
+training graph are left out. The variables are restored from the checkpoint and frozen
+into constants, then the graph is optimized (unused nodes stripped, constants and batch
+normalizations folded). Load the result with inference.load_inference_model.
+
+The exporter reports the size on disk and the time from process start to the first
+generated image for both the checkpoint and the exported model.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from config import size_image, device_strategy, intra_op_threads, inter_op_threads
+from devices import session_config
+from inference import build_inference_graph, load_inference_model, OUTPUT_NAMES
+
+INPUT_NAMES = ['query_images', 'z_input', 'valence_input', 'arousal_input']
+
+TRANSFORMS = [
+    'strip_unused_nodes',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'sort_by_execution_order',
+]
+
+
+def export_inference_graph(checkpoint_dir, output_path):
+    """
+    Builds the inference graph, restores its variables from the latest checkpoint in
+    checkpoint_dir, freezes and optimizes it and saves it to output_path.
+
+    @param checkpoint_dir: directory of the checkpoint (string)
+    @param output_path: path of the frozen graph (string)
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        build_inference_graph()
+        saver = tf.train.Saver(tf.global_variables())
+        with tf.Session(graph=graph) as session:
+            saver.restore(session, tf.train.latest_checkpoint(checkpoint_dir))
+            graph_def = tf.graph_util.convert_variables_to_constants(
+                session,
+                graph.as_graph_def(),
+                OUTPUT_NAMES
+            )
+
+    graph_def = TransformGraph(graph_def, INPUT_NAMES, OUTPUT_NAMES, TRANSFORMS)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+
+def checkpoint_size(checkpoint_dir):
+    """
+    @param checkpoint_dir: directory of the checkpoint (string)
+
+    @return: size in bytes of the meta graph, index and data files of the latest checkpoint
+    """
+    checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    prefix = os.path.basename(checkpoint)
+    return sum(os.path.getsize(os.path.join(checkpoint_dir, f))
+               for f in os.listdir(checkpoint_dir) if f.startswith(prefix + '.'))
+
+
+def time_to_first_image(model_path):
+    """
+    Measures the time from starting a new python process to the first generated image.
+
+    @param model_path: frozen graph or checkpoint directory (string)
+
+    @return: time in seconds
+    """
+    start_time = time.time()
+    subprocess.check_call([sys.executable, os.path.abspath(__file__), '--first-image', model_path])
+    return time.time() - start_time
+
+
+def generate_first_image(model_path):
+    """
+    Loads the model and encodes and generates a single image.
+
+    @param model_path: frozen graph or checkpoint directory (string)
+    """
+    model = load_inference_model(model_path, config=session_config(device_strategy, intra_op_threads, inter_op_threads))
+    with model:
+        z = model.encode(np.zeros((1, size_image, size_image, 3), dtype=np.float32))
+        model.generate(z, np.zeros((1, 1), dtype=np.float32), np.zeros((1, 1), dtype=np.float32))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--checkpoint_dir', default='./checkpoint')
+    parser.add_argument('--output', default='./export/inference_model.pb')
+    parser.add_argument('--first-image', dest='first_image', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.first_image:
+        generate_first_image(args.first_image)
+        sys.exit()
+
+    export_inference_graph(args.checkpoint_dir, args.output)
+
+    size_checkpoint = checkpoint_size(args.checkpoint_dir)
+    size_export = os.path.getsize(args.output)
+    time_checkpoint = time_to_first_image(args.checkpoint_dir)
+    time_export = time_to_first_image(args.output)
+
+    print("Exported inference model to %s" % args.output)
+    print("\tsize on disk:         checkpoint %7.1f MB  exported %7.1f MB  (%.1fx smaller)" %
+          (size_checkpoint / 1e6, size_export / 1e6, size_checkpoint / size_export))
+    print("\tstart to first image: checkpoint %7.2f s   exported %7.2f s   (%.1fx faster)" %
+          (time_checkpoint, time_export, time_checkpoint / time_export))
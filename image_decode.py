@@ -0,0 +1,88 @@
+"""
+Decoding of image files into network inputs.
+
+Images are decoded with PIL. For JPEG files the decoder is put into draft mode, which
+lets libjpeg decode at a reduced scale (1/2, 1/4 or 1/8) that is still at least
+image_size, so that a large photo is never decoded at full resolution. The remaining
+resize is done on the uint8 image, and the conversion to image_value_range is done once
+for a whole batch.
+
+decode_images() decodes a batch of files, optionally on a thread pool and into a given
+array (e.g. a memory-mapped file); load_images() additionally converts the batch to
+float32 network inputs. Both are used for training (input_pipeline.FileSource,
+dataset_cache, evaluation.ValidationSet) and by experiment.py.
+"""
+import numpy as np
+from PIL import Image
+
+
+def decode_image(path, image_size=96, is_gray=False):
+    """
+    Decodes an image file and resizes it to image_size x image_size.
+
+    @param path: path of the image (string)
+    @param image_size: width and height of the returned image (int)
+    @param is_gray: decode as gray scale instead of color image (bool)
+
+    @return: uint8 numpy array of shape [image_size, image_size, 3], or [image_size, image_size] if is_gray
+    """
+    mode = 'L' if is_gray else 'RGB'
+    with Image.open(path) as image:
+        # no-op for other formats than JPEG
+        image.draft(mode, (image_size, image_size))
+        image = image.convert(mode)
+        if image.size != (image_size, image_size):
+            image = image.resize((image_size, image_size), Image.BILINEAR)
+        return np.asarray(image, dtype=np.uint8)
+
+
+def decode_images(paths, image_size=96, pool=None, out=None):
+    """
+    Decodes a batch of color images.
+
+    @param paths: paths of the images (list of strings)
+    @param image_size: width and height of the returned images (int)
+    @param pool: (optional) concurrent.futures executor decoding the images in parallel
+    @param out: (optional) uint8 array of shape [len(paths), image_size, image_size, 3] to decode into
+
+    @return: uint8 numpy array of shape [len(paths), image_size, image_size, 3]
+    """
+    if out is None:
+        out = np.empty((len(paths), image_size, image_size, 3), dtype=np.uint8)
+
+    def decode(index):
+        out[index] = decode_image(paths[index], image_size=image_size)
+
+    if pool is None:
+        for index in range(len(paths)):
+            decode(index)
+    else:
+        list(pool.map(decode, range(len(paths))))
+    return out
+
+
+def uint8_to_range(images, image_value_range=(-1, 1)):
+    """
+    Converts uint8 images to float32 images with pixel values in image_value_range
+
+    @param images: uint8 numpy array
+    @param image_value_range: expected pixel value range of the images
+
+    @return: float32 numpy array of the same shape
+    """
+    low, high = image_value_range[0], image_value_range[-1]
+    return images.astype(np.float32) * np.float32((high - low) / 255.0) + np.float32(low)
+
+
+def load_images(paths, image_size=96, image_value_range=(-1, 1), pool=None):
+    """
+    Decodes a batch of color images into network inputs.
+
+    @param paths: paths of the images (list of strings)
+    @param image_size: width and height of the returned images (int)
+    @param image_value_range: pixel value range of the returned images
+    @param pool: (optional) concurrent.futures executor decoding the images in parallel
+
+    @return: float32 numpy array of shape [len(paths), image_size, image_size, 3]
+    """
+    return uint8_to_range(decode_images(paths, image_size=image_size, pool=pool), image_value_range)
@@ -1,23 +1,86 @@
 from __future__ import division
 import numpy as np
-from scipy.misc import imread, imresize, imsave
+from PIL import Image
 
-def load_image(image_path, image_size=64,  image_value_range=(-1, 1),  is_gray=False):
+def to_uint8(images, image_value_range=(-1, 1)):
     """
-    Load image from file
+    Converts images with pixel values in image_value_range to uint8 images
 
-    @param image_path: path of the image
-    @param image_size: expected size of the image
-    @param image_value_range: expected pixel value range of the image
-    @param is_gray: gray scale or color image
+    @param images: numpy array
+    @param image_value_range: pixel value range of the images
+
+    @return: uint8 numpy array of the same shape
+    """
+    low, high = image_value_range[0], image_value_range[-1]
+    scaled = (images - np.float32(low)) * np.float32(255.0 / (high - low)) + np.float32(0.5)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+def emotion_grid_layout(size=7, margin=3):
+    """
+    Layout of the input image next to the size x size grid of generated images: the input
+    image is placed in the middle row of the margin, the generated images to the right of it.
+
+    @param size: number of rows and columns of the generated images (int)
+    @param margin: number of columns left of the generated images (int)
+
+    @return: layout for tile_images with the input image at index 0 and the generated images
+             at indices 1 to size*size, of shape [size, size+margin]
+    """
+    layout = -np.ones((size, size + margin), dtype=np.int64)
+    layout[:, margin:] = np.arange(1, size * size + 1).reshape((size, size))
+    layout[size // 2, margin // 2] = 0
+    return layout
+
+def tile_images(images, size_frame=None, layout=None, out=None):
+    """
+    Arranges images in a grid
+
+    @param images: images tensor of shape [n, h, w] or [n, h, w, c], of any dtype
+    @param size_frame: size of the image matrix, number of images in each row and column,
+                       defaults to the smallest square holding all images
+    @param layout: (optional) index of the image in each cell of the grid, row by row,
+                   -1 for an empty (black) cell; defaults to the images in order
+    @param out: (optional) C-contiguous array of shape [rows*h, cols*w(, c)] to write the grid into
+
+    @return: grid of shape [rows*h, cols*w(, c)] and of the dtype of images
+    """
+    if layout is not None:
+        layout = np.asarray(layout)
+        size_frame = layout.shape if layout.ndim == 2 else size_frame
+    if size_frame is None:
+        auto_size = int(np.ceil(np.sqrt(images.shape[0])))
+        size_frame = [auto_size, auto_size]
+    rows, cols = size_frame
+    if layout is None:
+        layout = np.arange(rows * cols)
+        layout[len(images):] = -1
+    layout = layout.reshape(-1)
+
+    img_h, img_w = images.shape[1], images.shape[2]
+    cell_shape = images.shape[3:]
+    if out is None:
+        out = np.empty((rows * img_h, cols * img_w) + cell_shape, dtype=images.dtype)
+    elif not out.flags['C_CONTIGUOUS'] or out.shape != (rows * img_h, cols * img_w) + cell_shape:
+        raise ValueError('out has to be a C-contiguous array of shape %s' % str((rows * img_h, cols * img_w) + cell_shape))
+
+    # view of the grid as [rows, cols, h, w(, c)]
+    axes = (0, 2, 1, 3) + tuple(range(4, 4 + len(cell_shape)))
+    cells = out.reshape((rows, img_h, cols, img_w) + cell_shape).transpose(axes)
+
+    cell_rows, cell_cols = np.divmod(np.arange(rows * cols), cols)
+    filled = layout >= 0
+    cells[cell_rows[filled], cell_cols[filled]] = images[layout[filled]]
+    cells[cell_rows[~filled], cell_cols[~filled]] = 0
+    return out
+
+def save_image(image, path):
     """
-    if is_gray:
-        image = imread(image_path, flatten=True).astype(np.float32)
-    else:
-        image = imread(image_path).astype(np.float32)
-    image = imresize(image, [image_size, image_size])
-    image = image.astype(np.float32) * (image_value_range[-1] - image_value_range[0]) / 255.0 + image_value_range[0]
-    return image
+    Save uint8 image to file
+
+    @param image: uint8 numpy array of shape [h, w, 3]
+    @param path: path to save the image to
+    """
+    Image.fromarray(image).save(path)
 
 def save_batch_images(batch_images, save_path, image_value_range=(-1,1),  size_frame=None):
     """
@@ -28,18 +91,7 @@ def save_batch_images(batch_images, save_path, image_value_range=(-1,1),  size_f
     @param image_value_range: value range of the images tensor
     @param size_frame: size of the image matrix, number of images in each row and column
     """
-    # transform the pixel value to 0~1
-    images = (batch_images - image_value_range[0]) / (image_value_range[-1] - image_value_range[0])
-    if size_frame is None:
-        auto_size = int(np.ceil(np.sqrt(images.shape[0])))
-        size_frame = [auto_size, auto_size]
-    img_h, img_w = batch_images.shape[1], batch_images.shape[2]
-    frame = np.zeros([img_h * size_frame[0], img_w * size_frame[1], 3])
-    for ind, image in enumerate(images):
-        ind_col = ind % size_frame[1]
-        ind_row = ind // size_frame[1]
-        frame[(ind_row * img_h):(ind_row * img_h + img_h), (ind_col * img_w):(ind_col * img_w + img_w), :] = image
-    imsave(save_path, frame)
+    save_image(images_to_grid(batch_images, image_value_range=image_value_range, size_frame=size_frame), save_path)
 
 def save_output(input_image, output, path, image_value_range = (-1,1), size_frame=[7, 10]):
     """
@@ -48,19 +100,11 @@ def save_output(input_image, output, path, image_value_range = (-1,1), size_fram
     @param input_image: input image tensor
     @param output: network output (i.e. 49 images) for input image and 49 different valence/arousal labels
     @param path: path to save the image grid to
+    @param size_frame: size of the image matrix, the generated images take the right size_frame[0] columns
     """
-    # Tile black background
-    black_image = np.zeros((1, 96, 96, 3))
-    black_image3 = np.tile(black_image, (3, 1, 1, 1))
-
-    # Build final image from components
-    input_frame = np.concatenate([black_image3,output[:4],black_image, input_image, black_image,output[4:8],black_image3,output[8:12],black_image3,output[12:]])
-
-    # Transform into savable format
-    final_image = images_to_grid(input_frame, image_value_range=image_value_range, size_frame=size_frame)
-
-    # Save image
-    imsave(path, final_image)
+    images = to_uint8(np.concatenate([input_image[:1], output]), image_value_range)
+    layout = emotion_grid_layout(size=size_frame[0], margin=size_frame[1] - size_frame[0])
+    save_image(tile_images(images, layout=layout), path)
 
 def images_to_grid(batch_images, image_value_range=(-1, 1), size_frame=None):
     """
@@ -70,17 +114,6 @@ def images_to_grid(batch_images, image_value_range=(-1, 1), size_frame=None):
     @param image_value_range: value range of the images tensor
     @param size_frame:  size of the image matrix, number of images in each row and column
 
-    @return: images grid
+    @return: uint8 images grid
     """
-    # transform the pixel value to 0~1
-    images = (batch_images - image_value_range[0]) / (image_value_range[-1] - image_value_range[0])
-    if size_frame is None:
-        auto_size = int(np.ceil(np.sqrt(images.shape[0])))
-        size_frame = [auto_size, auto_size]
-    img_h, img_w = batch_images.shape[1], batch_images.shape[2]
-    frame = np.zeros([img_h * size_frame[0], img_w * size_frame[1], 3])
-    for ind, image in enumerate(images):
-        ind_col = ind % size_frame[1]
-        ind_row = ind // size_frame[1]
-        frame[(ind_row * img_h):(ind_row * img_h + img_h), (ind_col * img_w):(ind_col * img_w + img_w), :] = image
-    return frame
\ No newline at end of file
+    return tile_images(to_uint8(batch_images, image_value_range), size_frame=size_frame)
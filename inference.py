@@ -0,0 +1,302 @@
+"""
+Inference with a trained model: encode images once, then generate images for any labels.
+
+Graphs built by model.Model and frozen graphs written by export.py contain a separate
+inference branch (see build_inference_graph):
+
+- query_images -> query_z: the encoder alone
+- z_input, valence_input, arousal_input -> generated_images: the generator alone
+
+Graphs of older checkpoints (e.g. checkpoint/01_model.meta) only contain the training
+branch with fixed batch size. For them, the generator is run by feeding the encoder
+output encoder/Tanh:0 directly, so the encoder is skipped as well.
+
+The int8 models written by quantize.py are a directory with one TensorFlow Lite model for
+the encoder and one for the generator, run by QuantizedInferenceModel.
+"""
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from config import size_image, num_z_channels
+from subnetworks import encoder, generator
+
+# names of the outputs of the inference branch
+OUTPUT_NAMES = ['query_z', 'generated_images']
+
+# files of the quantized encoder and generator in the directory written by quantize.py
+ENCODER_FILE = 'encoder.tflite'
+GENERATOR_FILE = 'generator.tflite'
+
+
+def build_inference_graph(reuse_variables=False):
+    """
+    Creates the inference branch: the encoder and the generator, each with its own inputs
+    and an open batch dimension.
+
+    @param reuse_variables: reuse the variables of an existing encoder and generator (bool)
+
+    @return: query_images, query_z, z_input, valence_input, arousal_input, generated_images
+    """
+    # images to encode (any number)
+    query_images = tf.placeholder(
+        tf.float32,
+        [None, size_image, size_image, 3],
+        name='query_images'
+    )
+
+    # z and labels to generate images from (any number)
+    z_input = tf.placeholder(
+        tf.float32,
+        [None, num_z_channels],
+        name='z_input'
+    )
+
+    valence_input = tf.placeholder(
+        tf.float32,
+        [None, 1],
+        name='valence_input'
+    )
+
+    arousal_input = tf.placeholder(
+        tf.float32,
+        [None, 1],
+        name='arousal_input'
+    )
+
+    # encoder alone: query images --> z
+    query_z = tf.identity(encoder(query_images, reuse_variables=reuse_variables), name=OUTPUT_NAMES[0])
+
+    # generator alone: z + arousal + valence --> generated image
+    generated_images = tf.identity(generator(z_input,
+                                             valence=valence_input,
+                                             arousal=arousal_input,
+                                             reuse_variables=reuse_variables), name=OUTPUT_NAMES[1])
+
+    return query_images, query_z, z_input, valence_input, arousal_input, generated_images
+
+
+def emotion_grid(size=7, maximum=0.75):
+    """
+    Creates the valence/arousal labels of a size x size grid, from positive (top) to negative
+    (bottom) valence and from high (left) to low (right) arousal.
+
+    @param size: number of rows and columns of the grid (int)
+    @param maximum: largest absolute value of the labels (float)
+
+    @return: valence, arousal: numpy arrays of shape [size*size, 1]
+    """
+    values = np.linspace(maximum, -maximum, size).astype(np.float32)
+    valence = np.repeat(values, size).reshape((-1, 1))
+    arousal = np.tile(values, size).reshape((-1, 1))
+    return valence, arousal
+
+
+def run_in_batches(session, fetch, feeds, batch_size):
+    """
+    Runs fetch on inputs of arbitrary length for a graph with fixed batch size,
+    padding the last batch with zeros.
+
+    @param session: tensorflow session
+    @param fetch: tensor to evaluate
+    @param feeds: dictionary of placeholder tensors to numpy arrays of equal length
+    @param batch_size: batch size of the graph (int)
+
+    @return: numpy array with one entry for each input
+    """
+    num_inputs = len(next(iter(feeds.values())))
+    results = []
+    for start in range(0, num_inputs, batch_size):
+        feed_dict = {}
+        for tensor, value in feeds.items():
+            value = value[start:start + batch_size]
+            padding = batch_size - len(value)
+            if padding:
+                value = np.concatenate([value, np.zeros((padding,) + value.shape[1:], dtype=value.dtype)])
+            feed_dict[tensor] = value
+        results.append(session.run(fetch, feed_dict=feed_dict)[:min(batch_size, num_inputs - start)])
+    return np.concatenate(results)
+
+
+class InferenceModel(object):
+    """
+    Encoder and generator of a trained model in a tensorflow session.
+    """
+    def __init__(self, session, graph=None):
+        """
+        @param session: tensorflow session holding the trained variables
+        @param graph: (optional) graph of the model, defaults to the session's graph
+        """
+        self.session = session
+        graph = graph or session.graph
+        try:
+            self.images = graph.get_tensor_by_name('query_images:0')
+            self.z = graph.get_tensor_by_name('query_z:0')
+            self.z_input = graph.get_tensor_by_name('z_input:0')
+            self.valence = graph.get_tensor_by_name('valence_input:0')
+            self.arousal = graph.get_tensor_by_name('arousal_input:0')
+            self.G = graph.get_tensor_by_name('generated_images:0')
+            self.batch_size = None
+        except KeyError:
+            # graph without inference branch
+            self.images = graph.get_tensor_by_name('input_images:0')
+            self.z = graph.get_tensor_by_name('encoder/Tanh:0')
+            self.z_input = self.z
+            self.valence = graph.get_tensor_by_name('valence_labels:0')
+            self.arousal = graph.get_tensor_by_name('arousal_labels:0')
+            self.G = graph.get_tensor_by_name('generator/Tanh:0')
+            self.batch_size = self.images.get_shape().as_list()[0]
+
+    @classmethod
+    def from_checkpoint(cls, session, checkpoint_dir='./checkpoint', meta_path=None):
+        """
+        Restores the meta graph and the latest checkpoint of checkpoint_dir into session.
+
+        @param session: tensorflow session
+        @param checkpoint_dir: directory of the checkpoint (string)
+        @param meta_path: (optional) path of the meta graph, defaults to the one of the latest checkpoint
+
+        @return: InferenceModel
+        """
+        checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+        saver = tf.train.import_meta_graph(meta_path or checkpoint + '.meta')
+        saver.restore(session, checkpoint)
+        return cls(session)
+
+    @classmethod
+    def from_frozen_graph(cls, path, config=None):
+        """
+        Loads a frozen inference graph written by export.py into a new session.
+
+        @param path: path of the frozen graph (string)
+        @param config: (optional) tf.ConfigProto of the session
+
+        @return: InferenceModel
+        """
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        return cls(tf.Session(graph=graph, config=config), graph)
+
+    def _run(self, fetch, feeds):
+        if self.batch_size is None:
+            return self.session.run(fetch, feed_dict=feeds)
+        return run_in_batches(self.session, fetch, feeds, self.batch_size)
+
+    def encode(self, images):
+        """
+        @param images: numpy array of shape [n, 96, 96, 3]
+
+        @return: z: numpy array of shape [n, num_z_channels]
+        """
+        return self._run(self.z, {self.images: images})
+
+    def generate(self, z, valence, arousal):
+        """
+        @param z: numpy array of shape [n, num_z_channels]
+        @param valence: numpy array of shape [n, 1]
+        @param arousal: numpy array of shape [n, 1]
+
+        @return: generated images: numpy array of shape [n, 96, 96, 3]
+        """
+        return self._run(self.G, {self.z_input: z, self.valence: valence, self.arousal: arousal})
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class QuantizedInferenceModel(object):
+    """
+    Quantized encoder and generator written by quantize.py, run by the TensorFlow Lite interpreter.
+
+    The models have a fixed batch size, inputs of any length are run in batches of that size.
+    Inputs and outputs are float32 like those of InferenceModel.
+    """
+    def __init__(self, path):
+        """
+        @param path: directory of the quantized models (string)
+        """
+        self.encoder = tf.lite.Interpreter(model_path=os.path.join(path, ENCODER_FILE))
+        self.generator = tf.lite.Interpreter(model_path=os.path.join(path, GENERATOR_FILE))
+        self.encoder.allocate_tensors()
+        self.generator.allocate_tensors()
+
+    @staticmethod
+    def _invoke(interpreter, feeds):
+        """
+        @param interpreter: tf.lite.Interpreter with a single output
+        @param feeds: dictionary of input names to numpy arrays of equal length
+
+        @return: numpy array with one entry for each input
+        """
+        inputs = dict((detail['name'], detail) for detail in interpreter.get_input_details())
+        output = interpreter.get_output_details()[0]
+        batch_size = output['shape'][0]
+        num_inputs = len(next(iter(feeds.values())))
+        results = []
+        for start in range(0, num_inputs, batch_size):
+            for name, value in feeds.items():
+                value = value[start:start + batch_size]
+                padding = batch_size - len(value)
+                if padding:
+                    value = np.concatenate([value, np.zeros((padding,) + value.shape[1:], dtype=value.dtype)])
+                interpreter.set_tensor(inputs[name]['index'], value.astype(np.float32))
+            interpreter.invoke()
+            results.append(interpreter.get_tensor(output['index'])[:min(batch_size, num_inputs - start)])
+        return np.concatenate(results)
+
+    def encode(self, images):
+        """
+        @param images: numpy array of shape [n, 96, 96, 3]
+
+        @return: z: numpy array of shape [n, num_z_channels]
+        """
+        return self._invoke(self.encoder, {'query_images': images})
+
+    def generate(self, z, valence, arousal):
+        """
+        @param z: numpy array of shape [n, num_z_channels]
+        @param valence: numpy array of shape [n, 1]
+        @param arousal: numpy array of shape [n, 1]
+
+        @return: generated images: numpy array of shape [n, 96, 96, 3]
+        """
+        return self._invoke(self.generator, {'z_input': z, 'valence_input': valence, 'arousal_input': arousal})
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_inference_model(path='./checkpoint', config=None):
+    """
+    Loads a trained model for inference into a new session.
+
+    @param path: frozen graph (.pb) written by export.py, directory of the quantized models
+                 written by quantize.py, or checkpoint directory (string)
+    @param config: (optional) tf.ConfigProto of the session, not used by quantized models
+
+    @return: InferenceModel or QuantizedInferenceModel
+    """
+    if os.path.isfile(os.path.join(path, ENCODER_FILE)):
+        return QuantizedInferenceModel(path)
+    if path.endswith('.pb'):
+        return InferenceModel.from_frozen_graph(path, config=config)
+    graph = tf.Graph()
+    with graph.as_default():
+        return InferenceModel.from_checkpoint(tf.Session(graph=graph, config=config), path)
@@ -0,0 +1,189 @@
+"""
+Input pipeline that prepares training batches in the background.
+
+Batches are read from a source while the training step is running, so that the model
+does not have to wait for the disk. A source provides __len__, load(indices) and close():
+
+- FileSource decodes, resizes and normalizes image files on a pool of worker threads
+- dataset_cache.DatasetCache reads preprocessed images from a memory-mapped array
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_decode import load_images
+
+
+class FileSource(object):
+    """
+    Loads training samples from image files, decoding the images of a batch in parallel.
+    """
+    def __init__(self, manifest, image_size, image_value_range=(-1, 1), num_threads=8, indices=None):
+        """
+        @param manifest: manifest.Manifest of the data directory
+        @param image_size: width and height of the returned images (int)
+        @param image_value_range: pixel value range of the returned images
+        @param num_threads: number of decoding threads (int)
+        @param indices: (optional) images of the manifest making up this source, may contain
+                        duplicates (e.g. for balancing the categories)
+        """
+        self.file_names = manifest.paths
+        self.categories = manifest.categories
+        self.valence = manifest.valence
+        self.arousal = manifest.arousal
+        self.image_size = image_size
+        self.image_value_range = image_value_range
+        self.indices = np.arange(len(manifest)) if indices is None else np.asarray(indices)
+        self._pool = ThreadPoolExecutor(max_workers=num_threads)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def load(self, indices):
+        """
+        @param indices: indices of the samples to load
+
+        @return: images [n, image_size, image_size, 3], valence [n, 1], arousal [n, 1]
+        """
+        rows = self.indices[indices]
+        batch_files = [self.file_names[i] for i in rows]
+        images = load_images(batch_files, self.image_size, self.image_value_range, pool=self._pool)
+        return images, self.valence[rows], self.arousal[rows]
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class InputPipeline(object):
+    """
+    Produces batches of (images, valence, arousal) on a background thread.
+
+    The producer thread loads the batches from the source and puts them into a bounded
+    queue, which holds at most num_prefetch batches. The training loop takes batches
+    from the queue with next_batch().
+    """
+    def __init__(self, source, batch_size, num_epochs=1, shuffle=True, num_prefetch=4):
+        """
+        @param source: FileSource or DatasetCache
+        @param batch_size: number of images per batch (int)
+        @param num_epochs: number of passes over the source (int)
+        @param shuffle: shuffle the samples at the beginning of each epoch (bool)
+        @param num_prefetch: maximal number of batches prepared ahead (int)
+        """
+        self.source = source
+        self.batch_size = batch_size
+        self.num_epochs = num_epochs
+        self.shuffle = shuffle
+        self.num_batches = len(source) // batch_size
+
+        self._queue = queue.Queue(maxsize=num_prefetch)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # statistics
+        self._lock = threading.Lock()
+        self._produced_images = 0
+        self._load_time = 0.0
+        self._wait_time = 0.0
+        self._consumed_batches = 0
+        self._start_time = None
+
+    # -- PRODUCER -------------------------------------------------------------------------
+    # -------------------------------------------------------------------------------------
+    def _put(self, item):
+        # block while the queue is full, but give up once the pipeline is stopped
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            order = np.arange(len(self.source))
+            for _ in range(self.num_epochs):
+                if self.shuffle:
+                    np.random.shuffle(order)
+                for ind_batch in range(self.num_batches):
+                    start_time = time.time()
+                    batch = self.source.load(order[ind_batch*self.batch_size:(ind_batch+1)*self.batch_size])
+                    with self._lock:
+                        self._produced_images += self.batch_size
+                        self._load_time += time.time() - start_time
+                    if not self._put(batch):
+                        return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    # -- CONSUMER -------------------------------------------------------------------------
+    # -------------------------------------------------------------------------------------
+    def start(self):
+        """
+        Starts the producer thread.
+        """
+        self._start_time = time.time()
+        self._thread = threading.Thread(target=self._produce, name='input_pipeline')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def next_batch(self):
+        """
+        Returns the next batch, blocking until it is available.
+
+        @return: images [batch_size, image_size, image_size, 3], valence [batch_size, 1],
+                 arousal [batch_size, 1]
+        """
+        start_time = time.time()
+        item = self._queue.get()
+        with self._lock:
+            self._wait_time += time.time() - start_time
+            self._consumed_batches += 1
+        if item is None:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.next_batch()
+            except StopIteration:
+                return
+
+    def stop(self):
+        """
+        Stops the producer thread, drops all prefetched batches and closes the source.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self.source.close()
+
+    def stats(self):
+        """
+        Returns the throughput of the pipeline.
+
+        - load_images_per_sec: images/sec of the loading stage alone
+        - images_per_sec: images/sec produced since the pipeline was started
+        - wait_time: total time the training loop has been waiting for batches (sec)
+        - queue_fill: number of batches currently prepared ahead
+        """
+        with self._lock:
+            elapsed = time.time() - self._start_time if self._start_time else 0.0
+            return {
+                'load_images_per_sec': self._produced_images / self._load_time if self._load_time else 0.0,
+                'images_per_sec': self._produced_images / elapsed if elapsed else 0.0,
+                'wait_time': self._wait_time,
+                'consumed_batches': self._consumed_batches,
+                'queue_fill': self._queue.qsize(),
+            }
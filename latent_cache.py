@@ -0,0 +1,163 @@
+"""
+Cache of the encoder outputs z, keyed by the content of the input images.
+
+A face is usually edited many times with different labels, but its code z only depends
+on the image and the weights of the encoder. LatentCache keeps the codes of the most
+recently used images in memory (least recently used ones are evicted beyond max_entries)
+and, with a cache directory, also on disk in a subdirectory named after the model id, so
+that the codes survive restarts and are never mixed up between checkpoints.
+
+Keys are SHA-1 hashes of the image files (or of decoded images), see content_key;
+model_id identifies the weights of a checkpoint, frozen graph or quantized model.
+"""
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from inference import ENCODER_FILE
+
+
+def content_key(data):
+    """
+    @param data: content of an image file (bytes) or decoded image (numpy array)
+
+    @return: hex digest of the SHA-1 hash of data (string)
+    """
+    if isinstance(data, np.ndarray):
+        data = str(data.shape).encode('ascii') + np.ascontiguousarray(data).tobytes()
+    return hashlib.sha1(data).hexdigest()
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def model_id(path):
+    """
+    @param path: frozen graph (.pb) written by export.py, directory of the quantized models
+                 written by quantize.py, or checkpoint directory (string)
+
+    @return: id of the encoder weights of the model (string), the name of the checkpoint
+             and a hash of its index file, which holds the checksums of all variables, or
+             a hash of the model file
+    """
+    if os.path.isfile(os.path.join(path, ENCODER_FILE)):
+        return 'quantized-' + _file_hash(os.path.join(path, ENCODER_FILE))[:16]
+    if path.endswith('.pb'):
+        return 'frozen-' + _file_hash(path)[:16]
+    checkpoint = tf.train.latest_checkpoint(path)
+    if checkpoint is None:
+        raise IOError("No checkpoint found in %s" % path)
+    return os.path.basename(checkpoint) + '-' + _file_hash(checkpoint + '.index')[:16]
+
+
+class LatentCache(object):
+    """
+    Least recently used cache of encoder outputs z in memory, optionally persisted on disk.
+    Thread safe.
+    """
+    def __init__(self, model_id, max_entries=10000, cache_dir=None):
+        """
+        @param model_id: id of the model computing the codes, see model_id() (string)
+        @param max_entries: maximal number of codes kept in memory (int)
+        @param cache_dir: (optional) directory persisting the codes, one .npy file per image (string)
+        """
+        self.max_entries = max_entries
+        self.directory = os.path.join(cache_dir, model_id) if cache_dir else None
+        if self.directory and not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def _remember(self, key, z):
+        # with the lock held
+        self._entries[key] = z
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        @param key: content key of an image (string)
+
+        @return: code z of the image (numpy array of shape [num_z_channels]), or None
+        """
+        with self._lock:
+            z = self._entries.get(key)
+            if z is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return z
+        if self.directory and os.path.exists(self._path(key)):
+            z = np.load(self._path(key))
+            with self._lock:
+                self._remember(key, z)
+                self.hits += 1
+                self.disk_hits += 1
+            return z
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, z):
+        """
+        @param key: content key of an image (string)
+        @param z: code z of the image (numpy array of shape [num_z_channels])
+        """
+        z = np.array(z, dtype=np.float32)
+        with self._lock:
+            self._remember(key, z)
+        if self.directory:
+            # write to a temporary file first, so that readers never see a partial file
+            temporary = self._path(key) + '.%d.tmp' % threading.get_ident()
+            with open(temporary, 'wb') as f:
+                np.save(f, z)
+            os.replace(temporary, self._path(key))
+
+    def encode(self, model, keys, load_images):
+        """
+        Looks up the codes of images and encodes the missing ones in a single run.
+
+        @param model: model providing encode()
+        @param keys: content keys of the images (list of strings)
+        @param load_images: function returning the images of the given indices of keys,
+                            numpy array of shape [n, size_image, size_image, 3]
+
+        @return: codes z of the images, numpy array of shape [len(keys), num_z_channels]
+        """
+        codes = [self.get(key) for key in keys]
+        missing = [index for index, z in enumerate(codes) if z is None]
+        if missing:
+            for index, z in zip(missing, model.encode(load_images(missing))):
+                self.put(keys[index], z)
+                codes[index] = z
+        return np.stack(codes)
+
+    def stats(self):
+        """
+        @return: dictionary of the number of hits (of which from disk), misses, the hit rate
+                 and the number of codes in memory
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+                'entries': len(self._entries),
+            }
@@ -1,6 +1,14 @@
 import tensorflow as tf
 
-def conv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=False):
+def channels(data_format):
+    """
+    @param data_format: 'NHWC' or 'NCHW'
+
+    @return: data format in the notation of tf.layers, 'channels_last' or 'channels_first'
+    """
+    return 'channels_first' if data_format == 'NCHW' else 'channels_last'
+
+def conv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=False, data_format='NHWC'):
     """
     Convolutional layer
     
@@ -8,6 +16,7 @@ def conv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=Fal
     @param num_filters: number of applied filters (int)
     @param size_kernel: size of the convolution's kernel (int)
     @param stride: size of the convolution's stride (int)
+    @param data_format: layout of input_map, 'NHWC' or 'NCHW'
     
     @return: output tensor
     """
@@ -18,6 +27,7 @@ def conv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=Fal
                             kernel_initializer=tf.truncated_normal_initializer(stddev=0.02),
                             bias_initializer=tf.constant_initializer(0.0),
                             padding="same",
+                            data_format=channels(data_format),
                             reuse=reuse,
                             name=name)
 
@@ -38,7 +48,7 @@ def dense(input_tensor, units, name=None, reuse=False):
                            reuse=reuse,
                            name=name)
 
-def deconv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=False):
+def deconv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=False, data_format='NHWC'):
     """
     Transposed convulotional layer
     
@@ -46,6 +56,7 @@ def deconv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=F
     @param num_filters: number of applied filters (int)
     @param size_kernel: size of the transposed convolution's kernel (int)
     @param stride: size of the transposed convolution's stride (int)
+    @param data_format: layout of input_map, 'NHWC' or 'NCHW'
     
     @return: output tensor
     """
@@ -56,19 +67,27 @@ def deconv2d(input_map, num_filters, size_kernel=5, stride=2, name=None, reuse=F
                                       kernel_initializer=tf.random_normal_initializer(stddev=0.02),
                                       bias_initializer=tf.constant_initializer(0.0),
                                       padding="same",
+                                      data_format=channels(data_format),
                                       reuse=reuse,
                                       name=name)
 
-def batch_norm(current, name, reuse=False):
+def batch_norm(current, name, reuse=False, data_format='NHWC'):
     """
     Batch normalization layer
     
     @param current: input tensor
     @param name: name of layer (string)
+    @param data_format: layout of current if it is 4-dimensional, 'NHWC' or 'NCHW'
     
     @return: output tensor
     """
-    return tf.contrib.layers.batch_norm(current,
-                                        scale=False,
-                                        scope=name,
-                                        reuse=reuse)
\ No newline at end of file
+    # the statistics are computed in float32, also for float16 inputs
+    dtype = current.dtype.base_dtype
+    if dtype != tf.float32:
+        current = tf.cast(current, tf.float32)
+    current = tf.contrib.layers.batch_norm(current,
+                                           scale=False,
+                                           scope=name,
+                                           data_format=data_format,
+                                           reuse=reuse)
+    return current if dtype == tf.float32 else tf.cast(current, dtype)
\ No newline at end of file
@@ -1,24 +1,40 @@
-import sys
+import logging
 
 import tensorflow as tf
-from model import Model, Logger
+from config import use_dataset_cache, log_file, log_level, log_max_bytes, log_backup_count, log_console_interval, \
+    device_strategy, intra_op_threads, inter_op_threads, log_device_placement, num_towers
+from devices import session_config
+from model import Model
+from training_log import AsyncLog
 
 def main(_):
 
-    # create log file
-    open('logfile.txt', 'a').close()
-
-    config = tf.ConfigProto(log_device_placement=True, allow_soft_placement=False)
-
-    with tf.Session(config=config) as session:
-	
-        # Set Logger Output File
-        sys.stdout = Logger(output_file='logfile.txt')
-
-        model = Model(session)
-
-        print('\n\t Start Training')
-        model.train()
+    # log to the console and to the log file from a background thread
+    training_log = AsyncLog(
+        log_file=log_file,
+        level=log_level,
+        console_interval=log_console_interval,
+        max_bytes=log_max_bytes,
+        backup_count=log_backup_count
+    )
+
+    config = session_config(
+        strategy=device_strategy,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+        log_placement=log_device_placement,
+        num_cpu_devices=num_towers
+    )
+
+    try:
+        with tf.Session(config=config) as session:
+
+            model = Model(session)
+
+            logging.getLogger(__name__).info('Start Training')
+            model.train(use_dataset_cache=use_dataset_cache)
+    finally:
+        training_log.close()
 
 if __name__ == '__main__':
-    tf.app.run()
\ No newline at end of file
+    tf.app.run()
@@ -0,0 +1,117 @@
+"""
+Label manifest of a data directory.
+
+The AffectNet images are named <id>s<category>s<valence>s<arousal>.<ext>, with valence
+and arousal given in thousandths. The manifest parses all file names of a directory
+once into numpy arrays and saves them, so that labels are looked up by index instead of
+splitting strings. A saved manifest is rebuilt when the directory was modified.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from config import save_dir
+
+
+def parse_file_name(name):
+    """
+    Parses the labels from an image file name.
+
+    @param name: file name of the form <id>s<category>s<valence>s<arousal>.<ext>
+
+    @return: id (string), category (int), valence (float), arousal (float)
+    """
+    parts = os.path.splitext(name)[0].split('s')
+    return parts[0], int(parts[1]), int(parts[2]) / 1000, int(parts[3]) / 1000
+
+
+class Manifest(object):
+    """
+    File names and labels of all valid images in a data directory.
+    """
+    def __init__(self, data_path, names, ids, categories, valence, arousal):
+        """
+        @param data_path: data directory (string)
+        @param names: file names, numpy array of strings
+        @param ids: image ids, numpy array of strings
+        @param categories: emotion categories, int8 numpy array
+        @param valence: valence labels, float32 numpy array of shape [n, 1]
+        @param arousal: arousal labels, float32 numpy array of shape [n, 1]
+        """
+        self.data_path = data_path
+        self.names = names
+        self.ids = ids
+        self.categories = categories
+        self.valence = valence
+        self.arousal = arousal
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def paths(self):
+        return [os.path.join(self.data_path, name) for name in self.names]
+
+
+def build_manifest(data_path):
+    """
+    Parses the file names in data_path, skipping images without valid valence label.
+
+    @param data_path: data directory (string)
+
+    @return: Manifest
+    """
+    names, ids, categories, valence, arousal = [], [], [], [], []
+    for name in sorted(os.listdir(data_path)):
+        image_id, category, v, a = parse_file_name(name)
+        if v < -1:
+            continue
+        names.append(name)
+        ids.append(image_id)
+        categories.append(category)
+        valence.append(v)
+        arousal.append(a)
+
+    return Manifest(
+        data_path,
+        names=np.asarray(names),
+        ids=np.asarray(ids),
+        categories=np.asarray(categories, dtype=np.int8),
+        valence=np.asarray(valence, dtype=np.float32).reshape((-1, 1)),
+        arousal=np.asarray(arousal, dtype=np.float32).reshape((-1, 1))
+    )
+
+
+def load_manifest(data_path, manifest_dir=os.path.join(save_dir, 'manifests')):
+    """
+    Loads the saved manifest of data_path, or builds and saves it if it is missing or outdated.
+
+    @param data_path: data directory (string)
+    @param manifest_dir: directory the manifests are saved to (string)
+
+    @return: Manifest
+    """
+    key = hashlib.md5(os.path.abspath(data_path).encode('utf-8')).hexdigest()
+    manifest_path = os.path.join(manifest_dir, key + '.npz')
+    mtime = os.stat(data_path).st_mtime
+
+    if os.path.exists(manifest_path):
+        with np.load(manifest_path) as data:
+            if float(data['mtime']) == mtime:
+                return Manifest(data_path, data['names'], data['ids'], data['categories'],
+                                data['valence'], data['arousal'])
+
+    manifest = build_manifest(data_path)
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    np.savez(
+        manifest_path,
+        mtime=mtime,
+        names=manifest.names,
+        ids=manifest.ids,
+        categories=manifest.categories,
+        valence=manifest.valence,
+        arousal=manifest.arousal
+    )
+    return manifest
@@ -0,0 +1,177 @@
+"""
+Timing of the stages of the training loop.
+
+- StageTimers measures named stages (data loading, optimizer run, checkpointing, ...) and
+  appends their statistics over the last steps to a JSONL metrics file, one record per line.
+- SmoothedETA estimates the remaining training time from an exponential moving average
+  of the step time, so that single slow steps (e.g. while sampling) do not dominate it.
+- StepTracer traces a single step on demand: writing a step number to the trigger file
+  (e.g. echo 1200 > save/trace_step) traces that step, or the next step if it has
+  already passed, without restarting the training. The timeline is saved for
+  chrome://tracing and the run metadata is added to the tensorboard summary.
+"""
+import collections
+import contextlib
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class StageTimers(object):
+    """
+    Rolling statistics of the durations of named stages.
+    """
+    def __init__(self, path, window=100):
+        """
+        @param path: JSONL file to append the records to (string)
+        @param window: number of most recent durations of each stage in the statistics (int)
+        """
+        self.window = window
+        self._durations = collections.OrderedDict()
+        self._totals = {}
+        self._counts = {}
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._file = open(path, 'a')
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measures the duration of the enclosed block as stage name.
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start_time)
+
+    def add(self, name, duration):
+        """
+        @param name: name of the stage (string)
+        @param duration: duration in seconds (float)
+        """
+        if name not in self._durations:
+            self._durations[name] = collections.deque(maxlen=self.window)
+            self._totals[name] = 0.0
+            self._counts[name] = 0
+        self._durations[name].append(duration)
+        self._totals[name] += duration
+        self._counts[name] += 1
+
+    def stats(self):
+        """
+        @return: dictionary of mean, p50, p90 and max of the recent durations of each stage (sec),
+                 and count and total duration of all its measurements
+        """
+        stats = collections.OrderedDict()
+        for name, durations in self._durations.items():
+            recent = np.asarray(durations)
+            stats[name] = {
+                'mean': float(recent.mean()),
+                'p50': float(np.percentile(recent, 50)),
+                'p90': float(np.percentile(recent, 90)),
+                'max': float(recent.max()),
+                'count': self._counts[name],
+                'total': self._totals[name],
+            }
+        return stats
+
+    def write(self, step, **values):
+        """
+        Appends a record with the current statistics and the given values to the metrics file.
+
+        @param step: training step (int)
+        @param values: further values of the record, e.g. the epoch
+        """
+        record = collections.OrderedDict([('step', int(step)), ('time', time.time())])
+        record.update(values)
+        record['stages'] = self.stats()
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SmoothedETA(object):
+    """
+    Remaining time estimated from an exponential moving average of the step time.
+    """
+    def __init__(self, smoothing=0.05):
+        """
+        @param smoothing: weight of the latest step time in the average, in (0, 1] (float)
+        """
+        self.smoothing = smoothing
+        self.step_time = None
+
+    def update(self, step_time):
+        """
+        @param step_time: duration of the latest step in seconds (float)
+        """
+        if self.step_time is None:
+            self.step_time = step_time
+        else:
+            self.step_time += self.smoothing * (step_time - self.step_time)
+
+    def seconds_left(self, steps_left):
+        """
+        @param steps_left: number of remaining steps (int)
+
+        @return: estimated remaining time in seconds, 0 before the first update
+        """
+        return steps_left * (self.step_time or 0.0)
+
+
+class StepTracer(object):
+    """
+    Traces the step whose number is written to a trigger file.
+    """
+    def __init__(self, trigger_file, trace_dir):
+        """
+        @param trigger_file: file holding the number of the step to trace, empty for the next step (string)
+        @param trace_dir: directory to save the timelines to (string)
+        """
+        self.trigger_file = trigger_file
+        self.trace_dir = trace_dir
+
+    def options(self, step):
+        """
+        @param step: number of the step about to run (int)
+
+        @return: RunOptions and RunMetadata to pass to session.run if step is to be traced,
+                 otherwise None, None
+        """
+        if not os.path.exists(self.trigger_file):
+            return None, None
+        with open(self.trigger_file) as f:
+            content = f.read().strip()
+        if content.isdigit() and step < int(content):
+            return None, None
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), tf.RunMetadata()
+
+    def save(self, step, run_metadata, writer=None):
+        """
+        Saves the timeline of a traced step and removes the trigger file.
+
+        @param step: number of the traced step (int)
+        @param run_metadata: RunMetadata filled by session.run
+        @param writer: (optional) tf.summary.FileWriter to add the run metadata to
+
+        @return: path of the timeline (string)
+        """
+        if not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+        path = os.path.join(self.trace_dir, 'step_%d.json' % step)
+        with open(path, 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        if writer is not None:
+            writer.add_run_metadata(run_metadata, 'step_%d' % step, step)
+        if os.path.exists(self.trigger_file):
+            os.remove(self.trigger_file)
+        return path
@@ -4,129 +4,114 @@ Implementation of the model.
 Parts of the code are inherited from the official CAAE implementation (https://arxiv.org/abs/1702.08423).
 """
 
+import logging
 import os
-import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
 import numpy as np
 import tensorflow as tf
-from scipy.io import loadmat, savemat
 
 from config import *
-from image_ops import *
+from image_utils import *
+from input_pipeline import InputPipeline, FileSource
+from dataset_cache import DatasetCache, cache_exists
+from devices import check_data_format, resolve_device, session_config
+from inference import build_inference_graph
+from evaluation import AsyncEvaluator, ValidationSet, save_samples, save_test, save_validation
+from manifest import load_manifest
+from metrics import SmoothedETA, StageTimers, StepTracer
 from subnetworks import encoder, generator, discriminator_img, discriminator_z
-from vgg_face import face_embedding
+from precision import cast, loss_scale_optimizer, precision_scope, resolve_dtype
+from towers import combine_batch, combine_losses, split_batch, tower_devices, tower_gradients, tower_scope
+from vgg_face import identity_loss, load_vgg_weights, vgg_variables
+
+log = logging.getLogger(__name__)
+
+class Tower(object):
+    """
+    Networks and losses of one data parallel tower, created by Model.build_tower.
+    """
+    pass
 
 class Model(object):
     """
     Implementation of the model used.
     """
-    def __init__(self, session):        
+    def __init__(self, session, device=None, towers=None, dtype=None):
+        """
+        @param session: tensorflow session
+        @param device: (optional) device of the networks (of the first tower), defaults to the one of config.device_strategy
+        @param towers: (optional) number of data parallel towers, defaults to config.num_towers
+        @param dtype: (optional) compute dtype of the networks, 'float32' or 'float16',
+                      defaults to config.compute_dtype
+        """
         self.session = session
-        self.vgg_weights = loadmat(vgg_face_path)
+        self.compute_dtype = resolve_dtype(compute_dtype if dtype is None else dtype)
+        self.device = resolve_device(device_strategy) if device is None else device
+        check_data_format(data_format, self.device)
         
         # -- INPUT PLACEHOLDERS -----------------------------------------------------------
         # ---------------------------------------------------------------------------------
         self.input_image = tf.placeholder(
             tf.float32,
-            [size_batch, size_image, size_image, 3],
+            [None, size_image, size_image, 3],
             name='input_images'
         )
 
         self.valence = tf.placeholder(
             tf.float32,
-            [size_batch, 1],
+            [None, 1],
             name='valence_labels'
         )
         
         self.arousal = tf.placeholder(
             tf.float32,
-            [size_batch, 1],
+            [None, 1],
             name='arousal_labels'
         )
 
         self.z_prior = tf.placeholder(
             tf.float32,
-            [size_batch, num_z_channels],
+            [None, num_z_channels],
             name='z_prior'
         )
         
         
         # -- GRAPH ------------------------------------------------------------------------
         # ---------------------------------------------------------------------------------
-        print ('\n\t SETTING  UP THE GRAPH')
+        log.info('Setting up the graph')
+
+        # data parallel towers (see towers.py), each on its own device with a slice of the batch
+        self.num_towers = num_towers if towers is None else towers
+        self.tower_devices = tower_devices(self.device, self.num_towers)
+        tower_inputs, self.tower_weights = split_batch(
+            [self.input_image, self.valence, self.arousal, self.z_prior],
+            self.num_towers
+        )
 
         with tf.variable_scope(tf.get_variable_scope()):
-            with tf.device('/device:GPU:0'): 
-                
-                # -- NETWORKS -------------------------------------------------------------
-                # -------------------------------------------------------------------------
-                
-                # encoder:  
-                self.z = encoder(self.input_image)
-
-                # generator: z + arousal + valence --> generated image   
-                self.G = generator(self.z, 
-                                   valence=self.valence, 
-                                   arousal=self.arousal)
-
-                # discriminator on z
-                self.D_z, self.D_z_logits = discriminator_z(self.z)
-
-                # discriminator on G
-                self.D_G, self.D_G_logits = discriminator_img(self.G, 
-                                                              valence=self.valence, 
-                                                              arousal=self.arousal)
-
-                # discriminator on z_prior
-                self.D_z_prior, self.D_z_prior_logits = discriminator_z(self.z_prior,
-                                                                        reuse_variables=True)
-
-                # discriminator on input image
-                self.D_input, self.D_input_logits = discriminator_img(self.input_image,
-                                                                      valence=self.valence,
-                                                                      arousal=self.arousal,
-                                                                      reuse_variables=True)
-                
-                # -- LOSSES ---------------------------------------------------------------
-                # -------------------------------------------------------------------------
-                
-                # ---- VGG LOSS --------------------------------------------------------- 
-                real_conv1_2, real_conv2_2, real_conv3_2, real_conv4_2, real_conv5_2 = face_embedding(self.vgg_weights, self.input_image[:16])
-                fake_conv1_2, fake_conv2_2, fake_conv3_2, fake_conv4_2, fake_conv5_2 = face_embedding(self.vgg_weights, self.G[:16])
-
-                conv1_2_loss = tf.reduce_mean(tf.abs(real_conv1_2 - fake_conv1_2)) / 224. / 224.
-                conv2_2_loss = tf.reduce_mean(tf.abs(real_conv2_2 - fake_conv2_2)) / 112. / 112.
-                conv3_2_loss = tf.reduce_mean(tf.abs(real_conv3_2 - fake_conv3_2)) / 56. / 56.
-                conv4_2_loss = tf.reduce_mean(tf.abs(real_conv4_2 - fake_conv4_2)) / 28. / 28.
-                conv5_2_loss = tf.reduce_mean(tf.abs(real_conv5_2 - fake_conv5_2)) / 14. / 14.
-                self.vgg_loss = conv1_2_loss + conv2_2_loss + conv3_2_loss + conv4_2_loss + conv5_2_loss
-                # -----------------------------------------------------------------------
-            
-            # reconstruction loss of encoder+generator
-            self.EG_loss = tf.reduce_mean(tf.abs(self.input_image - self.G))  # L1 loss
 
-            # loss function of discriminator on z
-            self.D_z_loss_prior = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(logits=self.D_z_prior_logits, labels=tf.ones_like(self.D_z_prior_logits))
-            )
-            self.D_z_loss_z = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(logits=self.D_z_logits, labels=tf.zeros_like(self.D_z_logits))
-            )
-            self.E_z_loss = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(logits=self.D_z_logits, labels=tf.ones_like(self.D_z_logits))
-            )
-            # loss function of discriminator on image
-            self.D_img_loss_input = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(logits=self.D_input_logits, labels=tf.ones_like(self.D_input_logits))
-            )
-            self.D_img_loss_G = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(logits=self.D_G_logits, labels=tf.zeros_like(self.D_G_logits))
-            )
-            self.G_img_loss = tf.reduce_mean(
-                tf.nn.sigmoid_cross_entropy_with_logits(logits=self.D_G_logits, labels=tf.ones_like(self.D_G_logits))
-            )
+            # -- NETWORKS AND LOSSES OF EACH TOWER ----------------------------------------
+            # -----------------------------------------------------------------------------
+            self.towers = []
+            for index, (device, inputs) in enumerate(zip(self.tower_devices, tower_inputs)):
+                with tower_scope(index, device, self.num_towers):
+                    self.towers.append(self.build_tower(*inputs, reuse_variables=index > 0))
+
+            # outputs and losses of the whole batch (those of the tower if there is only one)
+            for name in ['z', 'G', 'D_z', 'D_z_logits', 'D_G', 'D_G_logits',
+                         'D_z_prior', 'D_z_prior_logits', 'D_input', 'D_input_logits']:
+                setattr(self, name, combine_batch([getattr(tower, name) for tower in self.towers]))
+            for name in ['vgg_loss', 'EG_loss', 'D_z_loss_prior', 'D_z_loss_z', 'E_z_loss',
+                         'D_img_loss_input', 'D_img_loss_G', 'G_img_loss']:
+                setattr(self, name, combine_losses([getattr(tower, name) for tower in self.towers], self.tower_weights))
+
+            with tf.device(self.device):
+                # inference: encoder alone and generator alone
+                self.query_images, self.query_z, self.z_input, self.valence_input, self.arousal_input, \
+                    self.G_from_z = build_inference_graph(reuse_variables=True)
             
             # -- TRAINABLE VARIABLES ----------------------------------------------------------
             # ---------------------------------------------------------------------------------
@@ -159,227 +144,444 @@ class Model(object):
                 self.D_input_logits_summary = tf.summary.histogram('D_input_logits', self.D_input_logits)
                 self.vgg_loss_summary = tf.summary.scalar('VGG_loss', self.vgg_loss)
 
-                # for saving the graph and variables
-                self.saver = tf.train.Saver(max_to_keep=10)
+                # for saving the graph and variables (the fixed VGG face weights are loaded from vgg_face_path)
+                vgg_names = [var.name for var in vgg_variables()]
+                self.saver = tf.train.Saver(
+                    var_list=[var for var in tf.global_variables() if var.name not in vgg_names],
+                    max_to_keep=10
+                )
         
+    def build_tower(self, input_image, valence, arousal, z_prior, reuse_variables=False):
+        """
+        Creates the networks and losses for one slice of the batch.
+
+        @param input_image: tensor of size [batch_size, size_image, size_image, 3]
+        @param valence: tensor of size [batch_size, 1]
+        @param arousal: tensor of size [batch_size, 1]
+        @param z_prior: tensor of size [batch_size, num_z_channels]
+        @param reuse_variables: use the variables of the first tower (bool)
+
+        @return: Tower
+        """
+        tower = Tower()
+        dtype = self.compute_dtype
+
+        # -- NETWORKS -------------------------------------------------------------
+        # -------------------------------------------------------------------------
+        # computed in dtype (float32 unless mixed precision is on, see precision.py)
+        images, valence, arousal, z_prior = [cast(tensor, dtype) for tensor in (input_image, valence, arousal, z_prior)]
+        with precision_scope(dtype):
+
+            # encoder:  
+            z = encoder(images, reuse_variables=reuse_variables)
+
+            # generator: z + arousal + valence --> generated image   
+            G = generator(z, 
+                          valence=valence, 
+                          arousal=arousal,
+                          reuse_variables=reuse_variables)
+
+            # discriminator on z
+            D_z, D_z_logits = discriminator_z(z, reuse_variables=reuse_variables)
+
+            # discriminator on G
+            D_G, D_G_logits = discriminator_img(G, 
+                                                valence=valence, 
+                                                arousal=arousal,
+                                                reuse_variables=reuse_variables)
+
+            # discriminator on z_prior
+            D_z_prior, D_z_prior_logits = discriminator_z(z_prior,
+                                                          reuse_variables=True)
+
+            # discriminator on input image
+            D_input, D_input_logits = discriminator_img(images,
+                                                        valence=valence,
+                                                        arousal=arousal,
+                                                        reuse_variables=True)
+
+            # ---- VGG LOSS (on the first images of the slice, size_vgg_subset in total)
+            size_subset = max(size_vgg_subset // self.num_towers, 1)
+            tower.vgg_loss = identity_loss(images[:size_subset],
+                                           G[:size_subset],
+                                           input_size=vgg_input_size)
+
+        # outputs in float32
+        tower.z, tower.G = cast(z, tf.float32), cast(G, tf.float32)
+        tower.D_z, tower.D_z_logits = cast(D_z, tf.float32), cast(D_z_logits, tf.float32)
+        tower.D_G, tower.D_G_logits = cast(D_G, tf.float32), cast(D_G_logits, tf.float32)
+        tower.D_z_prior, tower.D_z_prior_logits = cast(D_z_prior, tf.float32), cast(D_z_prior_logits, tf.float32)
+        tower.D_input, tower.D_input_logits = cast(D_input, tf.float32), cast(D_input_logits, tf.float32)
+
+        # -- LOSSES (float32) -----------------------------------------------------
+        # -------------------------------------------------------------------------
+
+        # reconstruction loss of encoder+generator
+        tower.EG_loss = tf.reduce_mean(tf.abs(input_image - tower.G))  # L1 loss
+
+        # loss function of discriminator on z
+        tower.D_z_loss_prior = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower.D_z_prior_logits, labels=tf.ones_like(tower.D_z_prior_logits))
+        )
+        tower.D_z_loss_z = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower.D_z_logits, labels=tf.zeros_like(tower.D_z_logits))
+        )
+        tower.E_z_loss = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower.D_z_logits, labels=tf.ones_like(tower.D_z_logits))
+        )
+        # loss function of discriminator on image
+        tower.D_img_loss_input = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower.D_input_logits, labels=tf.ones_like(tower.D_input_logits))
+        )
+        tower.D_img_loss_G = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower.D_G_logits, labels=tf.zeros_like(tower.D_G_logits))
+        )
+        tower.G_img_loss = tf.reduce_mean(
+            tf.nn.sigmoid_cross_entropy_with_logits(logits=tower.D_G_logits, labels=tf.ones_like(tower.D_G_logits))
+        )
+        return tower
+
     def train(self,
               num_epochs=2,  # number of epochs
               learning_rate=0.0002,  # learning rate of optimizer
               beta1=0.5,  # parameter for Adam optimizer
               decay_rate=1.0,  # learning rate decay (0, 1], 1 means no decay
               use_trained_model=False,  # used the saved checkpoint to initialize the model
+              use_dataset_cache=False,  # read the training data from the compiled data set in training_cache_dir
               ):
         
-        # set learning rate decay
-        with tf.variable_scope(tf.get_variable_scope()):
-            with tf.device('/device:CPU:0'):
-                self.EG_global_step = tf.Variable(0, trainable=False, name='global_step')
+        # timings of the stages of the training loop, written to save_dir/metrics.jsonl
+        timers = StageTimers(os.path.join(save_dir, 'metrics.jsonl'), window=metrics_window)
+        # write a step number to save_dir/trace_step to trace that step
+        tracer = StepTracer(os.path.join(save_dir, 'trace_step'), os.path.join(save_dir, 'traces'))
+        eta = SmoothedETA()
 
-        
-        # -- LOAD FILE NAMES --------------------------------------------------------------
+        # -- LOAD DATA --------------------------------------------------------------------
         # ---------------------------------------------------------------------------------
-        # ---- TRAINING DATA
-        path = training_data_path
-        file_names = [path + x for x in os.listdir(path) if not int(x.split('s')[2])/1000 <-1]
-        file_names = self.fill_up_equally(file_names)
-        size_data = len(file_names)
-        np.random.shuffle(file_names)
-        # ---- VALIDATION DATA
-        val_path = validation_data_path
-        self.validation_files = [val_path + v for v in os.listdir(val_path) if not int(v.split('s')[2])/1000 <-1]
-        
-        # -- LOSS FUNCTIONS ---------------------------------------------------------------
-        # ---------------------------------------------------------------------------------
-        self.loss_EG = self.EG_loss + self.vgg_loss/3 +  0.01 * self.G_img_loss + 0.01 * self.E_z_loss 
-        self.loss_Di = self.D_img_loss_input + self.D_img_loss_G        
-        self.loss_Di = self.D_img_loss_input + self.D_img_loss_G
-        
-        
-        # -- OPTIMIZERS -------------------------------------------------------------------
-        # ---------------------------------------------------------------------------------
-        with tf.device('/device:GPU:0'): 
-            
-            EG_learning_rate = tf.train.exponential_decay(
-                learning_rate=learning_rate,
-                global_step=self.EG_global_step,
-                decay_steps=size_data / size_batch * 2,
-                decay_rate=decay_rate,
-                staircase=True
-            )
-
-            # optimizer for encoder + generator
-            self.EG_optimizer = tf.train.AdamOptimizer(
-                learning_rate=EG_learning_rate,
-                beta1=beta1
-            ).minimize(
-                loss=self.loss_EG,
-                global_step=self.EG_global_step,
-                var_list=self.E_variables + self.G_variables
-            )
-
-            # optimizer for discriminator on z
-            self.D_z_optimizer = tf.train.AdamOptimizer(
-                learning_rate=EG_learning_rate,
-                beta1=beta1
-            ).minimize(
-                loss=self.loss_Dz,
-                var_list=self.D_z_variables
-            )
-
-            # optimizer for discriminator on image
-            self.D_img_optimizer = tf.train.AdamOptimizer(
-                learning_rate=EG_learning_rate,
-                beta1=beta1
-            ).minimize(
-                loss=self.loss_Di,
-                var_list=self.D_img_variables
+        # ---- TRAINING DATA (the labels are parsed once, by the manifest)
+        label_start_time = time.time()
+        if use_dataset_cache:
+            if not cache_exists(training_cache_dir):
+                raise IOError("No compiled data set in %s, run dataset_cache.py first" % training_cache_dir)
+            source = DatasetCache(training_cache_dir, image_value_range=image_value_range)
+        else:
+            source = FileSource(
+                load_manifest(training_data_path),
+                image_size=size_image,
+                image_value_range=image_value_range,
+                num_threads=num_loader_threads
             )
+        source.indices = np.asarray(self.balance_categories(source.categories))
+        timers.add('label_parsing', time.time() - label_start_time)
+        size_data = len(source)
+        # ---- VALIDATION DATA (decoded once, on the first validation)
+        if use_dataset_cache and cache_exists(validation_cache_dir):
+            self.validation_set = ValidationSet.from_cache(validation_cache_dir)
+        else:
+            self.validation_set = ValidationSet.from_manifest(load_manifest(validation_data_path),
+                                                              num_threads=num_loader_threads)
         
-
-        # -- TENSORBOARD SUMMARY ----------------------------------------------------------
-        # ---------------------------------------------------------------------------------        
+        # -- LOSSES, OPTIMIZERS AND SUMMARIES ---------------------------------------------
+        # ---------------------------------------------------------------------------------
+        self.build_training_ops(
+            learning_rate=learning_rate,
+            beta1=beta1,
+            decay_rate=decay_rate,
+            decay_steps=size_data / size_batch * 2
+        )
         with tf.device('/device:CPU:0'):
-            self.EG_learning_rate_summary = tf.summary.scalar('EG_learning_rate', EG_learning_rate)
-            self.summary = tf.summary.merge([
-                self.z_summary, self.z_prior_summary,
-                self.D_z_loss_z_summary, self.D_z_loss_prior_summary,
-                self.D_z_logits_summary, self.D_z_prior_logits_summary,
-                self.EG_loss_summary, self.E_z_loss_summary,
-                self.D_img_loss_input_summary, self.D_img_loss_G_summary,
-                self.G_img_loss_summary, self.EG_learning_rate_summary,
-                self.D_G_logits_summary, self.D_input_logits_summary,
-                self.vgg_loss_summary
-            ])
+            # the writer saves the events on its own background thread
             self.writer = tf.summary.FileWriter(os.path.join(save_dir, 'summary'), self.session.graph)
         
         
 
         # ************* get some random samples as testing data to visualize the learning process *********************
-        sample_files = file_names[0:size_batch]
-
-        file_names[0:size_batch] = []
-
-        sample = [load_image(
-            image_path=sample_file,
-            image_size=size_image,
-            image_value_range=image_value_range,
-            is_gray=False,
-        ) for sample_file in sample_files]
-
-        sample_images = np.array(sample).astype(np.float32)
+        sample_images, sample_label_valence, sample_label_arousal = source.load(np.arange(size_batch))
+        source.indices = source.indices[size_batch:]
 
-        sample_label_valence = np.asarray([[int(x.split('s')[2]) / 1000] for x in sample_files])
-        sample_label_arousal = np.asarray([[int(x.split('s')[3][:-4]) / 1000] for x in sample_files])
+        # start loading the training batches in the background
+        pipeline = InputPipeline(
+            source,
+            batch_size=size_batch,
+            num_epochs=num_epochs,
+            shuffle=enable_shuffle,
+            num_prefetch=prefetch_batches
+        ).start()
 
 
         # ******************************************* training *******************************************************
-        print('\n\tPreparing for training ...')
+        log.info('Preparing for training ...')
 
         # initialize the graph
         tf.global_variables_initializer().run()
+        load_vgg_weights(self.session, vgg_face_path)
 
         # load check point
         if use_trained_model:
             if self.load_checkpoint():
-                print("\tSUCCESS ^_^")
+                log.info("Loaded the checkpoint")
             else:
-                print("\tFAILED >_<!")
+                log.warning("No checkpoint found, training from scratch")
+
+        # sampling, testing and validation run in the background on snapshots of the weights
+        evaluator = AsyncEvaluator(
+            self.session,
+            max_pending=max_pending_evaluations,
+            num_writers=num_writer_threads,
+            config=session_config(device_strategy, intra_op_threads, inter_op_threads)
+        )
 
         # epoch iteration
-        num_batches = len(file_names) // size_batch
+        num_batches = pipeline.num_batches
+        step = self.EG_global_step.eval()
+        last_time = None
         for epoch in range(num_epochs):
-            if enable_shuffle:
-                np.random.shuffle(file_names)
             for ind_batch in range(num_batches):
-                start_time = time.time()
-                # read batch images and labels
-                batch_files = file_names[ind_batch*size_batch:(ind_batch+1)*size_batch]
-                batch = [load_image(
-                    image_path=batch_file,
-                    image_size=size_image,
-                    image_value_range=image_value_range,
-                    is_gray=False,
-                ) for batch_file in batch_files]
-
-                batch_images = np.array(batch).astype(np.float32)
+                # duration of the last iteration, including its evaluations and checkpoints
+                now = time.time()
+                if last_time is not None:
+                    eta.update(now - last_time)
+                last_time = now
 
-                batch_label_valence =np.asarray([[int(x.split('s')[2]) / 1000] for x in batch_files])
-                batch_label_arousal = np.asarray([[int(x.split('s')[3][:-4]) / 1000] for x in batch_files])
+                # read batch images and labels
+                with timers.stage('data_loading'):
+                    batch_images, batch_label_valence, batch_label_arousal = pipeline.next_batch()
 
                 # prior distribution on the prior of z
-                batch_z_prior = np.random.uniform(
-                    image_value_range[0],
-                    image_value_range[-1],
-                    [size_batch, num_z_channels]
-                ).astype(np.float32)
-
-                # update
-                _, _, _, EG_err, Ez_err, Dz_err, Dzp_err, Gi_err, DiG_err, Di_err, TV, vgg = self.session.run(
-                    fetches = [
-                        self.EG_optimizer,
-                        self.D_z_optimizer,
-                        self.D_img_optimizer,
-                        self.EG_loss,
-                        self.E_z_loss,
-                        self.D_z_loss_z,
-                        self.D_z_loss_prior,
-                        self.G_img_loss,
-                        self.D_img_loss_G,
-                        self.D_img_loss_input,
-                        self.tv_loss,
-                        self.vgg_loss
-                    ],
-                    feed_dict={
-                        self.input_image: batch_images,
-                        self.valence: batch_label_valence,
-                        self.arousal: batch_label_arousal,
-                        self.z_prior: batch_z_prior
-                    }
-                )
-                print("\nEpoch: [%3d/%3d] Batch: [%3d/%3d]\n\tEG_err=%.4f\tVGG=%.4f" %
-                    (epoch+1, num_epochs, ind_batch+1, num_batches, EG_err, vgg))
-                print("\tEz=%.4f\tDz=%.4f\tDzp=%.4f" % (Ez_err, Dz_err, Dzp_err))
-                print("\tGi=%.4f\tDi=%.4f\tDiG=%.4f" % (Gi_err, Di_err, DiG_err))
-
-                # estimate left run time
-                elapse = time.time() - start_time
-                time_left = ((num_epochs - epoch - 1) * num_batches + (num_batches - ind_batch - 1)) * elapse
-                print("\tTime left: %02d:%02d:%02d" %
-                      (int(time_left / 3600), int(time_left % 3600 / 60), time_left % 60))
-
+                with timers.stage('z_prior'):
+                    batch_z_prior = np.random.uniform(
+                        image_value_range[0],
+                        image_value_range[-1],
+                        [size_batch, num_z_channels]
+                    ).astype(np.float32)
+
+                # summaries are evaluated in the same run as the update
+                summaries = []
+                if step % summary_interval == 0:
+                    summaries.append(self.summary)
+                if step % histogram_interval == 0:
+                    summaries.append(self.histogram_summary)
+
+                # update (traced if requested in the trigger file)
+                run_options, run_metadata = tracer.options(step + 1)
+                with timers.stage('train_step'):
+                    results = self.train_step(batch_images, batch_label_valence, batch_label_arousal,
+                                              batch_z_prior, summaries,
+                                              options=run_options, run_metadata=run_metadata)
+                _, _, _, EG_err, Ez_err, Dz_err, Dzp_err, Gi_err, DiG_err, Di_err, vgg = results[:11]
+                step += 1
+                if run_metadata is not None:
+                    log.info("Trace of step %d saved to %s", step, tracer.save(step, run_metadata, self.writer))
 
                 # add to summary
-                summary = self.summary.eval(
-                    feed_dict={
-                        self.input_image: batch_images,
-                        self.valence: batch_label_valence,
-                        self.arousal: batch_label_arousal,
-                        self.z_prior: batch_z_prior
-                    }
-                )
-                self.writer.add_summary(summary, self.EG_global_step.eval())
+                with timers.stage('summary_writing'):
+                    for summary in results[11:]:
+                        self.writer.add_summary(summary, step)
+
+                # estimate left run time
+                time_left = eta.seconds_left((num_epochs - epoch - 1) * num_batches + (num_batches - ind_batch - 1))
+
+                # printed to the console every log_console_interval steps
+                log.info("Epoch: [%3d/%3d] Batch: [%3d/%3d]\n\tEG_err=%.4f\tVGG=%.4f"
+                         "\n\tEz=%.4f\tDz=%.4f\tDzp=%.4f"
+                         "\n\tGi=%.4f\tDi=%.4f\tDiG=%.4f"
+                         "\n\tTime left: %02d:%02d:%02d",
+                         epoch+1, num_epochs, ind_batch+1, num_batches, EG_err, vgg,
+                         Ez_err, Dz_err, Dzp_err,
+                         Gi_err, Di_err, DiG_err,
+                         int(time_left / 3600), int(time_left % 3600 / 60), time_left % 60,
+                         extra={'step': step})
+
+                if step % metrics_interval == 0:
+                    timers.write(step, epoch=epoch+1, step_time=eta.step_time, time_left=time_left,
+                                 input_pipeline=pipeline.stats())
 
                 if ind_batch%500 == 0:
+                    # check that the input pipeline keeps up with the training step
+                    stats = pipeline.stats()
+                    log.info("Input pipeline: %.1f images/sec (loading %.1f images/sec), waited %.1fs in total",
+                             stats['images_per_sec'], stats['load_images_per_sec'], stats['wait_time'])
+
                     # save sample images for each epoch
                     name = '{:02d}_{:02d}'.format(epoch+1, ind_batch)
-                    self.sample(sample_images, sample_label_valence, sample_label_arousal, name+'.png')
-                    # TEST
-                    test_dir = os.path.join(save_dir, 'test')
-                    if not os.path.exists(test_dir):
-                        os.makedirs(test_dir)
-                    self.test(sample_images, test_dir, name+'.png')
+                    with timers.stage('sampling'):
+                        evaluator.submit(save_samples,
+                                         images=sample_images,
+                                         valence=sample_label_valence,
+                                         arousal=sample_label_arousal,
+                                         sample_dir=os.path.join(save_dir, 'samples'),
+                                         name=name+'.png')
+                        # TEST
+                        evaluator.submit(save_test,
+                                         images=sample_images,
+                                         test_dir=os.path.join(save_dir, 'test'),
+                                         name=name+'.png')
+                    if evaluator.dropped_jobs:
+                        log.warning("Evaluation: %d jobs dropped, evaluation is slower than training", evaluator.dropped_jobs)
 
             # save checkpoint for each epoch
             # VALIDATE
             name = '{:02d}_model'.format(epoch+1)
-            self.validate(name)
-            self.save_checkpoint(name=name)
+            with timers.stage('validation'):
+                evaluator.submit(save_validation,
+                                 block=True,
+                                 validation_set=self.validation_set,
+                                 validation_dir=os.path.join(save_dir, 'validation', name),
+                                 images_per_run=validation_images_per_run)
+            with timers.stage('checkpoint'):
+                self.save_checkpoint(name=name)
+            timers.write(step, epoch=epoch+1, step_time=eta.step_time, input_pipeline=pipeline.stats())
+
+        pipeline.stop()
+        evaluator.close()
+        timers.close()
 
         # save the trained model
         #self.save_checkpoint()
         # close the summary writer
         #self.writer.close()
 
+    def build_training_ops(self,
+                           learning_rate=0.0002,  # learning rate of optimizer
+                           beta1=0.5,  # parameter for Adam optimizer
+                           decay_rate=1.0,  # learning rate decay (0, 1], 1 means no decay
+                           decay_steps=1000,  # number of steps between two decays of the learning rate
+                           ):
+        """
+        Creates the global step, the losses, the three optimizers and the merged summaries of the training.
+        """
+        # set learning rate decay
+        with tf.variable_scope(tf.get_variable_scope()):
+            with tf.device('/device:CPU:0'):
+                self.EG_global_step = tf.Variable(0, trainable=False, name='global_step')
+
+        # -- LOSS FUNCTIONS ---------------------------------------------------------------
+        # ---------------------------------------------------------------------------------
+        for tower in self.towers:
+            tower.loss_EG = tower.EG_loss + tower.vgg_loss/3 +  0.01 * tower.G_img_loss + 0.01 * tower.E_z_loss 
+            tower.loss_Dz = tower.D_z_loss_prior + tower.D_z_loss_z
+            tower.loss_Di = tower.D_img_loss_input + tower.D_img_loss_G
+        self.loss_EG = combine_losses([tower.loss_EG for tower in self.towers], self.tower_weights)
+        self.loss_Dz = combine_losses([tower.loss_Dz for tower in self.towers], self.tower_weights)
+        self.loss_Di = combine_losses([tower.loss_Di for tower in self.towers], self.tower_weights)
+        
+        
+        # -- OPTIMIZERS -------------------------------------------------------------------
+        # ---------------------------------------------------------------------------------
+        # the gradients are computed on the device of each tower and averaged,
+        # the losses are scaled for float16 (see precision.py)
+        with tf.device(self.device):
+            
+            EG_learning_rate = tf.train.exponential_decay(
+                learning_rate=learning_rate,
+                global_step=self.EG_global_step,
+                decay_steps=decay_steps,
+                decay_rate=decay_rate,
+                staircase=True
+            )
+
+            # optimizer for encoder + generator
+            optimizer = loss_scale_optimizer(
+                tf.train.AdamOptimizer(learning_rate=EG_learning_rate, beta1=beta1),
+                self.compute_dtype,
+                loss_scale
+            )
+            self.EG_optimizer = optimizer.apply_gradients(
+                tower_gradients(optimizer,
+                                [tower.loss_EG for tower in self.towers],
+                                self.E_variables + self.G_variables,
+                                self.tower_devices,
+                                self.tower_weights),
+                global_step=self.EG_global_step
+            )
+
+            # optimizer for discriminator on z
+            optimizer = loss_scale_optimizer(
+                tf.train.AdamOptimizer(learning_rate=EG_learning_rate, beta1=beta1),
+                self.compute_dtype,
+                loss_scale
+            )
+            self.D_z_optimizer = optimizer.apply_gradients(
+                tower_gradients(optimizer,
+                                [tower.loss_Dz for tower in self.towers],
+                                self.D_z_variables,
+                                self.tower_devices,
+                                self.tower_weights)
+            )
+
+            # optimizer for discriminator on image
+            optimizer = loss_scale_optimizer(
+                tf.train.AdamOptimizer(learning_rate=EG_learning_rate, beta1=beta1),
+                self.compute_dtype,
+                loss_scale
+            )
+            self.D_img_optimizer = optimizer.apply_gradients(
+                tower_gradients(optimizer,
+                                [tower.loss_Di for tower in self.towers],
+                                self.D_img_variables,
+                                self.tower_devices,
+                                self.tower_weights)
+            )
+        
+
+        # -- TENSORBOARD SUMMARY ----------------------------------------------------------
+        # ---------------------------------------------------------------------------------        
+        with tf.device('/device:CPU:0'):
+            self.EG_learning_rate_summary = tf.summary.scalar('EG_learning_rate', EG_learning_rate)
+            # scalars, written every summary_interval steps
+            self.summary = tf.summary.merge([
+                self.D_z_loss_z_summary, self.D_z_loss_prior_summary,
+                self.EG_loss_summary, self.E_z_loss_summary,
+                self.D_img_loss_input_summary, self.D_img_loss_G_summary,
+                self.G_img_loss_summary, self.EG_learning_rate_summary,
+                self.vgg_loss_summary
+            ])
+            # histograms, written every histogram_interval steps
+            self.histogram_summary = tf.summary.merge([
+                self.z_summary, self.z_prior_summary,
+                self.D_z_logits_summary, self.D_z_prior_logits_summary,
+                self.D_G_logits_summary, self.D_input_logits_summary
+            ])
+
+    def train_step(self, images, valence, arousal, z_prior, summaries=(), options=None, run_metadata=None):
+        """
+        Runs one update of encoder + generator and of both discriminators.
+
+        @param images: numpy array of shape [size_batch, size_image, size_image, 3]
+        @param valence: numpy array of shape [size_batch, 1]
+        @param arousal: numpy array of shape [size_batch, 1]
+        @param z_prior: numpy array of shape [size_batch, num_z_channels]
+        @param summaries: merged summaries to evaluate in the same run
+        @param options: (optional) tf.RunOptions of the run, e.g. for tracing
+        @param run_metadata: (optional) tf.RunMetadata filled by the run
+
+        @return: results of the three optimizers, EG_loss, E_z_loss, D_z_loss_z, D_z_loss_prior,
+                 G_img_loss, D_img_loss_G, D_img_loss_input and vgg_loss, followed by the summaries
+        """
+        return self.session.run(
+            fetches = [
+                self.EG_optimizer,
+                self.D_z_optimizer,
+                self.D_img_optimizer,
+                self.EG_loss,
+                self.E_z_loss,
+                self.D_z_loss_z,
+                self.D_z_loss_prior,
+                self.G_img_loss,
+                self.D_img_loss_G,
+                self.D_img_loss_input,
+                self.vgg_loss
+            ] + list(summaries),
+            feed_dict={
+                self.input_image: images,
+                self.valence: valence,
+                self.arousal: arousal,
+                self.z_prior: z_prior
+            },
+            options=options,
+            run_metadata=run_metadata
+        )
+
     def save_checkpoint(self, name=''):
         checkpoint_dir = os.path.join(save_dir, 'checkpoint')
         if not os.path.exists(checkpoint_dir):
@@ -390,7 +592,7 @@ class Model(object):
         )
 
     def load_checkpoint(self):
-        print("\n\tLoading pre-trained model ...")
+        log.info("Loading pre-trained model ...")
         checkpoint_dir = os.path.join(save_dir, 'checkpoint')
         checkpoints = tf.train.get_checkpoint_state(checkpoint_dir)
         if checkpoints and checkpoints.model_checkpoint_path:
@@ -401,81 +603,52 @@ class Model(object):
             return False
 
     def sample(self, images, valence, arousal, name):
-        sample_dir = os.path.join(save_dir, 'samples')
-        if not os.path.exists(sample_dir):
-            os.makedirs(sample_dir)
-        z, G = self.session.run(
-            [self.z, self.G],
+        save_samples(self, images, valence, arousal, os.path.join(save_dir, 'samples'), name)
+
+    def validate(self, name):
+        with ThreadPoolExecutor(max_workers=num_writer_threads) as writer:
+            save_validation(self, self.validation_set, os.path.join(save_dir, 'validation', name),
+                            images_per_run=validation_images_per_run, writer=writer)
+
+    def encode(self, images):
+        """
+        @param images: numpy array of shape [n, size_image, size_image, 3]
+
+        @return: z: numpy array of shape [n, num_z_channels]
+        """
+        return self.session.run(self.query_z, feed_dict={self.query_images: images})
+
+    def generate(self, z, valence, arousal):
+        """
+        @param z: numpy array of shape [n, num_z_channels]
+        @param valence: numpy array of shape [n, 1]
+        @param arousal: numpy array of shape [n, 1]
+
+        @return: generated images: numpy array of shape [n, size_image, size_image, 3]
+        """
+        return self.session.run(
+            self.G_from_z,
             feed_dict={
-                self.input_image: images,
-                self.valence: valence,
-                self.arousal: arousal
+                self.z_input: z,
+                self.valence_input: valence,
+                self.arousal_input: arousal
             }
         )
-        size_frame = int(np.sqrt(size_batch))
-        save_batch_images(
-            batch_images=G,
-            save_path=os.path.join(sample_dir, name),
-            image_value_range=image_value_range,
-            size_frame=[size_frame, size_frame]
-        )
-
-        save_batch_images(
-            batch_images=images,
-            save_path=os.path.join(sample_dir, "input.png"),
-            image_value_range=image_value_range,
-            size_frame=[size_frame, size_frame]
-        )
-
-    def validate(self, name):
-        # Create Validation Directory if needed
-        val_dir = os.path.join(save_dir, 'validation')
-        if not os.path.exists(val_dir):
-            os.makedirs(val_dir)
-        # Create Name Directory if needed
-        name_dir = os.path.join(val_dir, name)
-        if not os.path.exists(name_dir):
-            os.makedirs(name_dir)
-
-        # validate
-        for image_path in self.validation_files:
-            n = image_path.split("/")[3].split("s")[0]+ ".png"
-            self.test(np.array([load_image(image_path, image_size=96)]), name_dir, n)
 
     def test(self, images, test_dir, name):
-        images = images[:1, :, :, :]
+        save_test(self, images, test_dir, name)
 
-        # valence
-        valence = np.arange(0.75, -0.751, -0.25)
-        valence = np.repeat(valence, 7).reshape((49, 1))
 
-        # arousal
-        arousal = [np.arange(0.75, -0.751, -0.25)]
-        arousal = np.repeat(arousal, 7, axis=0)
-        arousal = np.asarray([item for sublist in arousal for item in sublist]).reshape((49, 1))
+    def balance_categories(self, categories):
+        """
+        Oversamples the samples of each category until all categories are equally frequent.
 
-        query_images = np.tile(images, (49, 1, 1, 1))
+        @param categories: category (0-7) of each sample
 
-        z, G = self.session.run(
-            [self.z, self.G],
-            feed_dict={
-                self.input_image: query_images,
-                self.valence: valence,
-                self.arousal: arousal
-            }
-        )
-
-        save_output(
-            input_image=images,
-            output=G,
-            path=os.path.join(test_dir, name),
-            image_value_range = image_value_range,
-            size_frame=[7, 10]
-        )
-
-
-    def fill_up_equally(self, X):
-        sorted_samples = [[x for x in X if int(x.split('s')[1]) == r] for r in range(8)]
+        @return: shuffled list of sample indices
+        """
+        categories = np.asarray(categories)
+        sorted_samples = [list(np.flatnonzero(categories == r)) for r in range(8)]
 
         amounts = [len(x) for x in sorted_samples]
         differences = [max(amounts) - a for a in amounts]
@@ -487,26 +660,6 @@ class Model(object):
 
         sorted_samples_flat = [item for sublist in sorted_samples for item in sublist]
 
-        np.random.seed = 14031993
         np.random.shuffle(sorted_samples_flat)
 
         return sorted_samples_flat
-
-
-class Logger(object):
-    def __init__(self, output_file):
-        self.terminal = sys.stdout
-        self.log = open(output_file, "a")
-
-    def write(self, message):
-        self.terminal.write(message)
-        if not self.log.closed:
-            self.log.write(message)
-
-    def close(self):
-        self.log.close()
-
-    def flush(self):
-        self.close()
-        # needed for python 3 compatibility
-        pass
\ No newline at end of file
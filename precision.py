@@ -0,0 +1,82 @@
+"""
+Mixed precision training.
+
+With compute_dtype 'float16', the networks of the training graph compute in
+that type, while their variables (the master weights) and the optimizer state stay in
+float32: precision_scope() installs a custom getter that creates float32 variables and
+hands the networks a cast of them. Batch normalization, the losses and the reductions of
+the VGG loss are computed in float32.
+
+float16 has a small exponent range, so its gradients are computed on a scaled loss:
+loss_scale_optimizer() wraps the optimizers, which unscales the gradients and, with a
+dynamic loss scale, skips updates with infinite gradients and adapts the scale.
+
+bfloat16 is not offered: tensorflow 1.14 has no bfloat16 convolution kernels on GPU, nor
+on CPU without MKL.
+"""
+import contextlib
+
+import tensorflow as tf
+
+COMPUTE_DTYPES = ['float32', 'float16']
+
+
+def resolve_dtype(name):
+    """
+    @param name: 'float32' or 'float16'
+
+    @return: tf.DType
+    """
+    if name not in COMPUTE_DTYPES:
+        raise ValueError("Unknown compute dtype '%s', expected one of %s" % (name, ', '.join(COMPUTE_DTYPES)))
+    return tf.as_dtype(name)
+
+
+def cast(tensor, dtype):
+    """
+    @return: tensor cast to dtype, or tensor itself if it already has dtype
+    """
+    return tensor if tensor.dtype.base_dtype == dtype else tf.cast(tensor, dtype)
+
+
+def float32_variable_getter(dtype):
+    """
+    @param dtype: compute dtype of the networks
+
+    @return: custom getter creating float32 variables for variables requested in dtype
+             and returning them cast to dtype
+    """
+    def custom_getter(getter, name, *args, **kwargs):
+        requested = kwargs.get('dtype')
+        if requested is not None and tf.as_dtype(requested).base_dtype == dtype:
+            kwargs['dtype'] = tf.float32
+            return tf.cast(getter(name, *args, **kwargs), dtype)
+        return getter(name, *args, **kwargs)
+    return custom_getter
+
+
+@contextlib.contextmanager
+def precision_scope(dtype):
+    """
+    Variables created in this scope are float32 master weights of networks computing in dtype.
+    Does nothing for float32, so the graph is the same as without the scope.
+    """
+    if dtype == tf.float32:
+        yield
+    else:
+        with tf.variable_scope(tf.get_variable_scope(), custom_getter=float32_variable_getter(dtype),
+                               auxiliary_name_scope=False):
+            yield
+
+
+def loss_scale_optimizer(optimizer, dtype, loss_scale='dynamic'):
+    """
+    @param optimizer: tf.train.Optimizer
+    @param dtype: compute dtype of the networks
+    @param loss_scale: 'dynamic' or a fixed loss scale (float)
+
+    @return: optimizer scaling the loss for float16, otherwise optimizer itself
+    """
+    if dtype != tf.float16:
+        return optimizer
+    return tf.train.experimental.MixedPrecisionLossScaleOptimizer(optimizer, loss_scale=loss_scale)
@@ -0,0 +1,256 @@
+"""
+Post-training int8 quantization of the encoder and generator for inference on CPU.
+
+Converts the frozen inference graph written by export.py into two TensorFlow Lite models,
+encoder.tflite and generator.tflite, in one directory. Pass that directory as model path
+to inference.load_inference_model (e.g. via experiment.apply_network_to_images_of_dir).
+
+- weights: weight-only int8; the weights are stored as int8 and the dense and convolution
+  layers run with hybrid kernels that quantize their activations on the fly
+- int8: weights and activations int8; the activation ranges are calibrated on real faces,
+  for the generator on the codes of these faces with labels of the emotion grid. Ops
+  without an int8 kernel stay float
+
+Calibration and comparison faces are two disjoint random samples of the images in
+--data_dir, by default the validation data (validation_data_path in config.py).
+Afterwards, the quantized models are compared with the float model on the comparison faces: the error of z, the per-pixel error of the generator alone and of
+encoder and generator together, and the identity distance (the identity preserving loss
+of the VGG face model) between float and quantized outputs. The report also holds the
+size on disk and the images/sec of both on CPU and is written to quantization.json. The
+TensorFlow Lite interpreter of tensorflow 1.14 runs on a single thread, while the float
+model uses the thread pools of config.py, whose sizes are part of the report.
+
+    python quantize.py --graph ./export/inference_model.pb [--data_dir <validation_data_path>] [--mode int8] [--output ./export/quantized]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import image_value_range, size_image, size_batch, num_z_channels, intra_op_threads, inter_op_threads, \
+    validation_data_path, vgg_face_path, vgg_input_size
+from devices import session_config
+from image_decode import load_images
+from image_utils import to_uint8
+from inference import emotion_grid, load_inference_model, ENCODER_FILE, GENERATOR_FILE, OUTPUT_NAMES
+from vgg_face import identity_loss, load_vgg_weights
+
+QUANTIZATION_MODES = ['weights', 'int8']
+
+
+def convert(graph_path, input_names, output_name, input_shapes, mode, representative_data=None):
+    """
+    Converts a branch of the frozen inference graph into a quantized TensorFlow Lite model.
+
+    @param graph_path: path of the frozen graph written by export.py (string)
+    @param input_names: names of the input placeholders (list of strings)
+    @param output_name: name of the output tensor (string)
+    @param input_shapes: shapes of the inputs with fixed batch size (list of lists)
+    @param mode: 'weights' or 'int8'
+    @param representative_data: function returning the calibration inputs, a list with one
+                                array per input for each run (required for 'int8')
+
+    @return: serialized TensorFlow Lite model (bytes)
+    """
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(
+        graph_path, input_names, [output_name], input_shapes=dict(zip(input_names, input_shapes)))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'int8':
+        converter.representative_dataset = tf.lite.RepresentativeDataset(representative_data)
+    return converter.convert()
+
+
+def quantize(graph_path, output_dir, mode, calibration_images, encoder_batch=1, generator_batch=size_batch):
+    """
+    Quantizes the encoder and the generator of a frozen inference graph.
+
+    @param graph_path: path of the frozen graph written by export.py (string)
+    @param output_dir: directory to save encoder.tflite and generator.tflite to (string)
+    @param mode: 'weights' or 'int8'
+    @param calibration_images: real faces calibrating the activation ranges of 'int8',
+                               numpy array of shape [n, size_image, size_image, 3]
+    @param encoder_batch: batch size of the quantized encoder (int)
+    @param generator_batch: batch size of the quantized generator (int)
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError("Unknown quantization mode '%s', expected one of %s" % (mode, ', '.join(QUANTIZATION_MODES)))
+
+    # codes of the calibration faces for the generator, with labels cycling through the emotion grid
+    model = load_inference_model(graph_path, config=session_config('cpu', intra_op_threads, inter_op_threads))
+    with model:
+        calibration_z = model.encode(calibration_images)
+    valence, arousal = emotion_grid()
+    labels = np.arange(len(calibration_z)) % len(valence)
+
+    def encoder_data():
+        for start in range(0, len(calibration_images) - encoder_batch + 1, encoder_batch):
+            yield [calibration_images[start:start + encoder_batch]]
+
+    def generator_data():
+        for start in range(0, len(calibration_z) - generator_batch + 1, generator_batch):
+            batch = labels[start:start + generator_batch]
+            yield [calibration_z[start:start + generator_batch], valence[batch], arousal[batch]]
+
+    encoder_model = convert(graph_path, ['query_images'], OUTPUT_NAMES[0],
+                            [[encoder_batch, size_image, size_image, 3]], mode, encoder_data)
+    generator_model = convert(graph_path, ['z_input', 'valence_input', 'arousal_input'], OUTPUT_NAMES[1],
+                              [[generator_batch, num_z_channels], [generator_batch, 1], [generator_batch, 1]],
+                              mode, generator_data)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(os.path.join(output_dir, ENCODER_FILE), 'wb') as f:
+        f.write(encoder_model)
+    with open(os.path.join(output_dir, GENERATOR_FILE), 'wb') as f:
+        f.write(generator_model)
+
+
+def pixel_error(images, reference):
+    """
+    @param images: numpy array of images with pixel values in image_value_range
+    @param reference: numpy array of the same shape
+
+    @return: dictionary of the mean, 99th percentile and maximal absolute error of the
+             uint8 pixel values and the PSNR (dB)
+    """
+    error = np.abs(to_uint8(images, image_value_range).astype(np.int16) -
+                   to_uint8(reference, image_value_range).astype(np.int16))
+    mse = np.mean(np.square(error, dtype=np.float64))
+    return {
+        'mean_abs': float(np.mean(error)),
+        'p99_abs': float(np.percentile(error, 99)),
+        'max_abs': int(np.max(error)),
+        'psnr': float(10 * np.log10(255. ** 2 / mse)) if mse > 0 else float('inf'),
+    }
+
+
+def identity_distance(images, reference, batch_size=size_batch):
+    """
+    @param images: numpy array of shape [n, size_image, size_image, 3]
+    @param reference: numpy array of the same shape
+
+    @return: mean identity preserving loss of the VGG face model between images and reference
+    """
+    graph = tf.Graph()
+    with graph.as_default(), \
+            tf.Session(graph=graph, config=session_config('cpu', intra_op_threads, inter_op_threads)) as session:
+        real = tf.placeholder(tf.float32, [None, size_image, size_image, 3])
+        fake = tf.placeholder(tf.float32, [None, size_image, size_image, 3])
+        loss = identity_loss(real, fake, input_size=vgg_input_size)
+        load_vgg_weights(session, vgg_face_path)
+        total = 0.
+        for start in range(0, len(images), batch_size):
+            feed_dict = {real: reference[start:start + batch_size], fake: images[start:start + batch_size]}
+            total += session.run(loss, feed_dict=feed_dict) * len(feed_dict[real])
+    return total / len(images)
+
+
+def run_model(model, images):
+    """
+    Encodes images and generates the emotion grid of each image.
+
+    @return: z, generated grids of shape [len(images) * 49, ...], and the time in seconds
+    """
+    valence, arousal = emotion_grid()
+    start_time = time.time()
+    z = model.encode(images)
+    generated = model.generate(np.repeat(z, len(valence), axis=0),
+                               np.tile(valence, (len(images), 1)),
+                               np.tile(arousal, (len(images), 1)))
+    return z, generated, time.time() - start_time
+
+
+def compare(graph_path, quantized_dir, images):
+    """
+    Compares the quantized encoder and generator with the float frozen graph on images.
+
+    @param graph_path: path of the frozen graph written by export.py (string)
+    @param quantized_dir: directory of the quantized models (string)
+    @param images: numpy array of shape [n, size_image, size_image, 3]
+
+    @return: dictionary of the errors, sizes, speeds and the thread counts of the speeds
+    """
+    valence, arousal = emotion_grid()
+    with load_inference_model(graph_path, config=session_config('cpu', intra_op_threads, inter_op_threads)) as model:
+        # first run builds the kernels
+        run_model(model, images[:1])
+        z, generated, time_float = run_model(model, images)
+    with load_inference_model(quantized_dir) as model:
+        run_model(model, images[:1])
+        z_quantized, generated_quantized, time_quantized = run_model(model, images)
+        # quantized generator alone, on the codes of the float encoder
+        generated_from_z = model.generate(np.repeat(z, len(valence), axis=0),
+                                          np.tile(valence, (len(images), 1)),
+                                          np.tile(arousal, (len(images), 1)))
+
+    num_generated = len(generated)
+    report = {
+        'num_images': len(images),
+        'z_mean_abs': float(np.mean(np.abs(z_quantized - z))),
+        'generator': pixel_error(generated_from_z, generated),
+        'encoder_generator': pixel_error(generated_quantized, generated),
+        'size_float': os.path.getsize(graph_path),
+        'size_quantized': sum(os.path.getsize(os.path.join(quantized_dir, f)) for f in [ENCODER_FILE, GENERATOR_FILE]),
+        'images_per_sec_float': num_generated / time_float,
+        'images_per_sec_quantized': num_generated / time_quantized,
+        # the float session's thread pools, the interpreter always runs on one thread
+        'threads_float': {'intra_op': intra_op_threads, 'inter_op': inter_op_threads},
+        'threads_quantized': 1,
+    }
+    if os.path.exists(vgg_face_path):
+        report['encoder_generator']['identity_distance'] = float(identity_distance(generated_quantized, generated))
+    else:
+        print("No VGG face weights at %s, skipping the identity distance" % vgg_face_path)
+    return report
+
+
+def sample_faces(data_dir, num_calibration, num_evaluation, seed=0):
+    """
+    @return: two disjoint random samples of the faces in data_dir, for calibration and evaluation
+    """
+    files = sorted(os.listdir(data_dir))
+    random.Random(seed).shuffle(files)
+    paths = [os.path.join(data_dir, f) for f in files[:num_calibration + num_evaluation]]
+    images = load_images(paths, image_size=size_image, image_value_range=image_value_range)
+    return images[:num_calibration], images[num_calibration:]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--graph', default='./export/inference_model.pb', help='frozen graph written by export.py')
+    parser.add_argument('--output', default='./export/quantized', help='directory of the quantized models')
+    parser.add_argument('--mode', default='int8', choices=QUANTIZATION_MODES)
+    parser.add_argument('--data_dir', default=validation_data_path, help='real faces, split into disjoint calibration and comparison samples (default: validation data)')
+    parser.add_argument('--num_calibration', type=int, default=490)
+    parser.add_argument('--num_evaluation', type=int, default=20, help='faces whose emotion grids are compared')
+    parser.add_argument('--encoder_batch', type=int, default=1)
+    parser.add_argument('--generator_batch', type=int, default=size_batch)
+    args = parser.parse_args()
+
+    calibration_images, evaluation_images = sample_faces(args.data_dir, args.num_calibration, args.num_evaluation)
+    quantize(args.graph, args.output, args.mode, calibration_images, args.encoder_batch, args.generator_batch)
+    report = compare(args.graph, args.output, evaluation_images)
+    report['mode'] = args.mode
+
+    with open(os.path.join(args.output, 'quantization.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("Quantized (%s) encoder and generator saved to %s" % (args.mode, args.output))
+    print("\tsize on disk:  float %7.1f MB  quantized %7.1f MB  (%.1fx smaller)" %
+          (report['size_float'] / 1e6, report['size_quantized'] / 1e6, report['size_float'] / report['size_quantized']))
+    print("\timages/sec:    float %7.1f     quantized %7.1f     (%.2fx; float with %d intra-op and %d inter-op "
+          "threads, quantized with 1 thread)" %
+          (report['images_per_sec_float'], report['images_per_sec_quantized'],
+           report['images_per_sec_quantized'] / report['images_per_sec_float'],
+           intra_op_threads, inter_op_threads))
+    print("\tz:             mean abs error %.4f" % report['z_mean_abs'])
+    for name in ['generator', 'encoder_generator']:
+        error = report[name]
+        print("\t%-17s mean abs %.2f  p99 abs %.0f  max abs %d  PSNR %.1f dB%s" % (
+            name.replace('_', '+') + ':', error['mean_abs'], error['p99_abs'], error['max_abs'], error['psnr'],
+            '  identity distance %.5f' % error['identity_distance'] if 'identity_distance' in error else ''))
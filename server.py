@@ -0,0 +1,327 @@
+"""
+Local inference server editing faces with a trained model.
+
+The model (a checkpoint, an export of export.py or the quantized models of quantize.py,
+see inference.load_inference_model) is loaded once and kept in memory. Edit requests
+are handled by concurrent HTTP threads and queued to a DynamicBatcher, which groups them
+into batches: a batch is closed when it holds server_max_batch_images generated images
+or server_max_latency seconds after its first request arrived, whichever comes first.
+All input images of a batch are encoded in one session call and all their targets are
+generated in one session call, then every request gets its own images back. The codes z
+are cached by image content (see latent_cache.py): a face that was edited before skips
+decoding and the encoder and goes straight to the generator.
+
+Endpoints (localhost only by default):
+
+- POST /edit: JSON {"image": <base64 encoded image file>, "targets": [[valence, arousal], ...]},
+  without targets the 49 labels of the emotion grid are generated. Returns JSON
+  {"images": [<base64 encoded PNG>, ...]} with one image per target.
+- GET /stats: queue depth, histogram of the batch sizes (requests per batch), p50/p99
+  latency from arrival of a request to its result, over the last requests, and the hits
+  and misses of the latent cache
+
+    python server.py [--model_path ./export/inference_model.pb] [--port 8000]
+"""
+import argparse
+import base64
+import collections
+import io
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+from PIL import Image
+
+from config import image_value_range, size_image, device_strategy, intra_op_threads, inter_op_threads, \
+    server_host, server_port, server_max_batch_images, server_max_latency, latent_cache_size, latent_cache_dir
+from devices import session_config
+from image_decode import decode_image, uint8_to_range
+from image_utils import to_uint8
+from inference import emotion_grid, load_inference_model
+from latent_cache import LatentCache, content_key, model_id
+
+log = logging.getLogger(__name__)
+
+
+class EditRequest(object):
+    """
+    An input image, or its code z, and the labels to generate it with.
+    """
+    def __init__(self, image, valence, arousal, key=None, z=None):
+        """
+        @param image: numpy array of shape [size_image, size_image, 3], None if z is given
+        @param valence: numpy array of shape [n, 1]
+        @param arousal: numpy array of shape [n, 1]
+        @param key: (optional) content key of the image in the latent cache (string)
+        @param z: (optional) cached code of the image, numpy array of shape [num_z_channels]
+        """
+        self.image = image
+        self.valence = valence
+        self.arousal = arousal
+        self.key = key
+        self.z = z
+        self.future = Future()
+        self.arrival = time.time()
+
+
+class DynamicBatcher(object):
+    """
+    Groups concurrent edit requests into batches, which a single thread runs on the model.
+    """
+    def __init__(self, model, max_batch_images=server_max_batch_images, max_latency=server_max_latency, window=1000,
+                 cache=None):
+        """
+        @param model: model providing encode() and generate()
+        @param max_batch_images: maximal number of generated images of a batch, a request with
+                                 more targets forms a batch of its own (int)
+        @param max_latency: maximal time a batch waits for further requests after its first (sec)
+        @param window: number of most recent requests in the latency statistics (int)
+        @param cache: (optional) LatentCache the codes of the encoded images are added to
+        """
+        self.model = model
+        self.cache = cache
+        self.max_batch_images = max_batch_images
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._pending = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._batch_sizes = collections.Counter()
+        self._num_requests = 0
+        self._num_images = 0
+        self._max_queue_depth = 0
+        self._thread = threading.Thread(target=self._run, name='dynamic_batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, image, valence, arousal, key=None, z=None):
+        """
+        Queues an edit request, see EditRequest for the arguments.
+
+        @return: concurrent.futures.Future of the generated images, numpy array of shape [n, size_image, size_image, 3]
+        """
+        request = EditRequest(image, valence, arousal, key, z)
+        self._queue.put(request)
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return request.future
+
+    def _next_batch(self):
+        """
+        @return: list of requests, or None when the batcher is closed
+        """
+        if self._pending is not None:
+            first, self._pending = self._pending, None
+        elif self._closed:
+            return None
+        else:
+            first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        num_images = len(first.valence)
+        deadline = first.arrival + self.max_latency
+        while num_images < self.max_batch_images:
+            try:
+                request = self._queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                self._closed = True
+                break
+            if num_images + len(request.valence) > self.max_batch_images:
+                # starts the next batch
+                self._pending = request
+                break
+            batch.append(request)
+            num_images += len(request.valence)
+        return batch
+
+    def _process(self, batch):
+        missing = [request for request in batch if request.z is None]
+        if missing:
+            for request, z in zip(missing, self.model.encode(np.stack([request.image for request in missing]))):
+                request.z = z
+                if self.cache is not None and request.key is not None:
+                    self.cache.put(request.key, z)
+        counts = [len(request.valence) for request in batch]
+        generated = self.model.generate(np.repeat(np.stack([request.z for request in batch]), counts, axis=0),
+                                        np.concatenate([request.valence for request in batch]),
+                                        np.concatenate([request.arousal for request in batch]))
+        done = time.time()
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._num_requests += len(batch)
+            self._num_images += len(generated)
+            self._latencies.extend(done - request.arrival for request in batch)
+        for request, images in zip(batch, np.split(generated, np.cumsum(counts)[:-1])):
+            request.future.set_result(images)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._process(batch)
+            except Exception as e:
+                log.exception("Batch of %d requests failed", len(batch))
+                for request in batch:
+                    request.future.set_exception(e)
+
+    def stats(self):
+        """
+        @return: dictionary of the current and maximal queue depth, the number of batches,
+                 requests and generated images, the histogram of requests per batch and
+                 p50/p99 of the latency of the recent requests (sec) and the statistics of the cache
+        """
+        with self._lock:
+            latencies = np.asarray(self._latencies)
+            stats = {
+                'queue_depth': self._queue.qsize() + (self._pending is not None),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': sum(self._batch_sizes.values()),
+                'requests': self._num_requests,
+                'generated_images': self._num_images,
+                'batch_size_histogram': dict((str(size), count) for size, count in sorted(self._batch_sizes.items())),
+            }
+        if len(latencies):
+            stats['latency_p50'] = float(np.percentile(latencies, 50))
+            stats['latency_p99'] = float(np.percentile(latencies, 99))
+        if self.cache is not None:
+            stats['latent_cache'] = self.cache.stats()
+        return stats
+
+    def close(self):
+        """
+        Runs the queued requests and stops the batching thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+
+def decode_request(body):
+    """
+    @param body: JSON body of an edit request (bytes)
+
+    @return: content of the image file (bytes), valence, arousal
+    """
+    request = json.loads(body.decode('utf-8'))
+    content = base64.b64decode(request['image'])
+    if request.get('targets'):
+        targets = np.asarray(request['targets'], dtype=np.float32).reshape((-1, 2))
+        valence, arousal = targets[:, :1], targets[:, 1:]
+    else:
+        valence, arousal = emotion_grid()
+    return content, valence, arousal
+
+
+def decode_input(content):
+    """
+    @param content: content of an image file (bytes)
+
+    @return: network input, numpy array of shape [size_image, size_image, 3]
+    """
+    return uint8_to_range(decode_image(io.BytesIO(content), image_size=size_image), image_value_range)
+
+
+def encode_png(image):
+    """
+    @param image: numpy array of shape [size_image, size_image, 3] with pixel values in image_value_range
+
+    @return: base64 encoded PNG file (string)
+    """
+    buffer = io.BytesIO()
+    Image.fromarray(to_uint8(image, image_value_range)).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+class EditHandler(BaseHTTPRequestHandler):
+    """
+    Handles the endpoints /edit and /stats, the batcher and the cache are attributes of the server.
+    """
+    def _reply(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.batcher.stats())
+        else:
+            self._reply(404, {'error': 'unknown endpoint %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/edit':
+            self._reply(404, {'error': 'unknown endpoint %s' % self.path})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            content, valence, arousal = decode_request(body)
+            key = content_key(content)
+            z = self.server.cache.get(key)
+            # a cached face is neither decoded nor encoded
+            image = decode_input(content) if z is None else None
+        except Exception as e:
+            self._reply(400, {'error': 'invalid edit request: %s' % e})
+            return
+        try:
+            images = self.server.batcher.submit(image, valence, arousal, key, z).result()
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, {'images': [encode_png(image) for image in images]})
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class EditServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server handling every connection on its own thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, batcher, cache):
+        HTTPServer.__init__(self, address, EditHandler)
+        self.batcher = batcher
+        self.cache = cache
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local inference server editing faces with a trained model')
+    parser.add_argument('--model_path', default='./checkpoint',
+                        help='checkpoint directory, frozen graph of export.py or quantized models of quantize.py')
+    parser.add_argument('--host', default=server_host)
+    parser.add_argument('--port', type=int, default=server_port)
+    parser.add_argument('--max_batch_images', type=int, default=server_max_batch_images)
+    parser.add_argument('--max_latency', type=float, default=server_max_latency)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    with load_inference_model(args.model_path,
+                              config=session_config(device_strategy, intra_op_threads, inter_op_threads)) as model:
+        cache = LatentCache(model_id(args.model_path), latent_cache_size, latent_cache_dir)
+        batcher = DynamicBatcher(model, args.max_batch_images, args.max_latency, cache=cache)
+        server = EditServer((args.host, args.port), batcher, cache)
+        log.info("Serving %s on http://%s:%d", args.model_path, args.host, args.port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            batcher.close()
+            log.info("Statistics: %s", json.dumps(batcher.stats()))
@@ -5,11 +5,15 @@ Implementations of the subnetworks of the CAAE:
 - Generator
 - Discriminator_Img
 - Discriminator_Z
+
+Inputs and outputs of all subnetworks are NHWC. With data_format='NCHW', the convolutional
+layers run on transposed NCHW tensors, which are transposed back before the dense layers,
+so the variables (and checkpoints) are the same for both layouts.
 """
 import tensorflow as tf
 import numpy as np
 from layers import dense, conv2d, deconv2d, batch_norm
-from config import size_batch, num_z_channels
+from config import num_z_channels, data_format as default_data_format
 
 
 # --HELPERS ---------------------------------------
@@ -25,17 +29,51 @@ def lrelu(inp, leak=0.2):
     return tf.maximum(inp, leak*inp)
 
 
-def concat_label(tensor, label, duplicate=1):
+def to_layout(tensor, data_format):
+    """
+    Transposes an NHWC tensor to data_format.
+
+    @param tensor: input tensor of size [batch_size, x, y, z]
+    @param data_format: 'NHWC' or 'NCHW'
+    """
+    return tf.transpose(tensor, [0, 3, 1, 2]) if data_format == 'NCHW' else tensor
+
+
+def from_layout(tensor, data_format):
+    """
+    Transposes a tensor in data_format to NHWC.
+
+    @param tensor: input tensor of size [batch_size, x, y, z] in data_format
+    @param data_format: 'NHWC' or 'NCHW'
+    """
+    return tf.transpose(tensor, [0, 2, 3, 1]) if data_format == 'NCHW' else tensor
+
+
+def flatten(tensor):
+    """
+    Flattens all dimensions but the batch dimension, which may be unknown.
+
+    @param tensor: input tensor of size [batch_size, x, y, z]
+
+    @return: tensor of size [batch_size, x*y*z]
+    """
+    return tf.reshape(tensor, [-1, int(np.prod(tensor.get_shape().as_list()[1:]))])
+
+
+def concat_label(tensor, label, duplicate=1, data_format='NHWC'):
     """
     Duplicates label and concatenates it to tensor.
     
     @param tensor: input tensor 
                    (1) of size [batch_size, length]
-                   (2) of size [batch_size, x, x, length]
+                   (2) of size [batch_size, x, x, length] (or [batch_size, length, x, x] for NCHW)
     @param label: input tensor of size [batch_size, label_length]
+    @param data_format: layout of a 4-dimensional tensor, 'NHWC' or 'NCHW'
     
     @return: (1) tensor of size [batch_size, length+duplicate*label_length]
-             (2) tensor of size [batch_size, x, x, length+duplicate*label_length]
+             (2) tensor of size [batch_size, x, x, length+duplicate*label_length] (or NCHW)
+
+    The batch size may be unknown when building the graph.
     """ 
     # duplicate the label to enhance its effect
     label = tf.tile(label, [1, duplicate])
@@ -48,11 +86,17 @@ def concat_label(tensor, label, duplicate=1):
     if len(tensor_shape) == 2: return tf.concat([tensor, label], 1)
     
     # CASE (2)
+    if len(tensor_shape) == 4 and data_format == 'NCHW':
+        # scale label to [batch_size, duplicate*label_length, x, x]
+        label = tf.reshape(label, [-1, label_shape[-1], 1, 1])
+        label = tf.tile(label, [1, 1, tensor_shape[2], tensor_shape[3]])
+        return tf.concat([tensor, label], 1)
+
     if len(tensor_shape) == 4:
         # reshape label to [batch_size, 1, 1, duplicate*label_length]
-        label = tf.reshape(label, [tensor_shape[0], 1, 1, label_shape[-1]])
+        label = tf.reshape(label, [-1, 1, 1, label_shape[-1]])
         # scale label to [batch_size, x, x, duplicate*label_length]
-        label = label*tf.ones([tensor_shape[0], tensor_shape[1], tensor_shape[2], label_shape[-1]])
+        label = tf.tile(label, [1, tensor_shape[1], tensor_shape[2], 1])
         # concatenate label and tensor
         return tf.concat([tensor, label], 3)
 
@@ -60,13 +104,14 @@ def concat_label(tensor, label, duplicate=1):
 # --NETWORKS --------------------------------------
 # -------------------------------------------------
 
-def generator(z, valence, arousal, reuse_variables=False):
+def generator(z, valence, arousal, reuse_variables=False, data_format=default_data_format):
     """
     Creates generator network.
     
     @param z: tensor of size config.num_z_channels
     @param valence: tensor of size 1
     @param arousal: tensor of size 1
+    @param data_format: layout of the transposed convolutions, 'NHWC' or 'NCHW'
     
     @return: tensor of size 96x96x3
     """
@@ -84,26 +129,27 @@ def generator(z, valence, arousal, reuse_variables=False):
         current = dense(z, 1024*6*6, reuse=reuse_variables)
         # reshape
         current = tf.reshape(current, [-1, 6, 6, 1024])
-        current = tf.nn.relu(current)
+        current = to_layout(tf.nn.relu(current), data_format)
 
         # -- transposed convolutional layer 1-4
         for index, num_filters in enumerate([512, 256, 128, 64]):
             name = 'G_deconv' + str(index+1)
-            current = deconv2d(current, num_filters, name=name, reuse=reuse_variables)
+            current = deconv2d(current, num_filters, name=name, reuse=reuse_variables, data_format=data_format)
             current = tf.nn.relu(current)
 
         # -- transposed convolutional layer 5+6
-        current = deconv2d(current, 32, stride=1, name='G_deconv5', reuse=reuse_variables)
+        current = deconv2d(current, 32, stride=1, name='G_deconv5', reuse=reuse_variables, data_format=data_format)
         current = tf.nn.relu(current)
 
-        current = deconv2d(current, 3, stride=1,  name='G_deconv6', reuse=reuse_variables)    
-        return tf.nn.tanh(current)
+        current = deconv2d(current, 3, stride=1,  name='G_deconv6', reuse=reuse_variables, data_format=data_format)
+        return tf.nn.tanh(from_layout(current, data_format))
         
-def encoder(current, reuse_variables=False):
+def encoder(current, reuse_variables=False, data_format=default_data_format):
     """
     Creates encoder network.
     
     @param current: tensor of size 96x96x3
+    @param data_format: layout of the convolutions, 'NHWC' or 'NCHW'
     
     @return: tensor of size config.num_z_channels
     """
@@ -111,15 +157,17 @@ def encoder(current, reuse_variables=False):
         tf.get_variable_scope().reuse_variables()
 
     with tf.variable_scope("encoder") as scope:
+
+        current = to_layout(current, data_format)
         
         # -- transposed convolutional layer 1-4
         for index, num_filters in enumerate([64,128,256,512]):
             name = 'E_conv' + str(index)
-            current = conv2d(current, num_filters, name=name, reuse=reuse_variables)
+            current = conv2d(current, num_filters, name=name, reuse=reuse_variables, data_format=data_format)
             current = tf.nn.relu(current)
              
-        # reshape
-        current = tf.reshape(current, [size_batch, -1])
+        # reshape (in NHWC order, independent of data_format)
+        current = flatten(from_layout(current, data_format))
 
         # -- fc layer
         name = 'E_fc'
@@ -127,13 +175,14 @@ def encoder(current, reuse_variables=False):
         return tf.nn.tanh(current)
     
 
-def discriminator_img(current, valence, arousal, reuse_variables=False):
+def discriminator_img(current, valence, arousal, reuse_variables=False, data_format=default_data_format):
     """
     Creates discriminator network on generated image + desired emotion.
 
     @param current: tensor of size 96x96x3
     @param valence: tensor of size 1
     @param arousal: tensor of size 1
+    @param data_format: layout of the convolutions, 'NHWC' or 'NCHW'
 
     @return:  sigmoid(output), output
               (output tensor is of size 1)
@@ -143,25 +192,27 @@ def discriminator_img(current, valence, arousal, reuse_variables=False):
 
     with tf.variable_scope("discriminator_img") as scope:
 
+        current = to_layout(current, data_format)
+
         # -- convolutional blocks (= convolution+batch_norm+relu) 1-4
         for index, num_filters in enumerate([16, 32, 64, 128]):
 
             # convolution
             name = 'D_img_conv' + str(index+1)
-            current = conv2d(current, num_filters, name=name, reuse=reuse_variables)
+            current = conv2d(current, num_filters, name=name, reuse=reuse_variables, data_format=data_format)
 
             # batch normalization
             name = 'D_img_bn' + str(index+1)
-            current = batch_norm(current, name, reuse=reuse_variables)
+            current = batch_norm(current, name, reuse=reuse_variables, data_format=data_format)
             # relu activation
             current = tf.nn.relu(current)
 
             if index==0:
-                current = concat_label(current, valence, 16)
-                current = concat_label(current, arousal, 16)
+                current = concat_label(current, valence, 16, data_format=data_format)
+                current = concat_label(current, arousal, 16, data_format=data_format)
 
-        # reshape
-        current = tf.reshape(current, [size_batch, -1])
+        # reshape (in NHWC order, independent of data_format)
+        current = flatten(from_layout(current, data_format))
 
         # -- fc 1
         name = 'D_img_fc1'
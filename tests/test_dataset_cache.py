@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from dataset_cache import DatasetCache, cache_exists, compile_dataset, IDS_FILE
+
+
+def write_images(data_path, names, size=32):
+    os.makedirs(data_path)
+    for index, name in enumerate(names):
+        # one flat color per image, so that the decoded images can be told apart
+        image = np.full((size, size, 3), index * 40, dtype=np.uint8)
+        Image.fromarray(image).save(os.path.join(data_path, name))
+
+
+def test_compiled_images_and_labels(tmp_path, monkeypatch):
+    # the manifests are saved below the current directory
+    monkeypatch.chdir(tmp_path)
+    data_path = str(tmp_path / 'data')
+    cache_dir = str(tmp_path / 'cache')
+    write_images(data_path, ['0s1s500s-250.png', '1s2s-1000s1000.png', '2s3s-2000s0.png', '3s4s0s250.png'])
+
+    assert compile_dataset(data_path, cache_dir, image_size=8, num_threads=2) == 3
+    assert cache_exists(cache_dir)
+    assert list(np.load(os.path.join(cache_dir, IDS_FILE))) == ['0', '1', '3']
+
+    cache = DatasetCache(cache_dir, image_value_range=(0, 1))
+    assert len(cache) == 3
+    images, valence, arousal = cache.load(np.array([2, 0]))
+    assert images.shape == (2, 8, 8, 3)
+    np.testing.assert_allclose(images[:, 0, 0, 0], [120 / 255., 0.], atol=1e-6)
+    np.testing.assert_allclose(valence[:, 0], [0., 0.5])
+    np.testing.assert_allclose(arousal[:, 0], [0.25, -0.25])
+
+
+def test_cache_without_ids_is_missing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_path = str(tmp_path / 'data')
+    cache_dir = str(tmp_path / 'cache')
+    write_images(data_path, ['0s1s500s-250.png'])
+    compile_dataset(data_path, cache_dir, image_size=8, num_threads=1)
+
+    os.remove(os.path.join(cache_dir, IDS_FILE))
+    assert not cache_exists(cache_dir)
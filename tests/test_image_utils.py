@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from image_utils import emotion_grid_layout, images_to_grid, tile_images
+
+
+def loop_grid(images, size_frame):
+    # the grid assembly tile_images replaced
+    img_h, img_w = images.shape[1], images.shape[2]
+    frame = np.zeros((img_h * size_frame[0], img_w * size_frame[1]) + images.shape[3:], dtype=images.dtype)
+    for ind, image in enumerate(images):
+        ind_col = ind % size_frame[1]
+        ind_row = ind // size_frame[1]
+        frame[(ind_row * img_h):(ind_row * img_h + img_h), (ind_col * img_w):(ind_col * img_w + img_w)] = image
+    return frame
+
+
+@pytest.mark.parametrize('num_images, size_frame, shape', [
+    (49, [7, 7], (5, 4, 3)),
+    (10, [3, 4], (6, 6, 3)),
+    (7, None, (4, 4, 3)),
+    (9, [3, 3], (5, 5)),
+])
+def test_tile_images_matches_loop(num_images, size_frame, shape):
+    images = np.random.RandomState(0).randint(0, 256, (num_images,) + shape).astype(np.uint8)
+    expected_frame = size_frame or [int(np.ceil(np.sqrt(num_images)))] * 2
+    np.testing.assert_array_equal(tile_images(images, size_frame), loop_grid(images, expected_frame))
+
+
+def test_tile_images_into_out():
+    images = np.random.RandomState(0).rand(4, 3, 3, 3).astype(np.float32)
+    out = np.full((6, 6, 3), -1, dtype=np.float32)
+    assert tile_images(images, [2, 2], out=out) is out
+    np.testing.assert_array_equal(out, loop_grid(images, [2, 2]))
+
+    with pytest.raises(ValueError):
+        tile_images(images, [2, 2], out=np.zeros((6, 6, 3), dtype=np.float32).T)
+
+
+def test_emotion_grid_layout():
+    images = np.arange(50, dtype=np.uint8).reshape((50, 1, 1, 1))
+    grid = tile_images(images, layout=emotion_grid_layout())[:, :, 0]
+
+    assert grid.shape == (7, 10)
+    # the input image in the middle row of the margin, the rest of the margin black
+    assert grid[3, 1] == 0
+    assert np.count_nonzero(grid[:, :3]) == 0
+    np.testing.assert_array_equal(grid[:, 3:], np.arange(1, 50).reshape((7, 7)))
+
+
+def test_images_to_grid_converts_to_uint8():
+    images = np.array([-1., 1.], dtype=np.float32).reshape((2, 1, 1, 1)) * np.ones((2, 2, 2, 3), dtype=np.float32)
+    grid = images_to_grid(images, image_value_range=(-1, 1), size_frame=[1, 2])
+    assert grid.dtype == np.uint8
+    np.testing.assert_array_equal(grid[:, :2], 0)
+    np.testing.assert_array_equal(grid[:, 2:], 255)
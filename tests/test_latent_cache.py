@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from latent_cache import LatentCache, content_key
+
+
+class FakeEncoder(object):
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, images):
+        self.encoded.append(len(images))
+        return images.reshape((len(images), -1))[:, :2] * 2
+
+
+def code(value):
+    return np.full(2, value, dtype=np.float32)
+
+
+def test_least_recently_used_code_is_evicted():
+    cache = LatentCache('model', max_entries=2)
+    cache.put('a', code(1))
+    cache.put('b', code(2))
+    # makes b the least recently used entry
+    np.testing.assert_array_equal(cache.get('a'), code(1))
+    cache.put('c', code(3))
+
+    assert cache.get('b') is None
+    np.testing.assert_array_equal(cache.get('a'), code(1))
+    np.testing.assert_array_equal(cache.get('c'), code(3))
+    assert cache.stats() == {'hits': 3, 'disk_hits': 0, 'misses': 1, 'hit_rate': 0.75, 'entries': 2}
+
+
+def test_codes_are_reloaded_from_disk(tmp_path):
+    cache_dir = str(tmp_path)
+    LatentCache('model', max_entries=1, cache_dir=cache_dir).put('a', code(1))
+
+    cache = LatentCache('model', max_entries=1, cache_dir=cache_dir)
+    np.testing.assert_array_equal(cache.get('a'), code(1))
+    # the second lookup is served from memory
+    np.testing.assert_array_equal(cache.get('a'), code(1))
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['disk_hits'] == 1
+
+    # codes of another model are kept apart
+    assert LatentCache('other', cache_dir=cache_dir).get('a') is None
+    assert (tmp_path / 'model' / 'a.npy').exists()
+
+
+def test_encode_only_encodes_missing_images():
+    cache = LatentCache('model')
+    cache.put('b', code(5))
+    images = np.arange(12, dtype=np.float32).reshape((3, 2, 2))
+    requested = []
+
+    def load_images(indices):
+        requested.append(list(indices))
+        return images[indices]
+
+    model = FakeEncoder()
+    codes = cache.encode(model, ['a', 'b', 'c'], load_images)
+
+    assert requested == [[0, 2]]
+    assert model.encoded == [2]
+    np.testing.assert_array_equal(codes, [[0, 2], [5, 5], [16, 18]])
+    np.testing.assert_array_equal(cache.get('c'), [16, 18])
+
+
+def test_content_key():
+    image = np.zeros((2, 3), dtype=np.uint8)
+    assert content_key(image) == content_key(image.copy())
+    # same bytes, different shape
+    assert content_key(image) != content_key(image.reshape((3, 2)))
+    assert content_key(b'abc') != content_key(b'abd')
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from manifest import build_manifest, load_manifest, parse_file_name
+
+
+def touch(data_path, names):
+    for name in names:
+        open(os.path.join(data_path, name), 'wb').close()
+
+
+def test_parse_file_name():
+    assert parse_file_name('1234s5s-750s125.jpg') == ('1234', 5, -0.75, 0.125)
+
+
+def test_build_manifest_drops_invalid_valence(tmp_path):
+    touch(str(tmp_path), ['0s1s500s-250.jpg', '1s2s-2000s-2000.jpg', '2s3s-1000s1000.jpg'])
+    manifest = build_manifest(str(tmp_path))
+
+    assert len(manifest) == 2
+    assert list(manifest.ids) == ['0', '2']
+    assert list(manifest.categories) == [1, 3]
+    np.testing.assert_allclose(manifest.valence[:, 0], [0.5, -1.])
+    np.testing.assert_allclose(manifest.arousal[:, 0], [-0.25, 1.])
+    assert manifest.paths == [os.path.join(str(tmp_path), '0s1s500s-250.jpg'),
+                              os.path.join(str(tmp_path), '2s3s-1000s1000.jpg')]
+
+
+def test_load_manifest_is_rebuilt_when_the_directory_changes(tmp_path):
+    data_path = str(tmp_path / 'data')
+    manifest_dir = str(tmp_path / 'manifests')
+    os.makedirs(data_path)
+    touch(data_path, ['0s1s500s-250.jpg'])
+    os.utime(data_path, (1000000, 1000000))
+
+    assert list(load_manifest(data_path, manifest_dir).ids) == ['0']
+    assert len(os.listdir(manifest_dir)) == 1
+
+    # a new file with the old modification time of the directory: the saved manifest is used
+    touch(data_path, ['1s2s0s0.jpg'])
+    os.utime(data_path, (1000000, 1000000))
+    assert list(load_manifest(data_path, manifest_dir).ids) == ['0']
+
+    # a new modification time: the manifest is rebuilt and saved again
+    os.utime(data_path, (2000000, 2000000))
+    assert list(load_manifest(data_path, manifest_dir).ids) == ['0', '1']
+    os.remove(os.path.join(data_path, '1s2s0s0.jpg'))
+    os.utime(data_path, (2000000, 2000000))
+    assert list(load_manifest(data_path, manifest_dir).ids) == ['0', '1']
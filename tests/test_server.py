@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from server import DynamicBatcher
+
+
+class FakeModel(object):
+    """
+    Encodes an image to its mean and generates z + valence + 10 * arousal, recording the batch sizes.
+    """
+    def __init__(self):
+        self.encoded = []
+        self.generated = []
+
+    def encode(self, images):
+        self.encoded.append(len(images))
+        return images.reshape((len(images), -1)).mean(axis=1, keepdims=True)
+
+    def generate(self, z, valence, arousal):
+        self.generated.append(len(z))
+        return z + valence + 10 * arousal
+
+
+def labels(*values):
+    values = np.asarray(values, dtype=np.float32).reshape((-1, 1))
+    return values, -values
+
+
+def test_concurrent_requests_form_one_batch():
+    model = FakeModel()
+    batcher = DynamicBatcher(model, max_batch_images=10, max_latency=0.5)
+    images = [np.full((2, 2, 3), value, dtype=np.float32) for value in [1., 2., 3.]]
+    futures = [batcher.submit(images[0], *labels(0.5)),
+               batcher.submit(images[1], *labels(0.1, 0.2)),
+               batcher.submit(images[2], *labels(-0.5, 0., 0.5))]
+    results = [future.result(timeout=5) for future in futures]
+    batcher.close()
+
+    assert model.encoded == [3]
+    assert model.generated == [6]
+    np.testing.assert_allclose(results[0], [[1. - 4.5]])
+    np.testing.assert_allclose(results[1], [[2. - 0.9], [2. - 1.8]])
+    np.testing.assert_allclose(results[2], [[3. + 4.5], [3.], [3. - 4.5]])
+
+    stats = batcher.stats()
+    assert stats['batches'] == 1
+    assert stats['requests'] == 3
+    assert stats['generated_images'] == 6
+    assert stats['batch_size_histogram'] == {'3': 1}
+    assert stats['queue_depth'] == 0
+
+
+def test_lone_request_is_flushed_after_max_latency():
+    model = FakeModel()
+    batcher = DynamicBatcher(model, max_batch_images=10, max_latency=0.1)
+    start = time.time()
+    result = batcher.submit(np.ones((2, 2, 3), dtype=np.float32), *labels(0.)).result(timeout=5)
+    elapsed = time.time() - start
+    batcher.close()
+
+    np.testing.assert_allclose(result, [[1.]])
+    assert 0.09 <= elapsed < 2.
+    assert batcher.stats()['batch_size_histogram'] == {'1': 1}
+
+
+def test_request_exceeding_the_batch_starts_the_next_batch():
+    model = FakeModel()
+    batcher = DynamicBatcher(model, max_batch_images=4, max_latency=0.2)
+    image = np.zeros((2, 2, 3), dtype=np.float32)
+    futures = [batcher.submit(image, *labels(0., 0., 0.)), batcher.submit(image, *labels(0., 0.))]
+    assert [len(future.result(timeout=5)) for future in futures] == [3, 2]
+    batcher.close()
+
+    assert model.generated == [3, 2]
+    assert batcher.stats()['batch_size_histogram'] == {'1': 2}
+
+
+def test_cached_codes_skip_the_encoder():
+    model = FakeModel()
+    batcher = DynamicBatcher(model, max_batch_images=10, max_latency=0.1)
+    result = batcher.submit(None, *labels(0., 0.), z=np.array([7.], dtype=np.float32)).result(timeout=5)
+    batcher.close()
+
+    assert model.encoded == []
+    np.testing.assert_allclose(result, [[7.], [7.]])
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from trajectory import keyframe_path, parse_points, polyline_path, render_trajectory
+
+
+def test_polyline_path():
+    valence, arousal = polyline_path([[0., 0.], [0.5, 0.], [0.5, 1.]], 7)
+
+    assert valence.shape == arousal.shape == (7, 1)
+    assert (valence[0, 0], arousal[0, 0]) == (0., 0.)
+    assert (valence[-1, 0], arousal[-1, 0]) == (0.5, 1.)
+    # constant speed along a polyline of length 1.5
+    steps = np.sqrt(np.square(np.diff(valence[:, 0])) + np.square(np.diff(arousal[:, 0])))
+    np.testing.assert_allclose(steps, 0.25, atol=1e-6)
+
+
+def test_keyframe_path():
+    valence, arousal = keyframe_path([[10, 0., 0.], [14, 1., -1.], [16, 0., 0.]])
+
+    assert valence.shape == arousal.shape == (7, 1)
+    np.testing.assert_allclose(valence[:, 0], [0., 0.25, 0.5, 0.75, 1., 0.5, 0.])
+    np.testing.assert_allclose(arousal[:, 0], -valence[:, 0])
+
+    with pytest.raises(ValueError):
+        keyframe_path([[0, 0., 0.], [0, 1., 1.]])
+
+
+def test_parse_points():
+    assert parse_points("0:0,0;100:0.75,-0.5;", 3) == [[0., 0., 0.], [100., 0.75, -0.5]]
+    with pytest.raises(ValueError):
+        parse_points("0,0;1", 2)
+
+
+class ListWriter(object):
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, frames):
+        self.chunks.append(frames)
+
+
+class FakeModel(object):
+    def encode(self, images):
+        return np.zeros((len(images), 1), dtype=np.float32)
+
+    def generate(self, z, valence, arousal):
+        assert len(z) == len(valence) == len(arousal)
+        return np.broadcast_to((z + valence)[:, :, np.newaxis, np.newaxis], (len(z), 2, 2, 3))
+
+
+def test_render_trajectory_in_chunks():
+    valence, arousal = polyline_path([[-1., 0.], [1., 0.]], 5)
+    writer = ListWriter()
+    render_trajectory(FakeModel(), np.zeros((2, 2, 3), dtype=np.float32), valence, arousal, writer, chunk_size=2)
+
+    assert [len(chunk) for chunk in writer.chunks] == [2, 2, 1]
+    frames = np.concatenate(writer.chunks)
+    assert frames.dtype == np.uint8
+    assert frames[0, 0, 0, 0] == 0 and frames[-1, 0, 0, 0] == 255
@@ -0,0 +1,108 @@
+"""
+Data parallel training with several towers in one graph.
+
+Each tower holds a replica of encoder, generator, discriminators and VGG loss on its own
+device and processes a slice of the batch; all towers share the variables. The gradients
+of the towers are averaged, weighted by the size of their slice, so that the update equals
+that of the whole batch on one device (up to the batch normalization statistics, which
+are computed per tower). The devices of the towers are GPUs or, on CPU-only hosts,
+logical CPU devices created with session_config(num_cpu_devices=...). These are no real
+partitions: all CPU devices of a process share one intra-op thread pool, and the towers
+only run concurrently on the threads of the inter-op pool, which session_config raises
+to at least the number of towers.
+"""
+import contextlib
+
+import tensorflow as tf
+
+
+def tower_devices(device, num_towers):
+    """
+    @param device: device of the first tower, e.g. '/device:GPU:0' (string)
+    @param num_towers: number of towers (int)
+
+    @return: devices of the towers, e.g. ['/device:GPU:0', '/device:GPU:1'] (list of strings)
+    """
+    device_type = device.rsplit(':', 1)[0]
+    return ['%s:%d' % (device_type, index) for index in range(num_towers)]
+
+
+@contextlib.contextmanager
+def tower_scope(index, device, num_towers):
+    """
+    Places the ops of tower index on device, in the name scope tower_<index> if there is more than one tower.
+    """
+    with tf.device(device):
+        if num_towers == 1:
+            yield
+        else:
+            with tf.name_scope('tower_%d' % index):
+                yield
+
+
+def split_batch(tensors, num_towers):
+    """
+    Splits tensors of the same (possibly unknown) batch size into num_towers slices of
+    nearly equal size, the batch size does not need to be divisible by num_towers.
+
+    @param tensors: list of tensors of size [batch_size, ...]
+    @param num_towers: number of towers (int)
+
+    @return: list of the slices of tensors for each tower, and the weight (fraction of the
+             batch) of each tower as float32 scalar tensors, or None for a single tower
+    """
+    if num_towers == 1:
+        return [tensors], None
+    batch_size = tf.shape(tensors[0])[0]
+    bounds = [batch_size * index // num_towers for index in range(num_towers + 1)]
+    slices = [[tensor[bounds[index]:bounds[index + 1]] for tensor in tensors] for index in range(num_towers)]
+    weights = [tf.cast(bounds[index + 1] - bounds[index], tf.float32) / tf.cast(batch_size, tf.float32)
+               for index in range(num_towers)]
+    return slices, weights
+
+
+def combine_batch(tensors):
+    """
+    @param tensors: tensors of the towers of size [tower_batch_size, ...]
+
+    @return: tensor of the whole batch
+    """
+    return tensors[0] if len(tensors) == 1 else tf.concat(tensors, axis=0)
+
+
+def combine_losses(losses, weights):
+    """
+    @param losses: scalar losses of the towers
+    @param weights: weights of the towers returned by split_batch
+
+    @return: loss of the whole batch
+    """
+    return losses[0] if len(losses) == 1 else tf.add_n([weight * loss for weight, loss in zip(weights, losses)])
+
+
+def tower_gradients(optimizer, losses, var_list, devices, weights):
+    """
+    Computes the gradients of the loss of each tower on its device and averages them.
+
+    @param optimizer: tf.train.Optimizer
+    @param losses: scalar losses of the towers
+    @param var_list: variables to compute the gradients for
+    @param devices: devices of the towers
+    @param weights: weights of the towers returned by split_batch
+
+    @return: list of (gradient, variable) pairs for optimizer.apply_gradients
+    """
+    if len(losses) == 1:
+        return optimizer.compute_gradients(losses[0], var_list=var_list)
+
+    gradients = []
+    for loss, device in zip(losses, devices):
+        with tf.device(device):
+            gradients.append(optimizer.compute_gradients(loss, var_list=var_list, colocate_gradients_with_ops=True))
+
+    averaged = []
+    for grads_and_vars in zip(*gradients):
+        variable = grads_and_vars[0][1]
+        grads = [weight * grad for (grad, _), weight in zip(grads_and_vars, weights) if grad is not None]
+        averaged.append((tf.add_n(grads) if grads else None, variable))
+    return averaged
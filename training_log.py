@@ -0,0 +1,88 @@
+"""
+Logging of the training.
+
+AsyncLog routes the records of all loggers through a queue to a background thread, which
+writes them to the console and to a log file, so that neither console nor disk I/O happens
+in the training loop. The log file is written in blocks of buffered records and rotated
+when it exceeds a maximal size.
+
+Records logged with extra={'step': step} (e.g. the losses of each training step) are
+printed to the console only every console_interval steps, but always written to the file.
+Warnings and errors are always printed and flush the buffer immediately.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+
+
+class StepThrottle(logging.Filter):
+    """
+    Passes the records of every interval-th step and all records without step.
+    """
+    def __init__(self, interval=1):
+        """
+        @param interval: number of steps between two passed step records (int)
+        """
+        super(StepThrottle, self).__init__()
+        self.interval = max(int(interval), 1)
+
+    def filter(self, record):
+        step = getattr(record, 'step', None)
+        return step is None or record.levelno >= logging.WARNING or step % self.interval == 0
+
+
+class AsyncLog(object):
+    """
+    Queue-backed logging to the console and a size-rotated log file.
+    """
+    def __init__(self, log_file='logfile.txt', level='INFO', console_interval=1,
+                 max_bytes=10 * 1024 * 1024, backup_count=5, buffer_records=100):
+        """
+        @param log_file: path of the log file (string)
+        @param level: minimal level of logged records (string or int)
+        @param console_interval: number of training steps between two step records on the console (int)
+        @param max_bytes: size of the log file at which it is rotated (int)
+        @param backup_count: number of rotated log files kept (int)
+        @param buffer_records: number of records buffered before they are written to the log file (int)
+        """
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter('%(message)s'))
+        console.addFilter(StepThrottle(console_interval))
+
+        self.file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=max_bytes,
+            backupCount=backup_count
+        )
+        self.file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        self.buffer = logging.handlers.MemoryHandler(
+            capacity=buffer_records,
+            flushLevel=logging.WARNING,
+            target=self.file_handler
+        )
+
+        self.queue_handler = logging.handlers.QueueHandler(queue.Queue(-1))
+        self.listener = logging.handlers.QueueListener(self.queue_handler.queue, console, self.buffer)
+
+        # replace the handlers of the root logger (e.g. the one installed by tf.app.run),
+        # which would write every record once more in the calling thread
+        root = logging.getLogger()
+        self._previous_handlers = root.handlers[:]
+        for handler in self._previous_handlers:
+            root.removeHandler(handler)
+        root.setLevel(level)
+        root.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def close(self):
+        """
+        Writes all queued and buffered records and closes the log file.
+        """
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        for handler in self._previous_handlers:
+            root.addHandler(handler)
+        self.listener.stop()
+        self.buffer.close()
+        self.file_handler.close()
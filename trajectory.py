@@ -0,0 +1,204 @@
+"""
+Rendering of a face along a path through valence/arousal space into a frame sequence.
+
+The path is either a polyline, traversed at constant speed in num_frames frames, or
+keyframes (frame index, valence, arousal) with linear interpolation between them. The
+face is encoded once, then the frames are generated in chunks of chunk_size labels, so
+the memory stays bounded for any number of frames, and every chunk is handed to a writer
+as soon as it is generated:
+
+- ImageSequenceWriter saves one PNG file per frame, on a thread pool
+- RawVideoWriter appends the frames as raw RGB24 video to a file or stdout, e.g.
+  python trajectory.py ... --output - | ffmpeg -f rawvideo -pixel_format rgb24 -video_size 96x96 -framerate 25 -i - out.mp4
+
+    python trajectory.py --image face.jpg --polyline "0.75,0.75;0,0;-0.75,-0.75" --frames 250 --output ./frames/
+    python trajectory.py --image face.jpg --keyframes "0:0,0;100:0.75,0.75;250:0,0" --output trajectory.rgb
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import image_value_range, size_image, size_batch, device_strategy, intra_op_threads, inter_op_threads, \
+    latent_cache_size, latent_cache_dir
+from devices import session_config
+from image_decode import load_images
+from image_utils import save_image, to_uint8
+from inference import load_inference_model
+from latent_cache import LatentCache, content_key, model_id
+
+
+def polyline_path(points, num_frames):
+    """
+    Labels of num_frames frames at equal distances along a polyline, from its first to its last point.
+
+    @param points: (valence, arousal) points of the polyline (list of pairs)
+    @param num_frames: number of frames (int)
+
+    @return: valence, arousal: numpy arrays of shape [num_frames, 1]
+    """
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+    # arc length at every point of the polyline
+    lengths = np.concatenate([[0.], np.cumsum(np.sqrt(np.sum(np.square(np.diff(points, axis=0)), axis=1)))])
+    positions = np.linspace(0., lengths[-1], num_frames)
+    valence = np.interp(positions, lengths, points[:, 0])
+    arousal = np.interp(positions, lengths, points[:, 1])
+    return valence.astype(np.float32).reshape((-1, 1)), arousal.astype(np.float32).reshape((-1, 1))
+
+
+def keyframe_path(keyframes):
+    """
+    Labels of the frames from the first to the last keyframe, interpolated linearly between the keyframes.
+
+    @param keyframes: (frame index, valence, arousal) with increasing frame indices (list of triples)
+
+    @return: valence, arousal: numpy arrays of shape [last frame index - first frame index + 1, 1]
+    """
+    keyframes = np.asarray(keyframes, dtype=np.float64).reshape((-1, 3))
+    if np.any(np.diff(keyframes[:, 0]) <= 0):
+        raise ValueError("The frame indices of the keyframes have to be increasing")
+    frames = np.arange(keyframes[0, 0], keyframes[-1, 0] + 1)
+    valence = np.interp(frames, keyframes[:, 0], keyframes[:, 1])
+    arousal = np.interp(frames, keyframes[:, 0], keyframes[:, 2])
+    return valence.astype(np.float32).reshape((-1, 1)), arousal.astype(np.float32).reshape((-1, 1))
+
+
+class ImageSequenceWriter(object):
+    """
+    Saves frames as numbered PNG files, on a thread pool.
+    """
+    def __init__(self, directory, pattern='%06d.png', num_threads=4):
+        """
+        @param directory: directory to save the frames to, created if it does not exist (string)
+        @param pattern: file name of a frame for its index (string)
+        @param num_threads: number of threads saving the frames (int)
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.pattern = pattern
+        self.num_frames = 0
+        self._pool = ThreadPoolExecutor(max_workers=num_threads)
+        self._pending = []
+
+    def write(self, frames):
+        """
+        @param frames: uint8 numpy array of shape [n, size_image, size_image, 3]
+        """
+        for frame in frames:
+            path = os.path.join(self.directory, self.pattern % self.num_frames)
+            self._pending.append(self._pool.submit(save_image, frame, path))
+            self.num_frames += 1
+        # limit the number of frames waiting to be saved
+        while len(self._pending) > 2 * len(frames):
+            self._pending.pop(0).result()
+
+    def close(self):
+        for pending in self._pending:
+            pending.result()
+        self._pool.shutdown()
+
+
+class RawVideoWriter(object):
+    """
+    Appends frames as raw video (rgb24, one frame after the other without header) to a file or stdout.
+    """
+    def __init__(self, path):
+        """
+        @param path: path of the video file, or '-' for stdout (string)
+        """
+        self._file = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        self.num_frames = 0
+
+    def write(self, frames):
+        """
+        @param frames: uint8 numpy array of shape [n, size_image, size_image, 3]
+        """
+        self._file.write(np.ascontiguousarray(frames).tobytes())
+        self._file.flush()
+        self.num_frames += len(frames)
+
+    def close(self):
+        if self._file is not sys.stdout.buffer:
+            self._file.close()
+
+
+def render_trajectory(model, image, valence, arousal, writer, chunk_size=size_batch, z=None):
+    """
+    Encodes image once and generates and writes the frames of the path in chunks.
+
+    @param model: model providing encode() and generate()
+    @param image: numpy array of shape [size_image, size_image, 3]
+    @param valence: labels of the frames, numpy array of shape [num_frames, 1]
+    @param arousal: labels of the frames, numpy array of shape [num_frames, 1]
+    @param writer: ImageSequenceWriter, RawVideoWriter or any object with write(uint8 frames)
+    @param chunk_size: number of frames generated per run (int)
+    @param z: (optional) code of image, e.g. from a LatentCache, skips the encoder
+    """
+    if z is None:
+        z = model.encode(image[np.newaxis])[0]
+    z_chunk = np.repeat(z[np.newaxis], chunk_size, axis=0)
+    for start in range(0, len(valence), chunk_size):
+        chunk_valence = valence[start:start + chunk_size]
+        chunk_arousal = arousal[start:start + chunk_size]
+        frames = model.generate(z_chunk[:len(chunk_valence)], chunk_valence, chunk_arousal)
+        writer.write(to_uint8(frames, image_value_range))
+
+
+def parse_points(text, size):
+    """
+    @param text: points separated by ';', their values by ',' or ':', e.g. "0:0,0;100:0.75,0.75" (string)
+    @param size: number of values of a point (int)
+
+    @return: list of points
+    """
+    points = [[float(value) for value in point.replace(':', ',').split(',')] for point in text.split(';') if point]
+    if any(len(point) != size for point in points):
+        raise ValueError("Expected %d values per point in '%s'" % (size, text))
+    return points
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Renders a face along a path through valence/arousal space')
+    parser.add_argument('--image', required=True, help='image of the face')
+    parser.add_argument('--model_path', default='./checkpoint',
+                        help='checkpoint directory, frozen graph of export.py or quantized models of quantize.py')
+    path = parser.add_mutually_exclusive_group(required=True)
+    path.add_argument('--polyline', help='points "valence,arousal;valence,arousal;..." traversed at constant speed')
+    path.add_argument('--keyframes', help='keyframes "frame:valence,arousal;frame:valence,arousal;..."')
+    parser.add_argument('--frames', type=int, default=250, help='number of frames along the polyline')
+    parser.add_argument('--chunk_size', type=int, default=size_batch, help='number of frames generated per run')
+    parser.add_argument('--output', required=True,
+                        help='directory of the PNG sequence, raw rgb24 video file (.rgb/.raw) or - for stdout')
+    args = parser.parse_args()
+
+    if args.polyline:
+        valence, arousal = polyline_path(parse_points(args.polyline, 2), args.frames)
+    else:
+        valence, arousal = keyframe_path(parse_points(args.keyframes, 3))
+
+    if args.output == '-' or os.path.splitext(args.output)[1] in ('.rgb', '.raw'):
+        writer = RawVideoWriter(args.output)
+    else:
+        writer = ImageSequenceWriter(args.output)
+
+    with open(args.image, 'rb') as f:
+        key = content_key(f.read())
+    image = load_images([args.image], image_size=size_image, image_value_range=image_value_range)[0]
+    cache = LatentCache(model_id(args.model_path), latent_cache_size, latent_cache_dir)
+
+    with load_inference_model(args.model_path,
+                              config=session_config(device_strategy, intra_op_threads, inter_op_threads)) as model:
+        z = cache.get(key)
+        if z is None:
+            z = model.encode(image[np.newaxis])[0]
+            cache.put(key, z)
+        try:
+            render_trajectory(model, image, valence, arousal, writer, args.chunk_size, z=z)
+        finally:
+            writer.close()
+
+    sys.stderr.write("Rendered %d frames of %dx%d to %s\n" % (writer.num_frames, size_image, size_image, args.output))
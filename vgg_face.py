@@ -2,71 +2,177 @@
 Code for loading the VGG face model and computing the identity preserving loss.
 
 This code is inherited from the official implementation of ExprGan (https://arxiv.org/abs/1709.03842).
+
+Only the layers up to conv5_2 are used. Run this script once to convert the MatConvNet
+file vgg-face.mat into a compact npz file of these layers. The weights are held in
+non-trainable variables in the scope vgg_face, which are shared by all calls of
+face_embedding and filled from the npz file by load_vgg_weights.
+
+The VGG face model expects 224x224 inputs. face_embedding can instead run the network at
+the native 96x96 resolution of the images or any other input size, which saves most
+of the convolution FLOPs (see benchmarks/vgg_loss.py).
 """
 import numpy as np
 import tensorflow as tf
 
-def face_embedding(vgg_weights, images):
+# layers of the VGG face model up to conv5_2: (name, type, kernel shape)
+VGG_LAYERS = [
+    ('conv1_1', 'conv', [3, 3, 3, 64]), ('relu1_1', 'relu', None),
+    ('conv1_2', 'conv', [3, 3, 64, 64]), ('relu1_2', 'relu', None),
+    ('pool1', 'pool', None),
+    ('conv2_1', 'conv', [3, 3, 64, 128]), ('relu2_1', 'relu', None),
+    ('conv2_2', 'conv', [3, 3, 128, 128]), ('relu2_2', 'relu', None),
+    ('pool2', 'pool', None),
+    ('conv3_1', 'conv', [3, 3, 128, 256]), ('relu3_1', 'relu', None),
+    ('conv3_2', 'conv', [3, 3, 256, 256]), ('relu3_2', 'relu', None),
+    ('conv3_3', 'conv', [3, 3, 256, 256]), ('relu3_3', 'relu', None),
+    ('pool3', 'pool', None),
+    ('conv4_1', 'conv', [3, 3, 256, 512]), ('relu4_1', 'relu', None),
+    ('conv4_2', 'conv', [3, 3, 512, 512]), ('relu4_2', 'relu', None),
+    ('conv4_3', 'conv', [3, 3, 512, 512]), ('relu4_3', 'relu', None),
+    ('pool4', 'pool', None),
+    ('conv5_1', 'conv', [3, 3, 512, 512]), ('relu5_1', 'relu', None),
+    ('conv5_2', 'conv', [3, 3, 512, 512]),
+]
+
+# input size and mean pixel value of the VGG face model
+VGG_IMAGE_SIZE = 224
+VGG_MEAN = [129.1863, 104.7624, 93.5940]
+
+
+def face_embedding(images, input_size=VGG_IMAGE_SIZE):
     """
     Computes the activations for the layers conv1_2, conv2_2, conv3_2, conv4_2, conv5_2
-    of the VGG face model with the vgg_weights with images as input.
-    
-    @param vgg_weights:pre-trained weights of VGG model loaded from a mat file
-    
+    of the VGG face model with images as input.
+
     @param images: tensor of size [batch_size, 96, 96, 3]
+    @param input_size: width and height the images are resized to before the VGG network (int)
     """
     images = (images+1)/2 * 255
-    net = vgg_face(vgg_weights, images)
+    net = vgg_face(images, input_size=input_size)
     return net['conv1_2'], net['conv2_2'], net['conv3_2'], net['conv4_2'], net['conv5_2']
 
-    
-def vgg_face(data, input_maps):
+
+def feature_map_sizes(input_size=VGG_IMAGE_SIZE):
     """
-    Creates VGG model for face identification from given weights.
-    
-    @param data: pre-trained weights of VGG model loaded from a mat file
-    @return: VGG network with data weights
+    @param input_size: width and height of the VGG input (int)
+
+    @return: widths of the activations of conv1_2, conv2_2, conv3_2, conv4_2, conv5_2
     """
-    # read meta info
-    meta = data['meta']
-    classes = meta['classes']
-    class_names = classes[0][0]['description'][0][0]
-    normalization = meta['normalization']
-    average_image = np.squeeze(normalization[0][0]['averageImage'][0][0][0][0])
-    image_size = np.squeeze(normalization[0][0]['imageSize'][0][0])
-    input_maps = tf.image.resize_images(input_maps, size=[image_size[0], image_size[1]])
-
-    # read layer info
-    layers = data['layers']
-    current = input_maps - np.array([129.1863, 104.7624, 93.5940]).reshape((1, 1, 1, 3))
-    network = {}
-    for layer in layers[0]:
-        name = layer[0]['name'][0][0]
+    return [int(np.ceil(input_size / 2. ** k)) for k in range(5)]
+
+
+def identity_loss(real_images, fake_images, input_size=VGG_IMAGE_SIZE):
+    """
+    Identity preserving loss: the mean absolute difference of the VGG activations of
+    real and generated images in the layers conv1_2, conv2_2, conv3_2, conv4_2, conv5_2.
+
+    Real and generated images pass the VGG face network as a single batch, no gradient flows
+    through the real half. Each layer's difference is divided by the squared width of that
+    layer for a 224x224 input, for every input_size, so that the loss values of all input
+    sizes are on the same scale.
+
+    @param real_images: tensor of size [batch_size, 96, 96, 3]
+    @param fake_images: tensor of size [batch_size, 96, 96, 3]
+    @param input_size: width and height the images are resized to before the VGG network (int)
+
+    @return: scalar tensor
+    """
+    vgg_input = tf.concat([tf.stop_gradient(real_images), fake_images], axis=0)
+    loss = 0.
+    for layer, size in zip(face_embedding(vgg_input, input_size=input_size), feature_map_sizes(VGG_IMAGE_SIZE)):
+        real, fake = tf.split(layer, 2, axis=0)
+        # reduced in float32 for float16 activations
+        loss += tf.reduce_mean(tf.cast(tf.abs(real - fake), tf.float32)) / size / size
+    return loss
+
+
+def vgg_face(input_maps, input_size=VGG_IMAGE_SIZE):
+    """
+    Creates VGG model for face identification up to layer conv5_2.
+
+    The weights are created as non-trainable variables on the first call and shared by
+    all further calls, they have to be filled with load_vgg_weights. The network computes
+    in the dtype of input_maps (e.g. float16), the variables are always float32.
+
+    @param input_maps: tensor of size [batch_size, x, x, 3] with pixel values in [0, 255]
+    @param input_size: width and height the input is resized to (int)
+
+    @return: dictionary of the activations of each layer
+    """
+    dtype = input_maps.dtype.base_dtype
+    if input_maps.get_shape().as_list()[1:3] != [input_size, input_size]:
+        # the resized images are float32
+        input_maps = tf.cast(tf.image.resize_images(input_maps, size=[input_size, input_size]), dtype)
 
-        if name == 'relu6' or name == 'fc6' or name == 'fc7' or name == 'relu7' or name == 'fc8' or name == 'prob' or name == 'pool5':
-            continue
-        else:
-            layer_type = layer[0]['type'][0][0]
+    current = input_maps - tf.constant(np.array(VGG_MEAN).reshape((1, 1, 1, 3)), dtype=dtype)
+    network = {}
+    with tf.variable_scope('vgg_face', reuse=tf.AUTO_REUSE):
+        for name, layer_type, shape in VGG_LAYERS:
             if layer_type == 'conv':
-                if name[:2] == 'fc':
-                    padding = 'VALID'
-                else:
-                    padding = 'SAME'
-                stride = layer[0]['stride'][0][0]
-                kernel, bias = layer[0]['weights'][0][0]
-                bias = np.squeeze(bias).reshape(-1)
-                conv = tf.nn.conv2d(current, tf.constant(kernel),
-                                    strides=(1, stride[0], stride[0], 1), padding=padding)
+                with tf.variable_scope(name):
+                    kernel = tf.get_variable('kernel', shape, tf.float32, initializer=tf.zeros_initializer(), trainable=False)
+                    bias = tf.get_variable('bias', shape[-1:], tf.float32, initializer=tf.zeros_initializer(), trainable=False)
+                    if dtype != tf.float32:
+                        kernel, bias = tf.cast(kernel, dtype), tf.cast(bias, dtype)
+                conv = tf.nn.conv2d(current, kernel, strides=(1, 1, 1, 1), padding='SAME')
                 current = tf.nn.bias_add(conv, bias)
             elif layer_type == 'relu':
                 current = tf.nn.relu(current)
             elif layer_type == 'pool':
-                stride = layer[0]['stride'][0][0]
-                pool = layer[0]['pool'][0][0]
-                current = tf.nn.max_pool(current, ksize=(1, pool[0], pool[1], 1),
-                                         strides=(1, stride[0], stride[0], 1), padding='SAME')
-            elif layer_type == 'softmax':
-                current = tf.nn.softmax(tf.reshape(current, [-1, len(class_names)]))
-
-        network[name] = current
-    return network
\ No newline at end of file
+                current = tf.nn.max_pool(current, ksize=(1, 2, 2, 1), strides=(1, 2, 2, 1), padding='SAME')
+            network[name] = current
+    return network
+
+
+def vgg_variables():
+    """
+    @return: list of the variables holding the VGG face weights
+    """
+    return tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='vgg_face/')
+
+
+def load_vgg_weights(session, path):
+    """
+    Fills the VGG face variables with the weights of the npz file written by convert_vgg_weights.
+
+    @param session: tensorflow session
+    @param path: path to the npz file (string)
+    """
+    with np.load(path) as weights:
+        for var in vgg_variables():
+            layer_name, weight_name = var.op.name.split('/')[-2:]
+            var.load(weights[layer_name + '_' + weight_name], session)
+
+
+def convert_vgg_weights(mat_path, npz_path):
+    """
+    Extracts the weights of the layers up to conv5_2 from the MatConvNet file of the
+    VGG face model and saves them to a npz file.
+
+    @param mat_path: path to vgg-face.mat (string)
+    @param npz_path: path to save the npz file to (string)
+    """
+    from scipy.io import loadmat
+
+    data = loadmat(mat_path)
+    image_size = np.squeeze(data['meta']['normalization'][0][0]['imageSize'][0][0])
+    assert image_size[0] == VGG_IMAGE_SIZE, 'unexpected VGG input size %d' % image_size[0]
+
+    shapes = dict((name, shape) for name, layer_type, shape in VGG_LAYERS if layer_type == 'conv')
+    weights = {}
+    for layer in data['layers'][0]:
+        name = layer[0]['name'][0][0]
+        if name in shapes:
+            kernel, bias = layer[0]['weights'][0][0]
+            weights[name + '_kernel'] = np.asarray(kernel, dtype=np.float32).reshape(shapes[name])
+            weights[name + '_bias'] = np.squeeze(bias).reshape(-1).astype(np.float32)
+    np.savez(npz_path, **weights)
+
+
+if __name__ == '__main__':
+
+    from config import vgg_face_path, vgg_face_mat_path
+
+    convert_vgg_weights(vgg_face_mat_path, vgg_face_path)
+    print("Converted %s to %s" % (vgg_face_mat_path, vgg_face_path))